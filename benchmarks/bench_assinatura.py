@@ -0,0 +1,73 @@
+"""Benchmark da detecção do bloco 9 / assinatura em ler_e_separar_sped.
+
+Compara a varredura antiga (para cada linha |9, re-varre linhas[i+1:]) com
+modules.leitor.localizar_inicio_assinatura (uma única passada de trás para frente).
+
+Uso (na raiz do projeto):
+    python benchmarks/bench_assinatura.py [qtd_registros_9900]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.leitor import localizar_inicio_assinatura
+
+
+def localizar_inicio_assinatura_antigo(linhas):
+    """Algoritmo original de ler_e_separar_sped (mantido aqui apenas para comparação)."""
+    for i, linha in enumerate(linhas):
+        if linha.startswith("|9") and len(linha.split('|')) > 2 and linha.split('|')[1].startswith('9'):
+            is_last_block = True
+            for next_line in linhas[i+1:]:
+                if next_line.startswith('|') and not next_line.startswith('|9'):
+                    is_last_block = False
+                    break
+            if is_last_block:
+                return i
+    return None
+
+
+def montar_linhas(qtd_corpo, qtd_9900, registro_final=None):
+    """Monta um SPED sintético: corpo + bloco 9 com `qtd_9900` linhas |9900|.
+
+    Se `registro_final` for informado, ele é colocado após o bloco 9 (caso em
+    que o algoritmo antigo re-varre o bloco 9 inteiro para cada linha dele).
+    """
+    linhas = ["|0000|017|0|01012024|31012024|EMPRESA|12345678000199||SP|1|3550308|||A|1|"]
+    linhas += [f"|C170|{i}|ITEM{i}|DESC|1|UN|10,00|0|0|000|5102||10,00|18,00|1,80|" for i in range(qtd_corpo)]
+    linhas.append("|9001|0|")
+    linhas += [f"|9900|R{i:03d}|{i}|" for i in range(qtd_9900)]
+    linhas.append(f"|9990|{qtd_9900 + 3}|")
+    linhas.append(f"|9999|{qtd_corpo + qtd_9900 + 4}|")
+    if registro_final:
+        linhas.append(registro_final)
+    linhas.append("SBRCAAEPDR...ASSINATURA-DIGITAL...")
+    return linhas
+
+
+def cronometrar(funcao, linhas, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        resultado = funcao(linhas)
+    return (time.perf_counter() - inicio) / repeticoes, resultado
+
+
+def main():
+    qtd_9900 = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    cenarios = [
+        ("Bloco 9 normal no final", montar_linhas(200_000, qtd_9900)),
+        ("Registro após o bloco 9 (pior caso)", montar_linhas(200_000, qtd_9900, "|C990|1|")),
+    ]
+    print(f"Bloco 9900 com {qtd_9900} entradas, corpo com 200000 linhas")
+    for nome, linhas in cenarios:
+        t_antigo, r_antigo = cronometrar(localizar_inicio_assinatura_antigo, linhas, 3)
+        t_novo, r_novo = cronometrar(localizar_inicio_assinatura, linhas, 3)
+        assert r_antigo == r_novo, (nome, r_antigo, r_novo)
+        print(f"- {nome}: antigo {t_antigo*1000:.2f} ms | novo {t_novo*1000:.3f} ms | "
+              f"{t_antigo / max(t_novo, 1e-9):.0f}x mais rápido (índice = {r_novo})")
+
+
+if __name__ == "__main__":
+    main()
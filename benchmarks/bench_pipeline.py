@@ -0,0 +1,477 @@
+"""Benchmark (tempo e pico de memória) dos caminhos principais do app, sem interface.
+
+Para cada tamanho, gera (ou reaproveita) um SPED sintético (ver gerar_sped.py)
+e mede as etapas de cada grupo:
+    leitura   ler_e_separar_sped, SpedDocument (índices), cache de documentos, separação dos registros
+    alterar   filtros por campo (igual/contém), pelo registro pai e por texto; aplicar e desfazer
+    resumo    montagem do cubo e as fatias da tela de resumo
+    converter Excel, Parquet e CSV
+    download  arquivo gerado (com edições) com os encerramentos recalculados
+
+Tempo: o menor de --repeticoes execuções (perf_counter), cada uma sobre um
+documento novo (nada montado por uma execução é reaproveitado pela seguinte).
+Memória: pico das alocações durante a etapa (tracemalloc, numa execução à parte,
+porque o rastreamento deixa o Python mais lento; o arquivo mapeado não conta) e o
+máximo de RSS do processo. Junto de cada etapa vão as sub-etapas medidas pela
+instrumentação do app (modules/instrumentacao.py).
+
+O resultado é gravado em JSON (--saida). Um resultado anterior (ex: a base do
+repositório, benchmarks/baseline.json) pode ser comparado com --comparar: etapas
+mais lentas ou com mais memória do que a tolerância terminam com código 1.
+
+Uso (na raiz do projeto):
+    python benchmarks/bench_pipeline.py [--linhas 10000,100000] [--etapas leitura,alterar,resumo,converter,download]
+                                        [--repeticoes 3] [--sem-memoria] [--dados PASTA] [--saida ARQUIVO.json]
+                                        [--comparar BASE.json] [--tolerancia 0.25]
+
+Exemplos:
+    python benchmarks/bench_pipeline.py --comparar benchmarks/baseline.json
+    python benchmarks/bench_pipeline.py --saida benchmarks/baseline.json
+    python benchmarks/bench_pipeline.py --linhas 1000000,10000000 --etapas leitura,alterar,resumo --repeticoes 1
+"""
+import argparse
+import gc
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from importlib import metadata
+
+try:
+    import resource # Só em sistemas Unix (máximo de RSS do processo)
+except ImportError:
+    resource = None
+
+DIRETORIO_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRETORIO_RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gerar_sped import SEMENTE_PADRAO, gerar_sped
+from modules.cache_documentos import CacheDocumentos
+from modules.cubo import REGISTROS_CUBO
+from modules.documento import SpedDocument
+from modules.exportar import exportar_parquet, exportar_xlsx, gerar_csv
+from modules.indices import filtrar_posicoes
+from modules.instrumentacao import DESLIGADO, ETAPAS, concluir_execucao, iniciar_execucao
+from modules.layout import carregar_catalogo, ler_tipos
+from modules.leitor import ArquivoMapeado, LinhasSped, separar_assinatura
+from utils import ler_e_separar_sped
+
+FORMATO_RESULTADO = 1
+TAMANHOS_PADRAO = [10_000, 100_000]
+GRUPOS = ["leitura", "alterar", "resumo", "converter", "download"]
+DIRETORIO_DADOS = os.path.join(tempfile.gettempdir(), "painel_sped_bench") # Arquivos gerados, reaproveitados entre execuções
+DIRETORIO_RESULTADOS = os.path.join(DIRETORIO_RAIZ, "benchmarks", "resultados")
+TOLERANCIA_PADRAO = 0.25
+MINIMO_SEGUNDOS = 0.01      # Diferenças de tempo menores que isso são ruído, não regressão
+MINIMO_BYTES = 1024**2      # Idem para o pico de memória
+FILTRO_CFOP = {"CFOP": "5102"}
+FILTRO_ITEM = {"COD_ITEM": "PRD00001"}
+FILTRO_PAI = {"DT_DOC": "15012024"}
+TEXTO_BUSCA = "PRD000123"
+
+
+class Entrada:
+    """Arquivo sintético de um tamanho, lido uma vez; as etapas montam documentos novos sobre ele."""
+
+    def __init__(self, caminho, catalogo, tipos):
+        self.caminho = caminho
+        self.catalogo = catalogo
+        self.tipos = tipos
+        self.bytes = os.path.getsize(caminho)
+        with open(caminho, "rb") as f:
+            self.dados = f.read() # Conteúdo "enviado" (como o upload do Streamlit)
+        self.corpo, self.assinatura = separar_assinatura(LinhasSped(ArquivoMapeado(caminho)))
+        self.base = SpedDocument(self.corpo, self.assinatura, catalogo, tipos)
+        self.sha256 = hashlib.sha256(self.dados).hexdigest()
+
+    def documento_novo(self, registros=()):
+        """SpedDocument sem nada montado (stores, índices de campo, cubo, edições) sobre o arquivo já lido."""
+        corpo = LinhasSped(self.corpo.arquivo, self.corpo.inicio, self.corpo.fim)
+        documento = SpedDocument(corpo, list(self.assinatura), self.catalogo, self.tipos,
+                                 indice_registros=self.base.indice_registros, hierarquia=self.base.hierarquia)
+        documento.carregar_registros(registros)
+        return documento
+
+
+class Caso:
+    """Etapa medida: `preparar(entrada)` monta o estado (fora da medição) e `executar(estado)` é o trecho medido.
+
+    `executar` retorna {"linhas": ..., "bytes": ...} (o que fizer sentido) e
+    `limpar(estado)`, se informado, remove o que a etapa deixou (arquivos).
+    """
+
+    def __init__(self, nome, executar, preparar=None, limpar=None):
+        self.nome = nome
+        self.grupo = nome.split(".")[0]
+        self.executar = executar
+        self.preparar = preparar or (lambda entrada: entrada)
+        self.limpar = limpar
+
+
+# --- Etapas ---
+
+def _arquivo_temporario(sufixo):
+    arquivo_tmp = tempfile.NamedTemporaryFile(prefix="bench_sped_", suffix=sufixo, delete=False)
+    arquivo_tmp.close()
+    return arquivo_tmp.name
+
+
+def _ler_e_separar(entrada):
+    corpo, assinatura = ler_e_separar_sped(io.BytesIO(entrada.dados))
+    return {"linhas": len(corpo) + len(assinatura), "bytes": entrada.bytes}
+
+
+def _montar_documento(estado):
+    corpo, assinatura, entrada = estado
+    documento = SpedDocument(corpo, assinatura, entrada.catalogo, entrada.tipos)
+    return {"linhas": len(documento)}
+
+
+def _preparar_cache(entrada, diretorio=None):
+    diretorio = diretorio or tempfile.mkdtemp(prefix="bench_cache_")
+    return CacheDocumentos(diretorio=diretorio), entrada
+
+
+def _preparar_cache_disco(entrada):
+    cache, _ = _preparar_cache(entrada)
+    cache.abrir(io.BytesIO(entrada.dados), entrada.catalogo, entrada.tipos)
+    return _preparar_cache(entrada, cache.diretorio) # Outra instância: o documento só está no disco
+
+
+def _abrir_pelo_cache(estado):
+    cache, entrada = estado
+    documento = cache.abrir(io.BytesIO(entrada.dados), entrada.catalogo, entrada.tipos)
+    return {"linhas": len(documento), "bytes": entrada.bytes}
+
+
+def _limpar_cache(estado):
+    shutil.rmtree(estado[0].diretorio, ignore_errors=True)
+
+
+def _separar_registros(documento):
+    registros = ["C100", "C170", "C190"]
+    documento.carregar_registros(registros)
+    return {"linhas": sum(len(documento.registros[reg]) for reg in registros if reg in documento.registros)}
+
+
+def _filtrar(filtros, modo):
+    def executar(documento):
+        return {"linhas": len(filtrar_posicoes(documento.registro("C170"), filtros, modo))}
+    return executar
+
+
+def _filtrar_pai(documento):
+    return {"linhas": len(documento.filtrar_por_pai("C170", "C100", FILTRO_PAI, "Igual"))}
+
+
+def _filtrar_texto(documento):
+    return {"linhas": len(documento.linhas_com_texto(TEXTO_BUSCA, diferenciar_maiusculas=True))}
+
+
+def _preparar_aplicar(entrada):
+    documento = entrada.documento_novo(["C100", "C170", "C190"])
+    store = documento.registro("C170")
+    return documento, store.linhas[filtrar_posicoes(store, FILTRO_CFOP, "Igual")]
+
+
+def _aplicar(estado):
+    documento, indices = estado
+    return {"linhas": len(documento.alterar_campo_em_lote("C170", indices, "CST_ICMS", "090"))}
+
+
+def _preparar_desfazer(entrada):
+    documento, indices = _preparar_aplicar(entrada)
+    documento.alterar_campo_em_lote("C170", indices, "CST_ICMS", "090")
+    return documento, len(indices)
+
+
+def _desfazer(estado):
+    documento, linhas = estado
+    documento.desfazer()
+    return {"linhas": linhas}
+
+
+def _montar_cubo(documento):
+    cubo = documento.cubo_resumo()
+    return {"linhas": sum(len(c.store) for c in cubo.cubos.values())}
+
+
+def _preparar_fatias(entrada):
+    documento = entrada.documento_novo(REGISTROS_CUBO)
+    documento.cubo_resumo()
+    return documento
+
+
+def _fatias(documento):
+    """As mesmas fatias da tela de resumo (resumo.generate_summary)."""
+    cubo = documento.cubo_resumo()
+    registros_interesse = ["C100", "C170", "D100"]
+    cubo.fatia(registros_interesse, ["REG"])
+    cubo.fatia(registros_interesse, ["CFOP"])
+    cubo.fatia(["C100", "D100"], ["IND_OPER"])
+    for registro in ("C190", "D190"):
+        meses = sorted(m for m in cubo.fatia([registro], ["MES"])["MES"] if m)
+        cubo.fatia([registro], ["CFOP", "CST_ICMS", "ALIQ_ICMS"], {"MES": meses[-1:]})
+    return {"linhas": sum(len(c.store) for c in cubo.cubos.values())}
+
+
+def _caso_exportar(nome, funcao, sufixo):
+    def preparar(entrada):
+        return entrada.documento_novo(), _arquivo_temporario(sufixo)
+
+    def executar(estado):
+        documento, destino = estado
+        funcao(documento, destino)
+        return {"linhas": len(documento), "bytes": os.path.getsize(destino)}
+
+    def limpar(estado):
+        os.remove(estado[1])
+    return Caso(nome, executar, preparar, limpar)
+
+
+def _exportar_csv(documento):
+    return {"linhas": len(documento), "bytes": len(gerar_csv(documento.corpo))}
+
+
+def _preparar_download(entrada):
+    documento = entrada.documento_novo(["C170"])
+    store = documento.registro("C170")
+    documento.alterar_campo_em_lote("C170", store.linhas[:1000], "CST_ICMS", "090") # Com edições, como no app
+    return documento
+
+
+def _download(documento):
+    return {"linhas": len(documento) + len(documento.assinatura), "bytes": os.path.getsize(documento.caminho_download())}
+
+
+CASOS = [
+    Caso("leitura.ler_e_separar_sped", _ler_e_separar),
+    Caso("leitura.documento", _montar_documento,
+         preparar=lambda entrada: (*separar_assinatura(LinhasSped(ArquivoMapeado(entrada.caminho))), entrada)),
+    Caso("leitura.cache_novo", _abrir_pelo_cache, preparar=_preparar_cache, limpar=_limpar_cache),
+    Caso("leitura.cache_disco", _abrir_pelo_cache, preparar=_preparar_cache_disco, limpar=_limpar_cache),
+    Caso("leitura.registros", _separar_registros, preparar=lambda entrada: entrada.documento_novo()),
+    Caso("alterar.filtrar_igual", _filtrar(FILTRO_CFOP, "Igual"), preparar=lambda entrada: entrada.documento_novo(["C170"])),
+    Caso("alterar.filtrar_contem", _filtrar(FILTRO_ITEM, "Contém"), preparar=lambda entrada: entrada.documento_novo(["C170"])),
+    Caso("alterar.filtrar_pai", _filtrar_pai, preparar=lambda entrada: entrada.documento_novo(["C100", "C170"])),
+    Caso("alterar.filtrar_texto", _filtrar_texto, preparar=lambda entrada: entrada.documento_novo()),
+    Caso("alterar.aplicar", _aplicar, preparar=_preparar_aplicar),
+    Caso("alterar.desfazer", _desfazer, preparar=_preparar_desfazer),
+    Caso("resumo.cubo", _montar_cubo, preparar=lambda entrada: entrada.documento_novo(REGISTROS_CUBO)),
+    Caso("resumo.fatias", _fatias, preparar=_preparar_fatias),
+    _caso_exportar("converter.xlsx", exportar_xlsx, ".xlsx"),
+    _caso_exportar("converter.parquet", exportar_parquet, ".zip"),
+    Caso("converter.csv", _exportar_csv, preparar=lambda entrada: entrada.documento_novo()),
+    Caso("download.gerar", _download, preparar=_preparar_download),
+]
+
+
+# --- Medição ---
+
+def _pico_rss():
+    """Máximo de RSS do processo até agora, em bytes (None fora do Unix)."""
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == "darwin" else pico * 1024 # Linux informa em KB
+
+
+def _preparar(caso, entrada):
+    """Estado da etapa, montado sem medir (nem imprimir eventos) o que não faz parte dela."""
+    iniciar_execucao(nivel=DESLIGADO)
+    try:
+        estado = caso.preparar(entrada)
+    finally:
+        concluir_execucao()
+    gc.collect()
+    return estado
+
+
+def medir_caso(caso, entrada, repeticoes, memoria=True):
+    """Resultado (dicionário do JSON) da etapa: tempos das repetições, pico de memória e sub-etapas."""
+    tempos = []
+    subetapas = extras = None
+    for _ in range(repeticoes):
+        estado = _preparar(caso, entrada)
+        execucao = iniciar_execucao(rotulo=caso.nome, nivel=ETAPAS)
+        try:
+            inicio = time.perf_counter()
+            extras = caso.executar(estado)
+            tempos.append(time.perf_counter() - inicio)
+        finally:
+            concluir_execucao()
+            if caso.limpar:
+                caso.limpar(estado)
+        if tempos[-1] == min(tempos):
+            subetapas = {nome: round(segundos * 1000, 3) for nome, (_, segundos, _, _) in execucao.totais().items()}
+        del estado
+
+    pico = None
+    if memoria:
+        estado = _preparar(caso, entrada)
+        iniciar_execucao(nivel=DESLIGADO)
+        tracemalloc.start()
+        try:
+            caso.executar(estado)
+            pico = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            concluir_execucao()
+            if caso.limpar:
+                caso.limpar(estado)
+        del estado
+
+    return {
+        "etapa": caso.nome, "linhas_arquivo": len(entrada.corpo) + len(entrada.assinatura),
+        "segundos": round(min(tempos), 6), "mediana": round(statistics.median(tempos), 6), "repeticoes": repeticoes,
+        "pico_bytes": pico, "rss_bytes": _pico_rss(), **(extras or {}), "subetapas": subetapas,
+    }
+
+
+def arquivo_sintetico(linhas, semente, diretorio):
+    """Caminho do SPED sintético do tamanho pedido, gerado só se ainda não existir em `diretorio`."""
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = os.path.join(diretorio, f"sped_sintetico_{linhas}_{semente}.txt")
+    if not os.path.exists(caminho):
+        inicio = time.perf_counter()
+        gerar_sped(caminho + ".tmp", linhas, semente, assinatura=True)
+        os.replace(caminho + ".tmp", caminho)
+        print(f"  {caminho} gerado em {time.perf_counter() - inicio:.1f} s")
+    return caminho
+
+
+def _versao(pacote):
+    try:
+        return metadata.version(pacote)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DIRETORIO_RAIZ, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def maquina():
+    """Ambiente da execução (só faz sentido comparar resultados da mesma máquina)."""
+    return {
+        "plataforma": platform.platform(), "processador": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(), "python": platform.python_version(),
+        "pacotes": {pacote: _versao(pacote) for pacote in ("numpy", "pandas", "pyarrow", "xlsxwriter", "streamlit")},
+    }
+
+
+def executar_benchmark(tamanhos, grupos, repeticoes, memoria, semente, diretorio_dados):
+    catalogo, tipos = carregar_catalogo(), ler_tipos()
+    resultados = []
+    for linhas in tamanhos:
+        print(f"{linhas} linhas:")
+        entrada = Entrada(arquivo_sintetico(linhas, semente, diretorio_dados), catalogo, tipos)
+        for caso in CASOS:
+            if caso.grupo not in grupos:
+                continue
+            resultado = medir_caso(caso, entrada, repeticoes, memoria)
+            resultado = {"tamanho": linhas, "sha256": entrada.sha256, **resultado}
+            resultados.append(resultado)
+            pico = f"{resultado['pico_bytes'] / 1024**2:9.1f} MB" if resultado["pico_bytes"] is not None else ""
+            print(f"  {caso.nome:<28} {resultado['segundos'] * 1000:10.1f} ms {pico}")
+        del entrada
+        gc.collect()
+    return {
+        "formato": FORMATO_RESULTADO, "data": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _commit(),
+        "maquina": maquina(), "parametros": {"semente": semente, "repeticoes": repeticoes, "memoria": memoria},
+        "resultados": resultados,
+    }
+
+
+# --- Comparação com um resultado anterior ---
+
+def comparar(base, atual, tolerancia=TOLERANCIA_PADRAO):
+    """Imprime a comparação etapa a etapa e retorna a lista de regressões [(tamanho, etapa, motivo)].
+
+    Uma etapa regrediu se ficou mais de `tolerancia` (fração) mais lenta ou com
+    pico de memória maior, e a diferença passa do ruído (MINIMO_SEGUNDOS/MINIMO_BYTES).
+    """
+    if base.get("maquina", {}).get("processador") != atual["maquina"]["processador"] or \
+            base.get("maquina", {}).get("cpus") != atual["maquina"]["cpus"]:
+        print("Atenção: a base foi medida em outra máquina; as diferenças de tempo podem não ser do código.")
+    anteriores = {(r["tamanho"], r["etapa"]): r for r in base.get("resultados", [])}
+    regressoes = []
+    print(f"\n{'tamanho':>9} {'etapa':<28} {'base ms':>10} {'atual ms':>10} {'razão':>6} {'base MB':>8} {'atual MB':>8}")
+    for resultado in atual["resultados"]:
+        chave = (resultado["tamanho"], resultado["etapa"])
+        anterior = anteriores.get(chave)
+        if anterior is None:
+            print(f"{chave[0]:>9} {chave[1]:<28} {'-':>10} {resultado['segundos'] * 1000:>10.1f}  (nova)")
+            continue
+        if anterior.get("sha256") != resultado["sha256"]:
+            print(f"{chave[0]:>9} {chave[1]:<28} arquivo sintético diferente da base (gerador ou semente mudou)")
+            continue
+        razao = resultado["segundos"] / anterior["segundos"] if anterior["segundos"] else float("inf")
+        motivos = []
+        if razao > 1 + tolerancia and resultado["segundos"] - anterior["segundos"] > MINIMO_SEGUNDOS:
+            motivos.append(f"tempo x{razao:.2f}")
+        pico_base, pico_atual = anterior.get("pico_bytes"), resultado.get("pico_bytes")
+        if pico_base is not None and pico_atual is not None and pico_atual > pico_base * (1 + tolerancia) \
+                and pico_atual - pico_base > MINIMO_BYTES:
+            motivos.append(f"memória x{pico_atual / max(pico_base, 1):.2f}")
+        colunas_mb = "".join(f" {valor / 1024**2:>8.1f}" if valor is not None else f" {'-':>8}" for valor in (pico_base, pico_atual))
+        print(f"{chave[0]:>9} {chave[1]:<28} {anterior['segundos'] * 1000:>10.1f} {resultado['segundos'] * 1000:>10.1f} "
+              f"{razao:>6.2f}{colunas_mb}" + (f"  REGRESSÃO ({', '.join(motivos)})" if motivos else ""))
+        regressoes.extend((chave[0], chave[1], motivo) for motivo in motivos)
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede tempo e memória das etapas principais do app sobre SPEDs sintéticos.")
+    parser.add_argument("--linhas", default=",".join(map(str, TAMANHOS_PADRAO)),
+                        help="Tamanhos (linhas) separados por vírgula (padrão: %(default)s)")
+    parser.add_argument("--etapas", default=",".join(GRUPOS), help="Grupos de etapas medidos (padrão: %(default)s)")
+    parser.add_argument("--repeticoes", type=int, default=3, help="Execuções de cada etapa; vale a mais rápida (padrão: 3)")
+    parser.add_argument("--sem-memoria", action="store_true", help="Não mede o pico de memória (execução com tracemalloc)")
+    parser.add_argument("--semente", type=int, default=SEMENTE_PADRAO, help="Semente do gerador de SPED sintético")
+    parser.add_argument("--dados", default=DIRETORIO_DADOS, help="Pasta dos arquivos sintéticos (padrão: %(default)s)")
+    parser.add_argument("--saida", help="JSON com os resultados (padrão: benchmarks/resultados/pipeline_<data>.json)")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior (ex: benchmarks/baseline.json)")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_PADRAO,
+                        help="Fração de piora aceita na comparação (padrão: %(default)s)")
+    args = parser.parse_args()
+
+    tamanhos = [int(valor) for valor in args.linhas.split(",") if valor.strip()]
+    grupos = [grupo.strip() for grupo in args.etapas.split(",") if grupo.strip()]
+    desconhecidos = sorted(set(grupos) - set(GRUPOS))
+    if desconhecidos:
+        parser.error(f"Etapas desconhecidas: {', '.join(desconhecidos)} (disponíveis: {', '.join(GRUPOS)})")
+
+    atual = executar_benchmark(tamanhos, grupos, args.repeticoes, not args.sem_memoria, args.semente, args.dados)
+
+    saida = args.saida or os.path.join(DIRETORIO_RESULTADOS, f"pipeline_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(atual, f, ensure_ascii=False, indent=1)
+    print(f"\nResultados gravados em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        regressoes = comparar(base, atual, args.tolerancia)
+        if regressoes:
+            print(f"\n{len(regressoes)} regressão(ões) acima da tolerância de {args.tolerancia:.0%}.")
+            sys.exit(1)
+        print("\nNenhuma regressão acima da tolerância.")
+
+
+if __name__ == "__main__":
+    main()
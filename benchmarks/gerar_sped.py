@@ -0,0 +1,438 @@
+"""Gerador determinístico de arquivos SPED (EFD ICMS/IPI) sintéticos para os benchmarks.
+
+Os registros seguem o layout de sped_descricao/sped_descritivo.txt: os campos
+que o gerador preenche estão em CAMPOS_GERADOS; os demais saem com o valor
+padrão do tipo (sped_tipos_campos.txt): "0,00" nos valores, vazio no resto.
+A mistura imita uma apuração mensal de um comércio: cadastro de participantes
+(0150), unidades (0190) e itens (0200); notas fiscais (C100) com itens (C170)
+e analíticos (C190) coerentes com os itens; conhecimentos de transporte (D100/
+D190); apuração do ICMS (E110) a partir dos analíticos; contadores x990/9900/
+9990/9999 corretos. O mesmo (linhas, semente) gera sempre o mesmo arquivo.
+
+Uso (na raiz do projeto):
+    python benchmarks/gerar_sped.py LINHAS [-o ARQUIVO] [--semente N] [--assinatura]
+
+Exemplos:
+    python benchmarks/gerar_sped.py 100000 -o /tmp/sped_100k.txt
+    python benchmarks/gerar_sped.py 10000000 -o /tmp/sped_10M.txt --assinatura
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from bisect import bisect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.layout import ARQUIVO_LAYOUT, ARQUIVO_TIPOS, ler_layout, ler_tipos
+
+SEMENTE_PADRAO = 2024
+LINHAS_POR_ESCRITA = 50_000 # Linhas acumuladas antes de cada escrita no arquivo
+ANO, MES, DIAS_NO_MES = 2024, 1, 31
+UF_EMPRESA, COD_MUN_EMPRESA = "SP", "3550308"
+
+# Campos preenchidos pelo gerador em cada registro (os demais ficam com o padrão do tipo)
+CAMPOS_GERADOS = {
+    "0000": ["COD_VER", "COD_FIN", "DT_INI", "DT_FIN", "NOME", "CNPJ", "UF", "IE", "COD_MUN", "IND_PERFIL", "IND_ATIV"],
+    "0001": ["IND_MOV"],
+    "0005": ["FANTASIA", "CEP", "END", "NUM", "BAIRRO", "FONE", "EMAIL"],
+    "0150": ["COD_PART", "NOME", "COD_PAIS", "CNPJ", "IE", "COD_MUN", "END", "NUM", "BAIRRO"],
+    "0190": ["UNID", "DESCR"],
+    "0200": ["COD_ITEM", "DESCR_ITEM", "COD_BARRA", "UNID_INV", "TIPO_ITEM", "COD_NCM", "COD_GEN", "ALIQ_ICMS", "CEST"],
+    "0990": ["QTD_LIN_0"],
+    "C001": ["IND_MOV"],
+    "C100": ["IND_OPER", "IND_EMIT", "COD_PART", "COD_MOD", "COD_SIT", "SER", "NUM_DOC", "CHV_NFE", "DT_DOC", "DT_E_S",
+             "VL_DOC", "IND_PGTO", "VL_MERC", "IND_FRT", "VL_BC_ICMS", "VL_ICMS", "VL_PIS", "VL_COFINS"],
+    "C170": ["NUM_ITEM", "COD_ITEM", "QTD", "UNID", "VL_ITEM", "IND_MOV", "CST_ICMS", "CFOP", "VL_BC_ICMS", "ALIQ_ICMS",
+             "VL_ICMS", "IND_APUR", "CST_IPI", "COD_ENQ", "CST_PIS", "VL_BC_PIS", "ALIQ_PIS_PERC", "VL_PIS",
+             "CST_COFINS", "VL_BC_COFINS", "ALIQ_COFINS_PERC", "VL_COFINS"],
+    "C190": ["CST_ICMS", "CFOP", "ALIQ_ICMS", "VL_OPR", "VL_BC_ICMS", "VL_ICMS", "VL_RED_BC"],
+    "C990": ["QTD_LIN_C"],
+    "D001": ["IND_MOV"],
+    "D100": ["IND_OPER", "IND_EMIT", "COD_PART", "COD_MOD", "COD_SIT", "SER", "NUM_DOC", "DT_DOC", "DT_A_P", "TP_CT-e",
+             "CHV_CTE", "VL_DOC", "IND_FRT", "VL_SERV", "VL_BC_ICMS", "VL_ICMS"],
+    "D190": ["CST_ICMS", "CFOP", "ALIQ_ICMS", "VL_OPR", "VL_BC_ICMS", "VL_ICMS"],
+    "D990": ["QTD_LIN_D"],
+    "E001": ["IND_MOV"],
+    "E100": ["DT_INI", "DT_FIN"],
+    "E110": ["VL_TOT_DEBITOS", "VL_TOT_CREDITOS", "VL_SLD_APURADO", "VL_ICMS_RECOLHER", "VL_SLD_CREDOR_TRANSPORTAR"],
+    "E990": ["QTD_LIN_E"],
+    "H001": ["IND_MOV"],
+    "H990": ["QTD_LIN_H"],
+    "1001": ["IND_MOV"],
+    "1990": ["QTD_LIN_1"],
+    "9001": ["IND_MOV"],
+    "9900": ["REG_BLC", "QTD_REG_BLC"],
+    "9990": ["QTD_LIN_9"],
+    "9999": ["QTD_LIN"],
+}
+
+# --- Parâmetros da mistura (frações e distribuições de uma apuração mensal típica) ---
+
+FRACAO_CTE = 0.08          # Documentos que são CT-e (D100) em vez de NF-e (C100)
+FRACAO_SAIDAS = 0.65       # Notas de saída (IND_OPER=1); as demais são entradas de terceiros
+FRACAO_CANCELADAS = 0.01   # Notas canceladas (COD_SIT=02): só a chave, sem itens nem valores
+FRACAO_FORA_DO_ESTADO = 0.3
+FRACAO_ITENS_ST = 0.2      # Itens com substituição tributária (CST x60, CFOP 5405/1403)
+FRACAO_ITENS_ISENTOS = 0.05
+FRACAO_ITENS_REDUCAO = 0.1 # Itens com redução de base de cálculo (CST x20)
+ITENS_POR_NOTA = [1, 2, 3, 4, 5, 6, 8, 10, 15, 25, 40]
+PESOS_ITENS_POR_NOTA = [30, 18, 12, 10, 8, 7, 5, 4, 3, 2, 1]
+# UF dos participantes -> (código IBGE da UF, município, alíquota interestadual a partir de SP)
+UFS = {
+    "SP": ("35", "3550308", 18), "RJ": ("33", "3304557", 12), "MG": ("31", "3106200", 12),
+    "PR": ("41", "4106902", 12), "SC": ("42", "4205407", 12), "RS": ("43", "4314902", 12),
+    "BA": ("29", "2927408", 7), "PE": ("26", "2611606", 7), "GO": ("52", "5208707", 7), "CE": ("23", "2304400", 7),
+}
+UNIDADES = [("UN", "UNIDADE"), ("CX", "CAIXA"), ("KG", "QUILOGRAMA"), ("PC", "PEÇA"), ("LT", "LITRO"), ("M", "METRO")]
+PALAVRAS_ITEM = ["PARAFUSO", "ARRUELA", "CABO", "FIO", "TOMADA", "LÂMPADA", "TUBO", "CONEXÃO", "TINTA", "VERNIZ",
+                 "MANGUEIRA", "TORNEIRA", "FECHADURA", "DOBRADIÇA", "CIMENTO", "ARGAMASSA", "AÇÚCAR", "CAFÉ", "ÓLEO", "SABÃO"]
+COMPLEMENTOS_ITEM = ["INOX", "GALVANIZADO", "BRANCO", "PRETO", "10MM", "20MM", "1/2\"", "3/4\"", "5L", "18L", "PREMIUM", "ECONÔMICO"]
+PALAVRAS_NOME = ["COMÉRCIO", "INDÚSTRIA", "DISTRIBUIDORA", "ATACADO", "MATERIAIS", "FERRAGENS", "ALIMENTOS", "TRANSPORTES"]
+SOBRENOMES = ["SILVA", "SOUZA", "OLIVEIRA", "PEREIRA", "LIMA", "CARVALHO", "ARAÚJO", "RIBEIRO", "ALMEIDA", "CONCEIÇÃO"]
+BAIRROS = ["CENTRO", "VILA NOVA", "JARDIM AMÉRICA", "DISTRITO INDUSTRIAL", "SÃO JOSÉ", "BOA VISTA"]
+
+
+def valor_padrao(tipo_campo):
+    """Valor de um campo não gerado: zero com as casas do tipo para valores (VL_, ALIQ_, QTD...), vazio para o resto."""
+    if tipo_campo is not None and tipo_campo.tipo == "N" and tipo_campo.decimais:
+        return "0," + "0" * tipo_campo.decimais
+    return ""
+
+
+class Modelo:
+    """Formato de linha de um registro na ordem do layout, com os campos gerados como marcadores."""
+
+    def __init__(self, registro, campos_layout, tipos_campos, gerados):
+        faltando = [campo for campo in gerados if campo not in campos_layout]
+        if faltando:
+            raise ValueError(f"Campos {faltando} do registro {registro} não estão no layout")
+        partes = [registro]
+        for campo in sorted(campos_layout, key=campos_layout.get):
+            partes.append("{" + campo + "}" if campo in gerados else valor_padrao(tipos_campos.get(campo)))
+        self.formato = "|" + "|".join(partes) + "|"
+
+    def linha(self, **valores):
+        return self.formato.format_map(valores)
+
+
+# --- Formatação (valores em centavos, inteiros, para os totais fecharem exatamente) ---
+
+def centavos(valor):
+    """1234 -> '12,34'"""
+    return f"{valor // 100},{valor % 100:02d}"
+
+
+def quantidade(milesimos):
+    """1500 -> '1,50000' (QTD com 5 casas)"""
+    return f"{milesimos // 1000},{milesimos % 1000:03d}00"
+
+
+def aliquota(percentual):
+    return f"{percentual},00"
+
+
+def data(dia):
+    return f"{dia:02d}{MES:02d}{ANO}"
+
+
+def digito_mod11(numero, pesos_ate=9):
+    """Dígito verificador módulo 11 (chave de acesso e CNPJ): pesos 2..pesos_ate da direita para a esquerda."""
+    soma, peso = 0, 2
+    for algarismo in reversed(numero):
+        soma += int(algarismo) * peso
+        peso = 2 if peso == pesos_ate else peso + 1
+    resto = soma % 11
+    return "0" if resto < 2 else str(11 - resto)
+
+
+def cnpj(raiz):
+    base = f"{raiz:08d}0001"
+    primeiro = digito_mod11(base)
+    return base + primeiro + digito_mod11(base + primeiro)
+
+
+def chave_acesso(cod_uf, cnpj_emitente, modelo, serie, numero, codigo):
+    chave = f"{cod_uf}{ANO % 100:02d}{MES:02d}{cnpj_emitente}{modelo}{serie:03d}{numero:09d}1{codigo:08d}"
+    return chave + digito_mod11(chave)
+
+
+class GeradorSped:
+    """Gera as linhas de um SPED sintético de aproximadamente `linhas` linhas (ver gerar_sped)."""
+
+    def __init__(self, linhas, semente=SEMENTE_PADRAO, layout=None, tipos=None):
+        layout = layout if layout is not None else ler_layout(ARQUIVO_LAYOUT)
+        tipos = tipos if tipos is not None else ler_tipos(ARQUIVO_TIPOS)
+        self.modelos = {registro: Modelo(registro, layout[registro], tipos.get(registro, {}), gerados)
+                        for registro, gerados in CAMPOS_GERADOS.items()}
+        self.linhas = linhas
+        self.rng = random.Random(semente)
+        self.contagem = {} # REG -> linhas geradas (para 9900 e x990)
+        self.cnpj_empresa = cnpj(12345678)
+        # Cadastros proporcionais ao tamanho do arquivo (um arquivo de 10M linhas tem dezenas de milhares de itens)
+        self.participantes = self._participantes(min(max(linhas // 400, 20), 20_000))
+        self.itens = self._itens(min(max(linhas // 200, 50), 50_000))
+        self.pesos_itens = [1.0 / (i + 1) ** 0.8 for i in range(len(self.itens))] # Poucos itens vendem muito
+        self.pesos_itens_acumulados = _acumulados(self.pesos_itens)
+        self.pesos_por_nota = _acumulados(PESOS_ITENS_POR_NOTA)
+        self.numero_saida = 0
+        self.debitos = self.creditos = 0
+
+    def _linha(self, registro, **valores):
+        self.contagem[registro] = self.contagem.get(registro, 0) + 1
+        return self.modelos[registro].linha(**valores)
+
+    # --- Cadastros (bloco 0) ---
+
+    def _participantes(self, quantidade_participantes):
+        rng = self.rng
+        ufs = list(UFS)
+        participantes = []
+        for i in range(quantidade_participantes):
+            uf = UF_EMPRESA if rng.random() >= FRACAO_FORA_DO_ESTADO else rng.choice(ufs[1:])
+            nome = f"{rng.choice(SOBRENOMES)} {rng.choice(PALAVRAS_NOME)} LTDA"
+            participantes.append((f"P{i + 1:06d}", nome, uf, cnpj(rng.randrange(10_000_000, 99_999_999))))
+        return participantes
+
+    def _itens(self, quantidade_itens):
+        rng = self.rng
+        itens = []
+        for i in range(quantidade_itens):
+            sorteio = rng.random()
+            if sorteio < FRACAO_ITENS_ST:
+                tributacao = "60"
+            elif sorteio < FRACAO_ITENS_ST + FRACAO_ITENS_ISENTOS:
+                tributacao = "40"
+            elif sorteio < FRACAO_ITENS_ST + FRACAO_ITENS_ISENTOS + FRACAO_ITENS_REDUCAO:
+                tributacao = "20"
+            else:
+                tributacao = "00"
+            unidade = rng.choice(UNIDADES)[0]
+            descricao = f"{rng.choice(PALAVRAS_ITEM)} {rng.choice(COMPLEMENTOS_ITEM)} {i + 1}"
+            preco = rng.randrange(50, 50_000) if rng.random() < 0.9 else rng.randrange(50_000, 2_000_000)
+            ncm = f"{rng.randrange(1_000_000, 99_999_999):08d}"
+            itens.append((f"PRD{i + 1:06d}", descricao, unidade, preco, tributacao, ncm))
+        return itens
+
+    def _bloco_0(self):
+        cabecalho = dict(
+            COD_VER="017", COD_FIN="0", DT_INI=data(1), DT_FIN=data(DIAS_NO_MES), NOME="EMPRESA SINTÉTICA DE COMÉRCIO LTDA",
+            CNPJ=self.cnpj_empresa, UF=UF_EMPRESA, IE="111222333444", COD_MUN=COD_MUN_EMPRESA, IND_PERFIL="A", IND_ATIV="1",
+        )
+        yield self._linha("0000", **cabecalho)
+        yield self._linha("0001", IND_MOV="0")
+        yield self._linha("0005", FANTASIA="SINTÉTICA", CEP="01001000", END="PRAÇA DA SÉ", NUM="100", BAIRRO="SÉ",
+                          FONE="1133334444", EMAIL="fiscal@sintetica.com.br")
+        for codigo, nome, uf, cnpj_participante in self.participantes:
+            yield self._linha("0150", COD_PART=codigo, NOME=nome, COD_PAIS="01058", CNPJ=cnpj_participante,
+                              IE=cnpj_participante[:12], COD_MUN=UFS[uf][1], END=f"RUA {self.rng.choice(SOBRENOMES)}",
+                              NUM=str(self.rng.randrange(1, 3000)), BAIRRO=self.rng.choice(BAIRROS))
+        for unidade, descricao in UNIDADES:
+            yield self._linha("0190", UNID=unidade, DESCR=descricao)
+        for codigo, descricao, unidade, _, tributacao, ncm in self.itens:
+            yield self._linha("0200", COD_ITEM=codigo, DESCR_ITEM=descricao, COD_BARRA=f"789{ncm}{codigo[-2:]}",
+                              UNID_INV=unidade, TIPO_ITEM="00", COD_NCM=ncm, COD_GEN=ncm[:2], ALIQ_ICMS=aliquota(18),
+                              CEST=f"{ncm[:7]}" if tributacao == "60" else "")
+        yield self._linha("0990", QTD_LIN_0=sum(q for reg, q in self.contagem.items() if reg[0] == "0") + 1)
+
+    # --- Documentos (blocos C e D) ---
+
+    def _nota(self, dia):
+        rng = self.rng
+        codigo_part, _, uf, cnpj_participante = rng.choice(self.participantes)
+        saida = rng.random() < FRACAO_SAIDAS
+        if saida:
+            self.numero_saida += 1
+            numero, cnpj_emitente, cod_uf = self.numero_saida, self.cnpj_empresa, UFS[UF_EMPRESA][0]
+        else:
+            numero, cnpj_emitente, cod_uf = rng.randrange(1, 999_999), cnpj_participante, UFS[uf][0]
+        chave = chave_acesso(cod_uf, cnpj_emitente, "55", 1, numero, rng.randrange(100_000_000))
+        comum = dict(IND_OPER="1" if saida else "0", IND_EMIT="0" if saida else "1", COD_PART=codigo_part, COD_MOD="55",
+                     SER="1", NUM_DOC=str(numero), CHV_NFE=chave)
+
+        if rng.random() < FRACAO_CANCELADAS:
+            return [self._linha("C100", COD_SIT="02", DT_DOC="", DT_E_S="", VL_DOC="", IND_PGTO="", VL_MERC="", IND_FRT="",
+                                VL_BC_ICMS="", VL_ICMS="", VL_PIS="", VL_COFINS="", **comum)]
+
+        interna = uf == UF_EMPRESA
+        aliquota_operacao = UFS[uf][2]
+        itens = []
+        analiticos = {} # (CST, CFOP, ALIQ) -> [VL_OPR, VL_BC_ICMS, VL_ICMS, VL_RED_BC]
+        total = total_bc = total_icms = total_pis = total_cofins = 0
+        quantidade_itens = ITENS_POR_NOTA[bisect(self.pesos_por_nota, rng.random() * self.pesos_por_nota[-1])]
+        for num_item in range(1, quantidade_itens + 1):
+            indice = bisect(self.pesos_itens_acumulados, rng.random() * self.pesos_itens_acumulados[-1])
+            codigo_item, _, unidade, preco, tributacao, _ = self.itens[indice]
+            milesimos = rng.randrange(500, 20_000) if unidade in ("KG", "LT", "M") else rng.randrange(1, 48) * 1000
+            valor = milesimos * preco // 1000 or 1
+            if tributacao == "60":
+                cfop = ("5405" if interna else "6404") if saida else ("1403" if interna else "2403")
+                base, aliq = 0, 0
+            elif tributacao == "40":
+                cfop = ("5102" if interna else "6102") if saida else ("1102" if interna else "2102")
+                base, aliq = 0, 0
+            else:
+                cfop = ("5102" if interna else "6102") if saida else ("1102" if interna else "2102")
+                base = valor * 6111 // 10000 if tributacao == "20" else valor
+                aliq = aliquota_operacao
+            icms = (base * aliq + 50) // 100
+            pis, cofins = (valor * 165 + 5000) // 10000, (valor * 760 + 5000) // 10000
+            cst_icms = "0" + tributacao
+            itens.append(self._linha(
+                "C170", NUM_ITEM=str(num_item), COD_ITEM=codigo_item, QTD=quantidade(milesimos), UNID=unidade,
+                VL_ITEM=centavos(valor), IND_MOV="0", CST_ICMS=cst_icms, CFOP=cfop, VL_BC_ICMS=centavos(base),
+                ALIQ_ICMS=aliquota(aliq), VL_ICMS=centavos(icms), IND_APUR="0", CST_IPI="53" if saida else "03",
+                COD_ENQ="999", CST_PIS="01" if saida else "50", VL_BC_PIS=centavos(valor), ALIQ_PIS_PERC="1,6500",
+                VL_PIS=centavos(pis), CST_COFINS="01" if saida else "50", VL_BC_COFINS=centavos(valor),
+                ALIQ_COFINS_PERC="7,6000", VL_COFINS=centavos(cofins),
+            ))
+            somas = analiticos.setdefault((cst_icms, cfop, aliq), [0, 0, 0, 0])
+            somas[0] += valor
+            somas[1] += base
+            somas[2] += icms
+            somas[3] += valor - base if tributacao == "20" else 0
+            total += valor
+            total_bc += base
+            total_icms += icms
+            total_pis += pis
+            total_cofins += cofins
+
+        if saida:
+            self.debitos += total_icms
+        else:
+            self.creditos += total_icms
+        dia_entrada = dia if saida else min(dia + rng.randrange(0, 4), DIAS_NO_MES)
+        linhas = [self._linha(
+            "C100", COD_SIT="00", DT_DOC=data(dia), DT_E_S=data(dia_entrada), VL_DOC=centavos(total),
+            IND_PGTO="1" if rng.random() < 0.7 else "0", VL_MERC=centavos(total), IND_FRT="0" if saida else "1",
+            VL_BC_ICMS=centavos(total_bc), VL_ICMS=centavos(total_icms), VL_PIS=centavos(total_pis),
+            VL_COFINS=centavos(total_cofins), **comum,
+        )]
+        linhas += itens
+        for (cst_icms, cfop, aliq), (operacao, base, icms, reducao) in analiticos.items():
+            linhas.append(self._linha("C190", CST_ICMS=cst_icms, CFOP=cfop, ALIQ_ICMS=aliquota(aliq), VL_OPR=centavos(operacao),
+                                      VL_BC_ICMS=centavos(base), VL_ICMS=centavos(icms), VL_RED_BC=centavos(reducao)))
+        return linhas
+
+    def _conhecimento(self, dia):
+        rng = self.rng
+        codigo_part, _, uf, cnpj_participante = rng.choice(self.participantes)
+        numero = rng.randrange(1, 999_999)
+        aliq = UFS[uf][2]
+        valor = rng.randrange(5_000, 500_000)
+        icms = (valor * aliq + 50) // 100
+        cfop = "1353" if uf == UF_EMPRESA else "2353"
+        self.creditos += icms
+        return [
+            self._linha("D100", IND_OPER="0", IND_EMIT="1", COD_PART=codigo_part, COD_MOD="57", COD_SIT="00", SER="1",
+                        NUM_DOC=str(numero), DT_DOC=data(dia), DT_A_P=data(dia), **{"TP_CT-e": "0"},
+                        CHV_CTE=chave_acesso(UFS[uf][0], cnpj_participante, "57", 1, numero, rng.randrange(100_000_000)),
+                        VL_DOC=centavos(valor), IND_FRT="1", VL_SERV=centavos(valor), VL_BC_ICMS=centavos(valor),
+                        VL_ICMS=centavos(icms)),
+            self._linha("D190", CST_ICMS="000", CFOP=cfop, ALIQ_ICMS=aliquota(aliq), VL_OPR=centavos(valor),
+                        VL_BC_ICMS=centavos(valor), VL_ICMS=centavos(icms)),
+        ]
+
+    def __iter__(self):
+        """Linhas do arquivo (sem quebra de linha), geradas sob demanda."""
+        yield from self._bloco_0()
+
+        # Linhas fixas fora dos documentos: C001/C990, D001/D990, E001/E100/E110/E990, H001/H990, 1001/1990,
+        # 9001/9990/9999 e um 9900 por registro
+        fixas = 2 + 2 + 4 + 2 + 2 + 3 + len(CAMPOS_GERADOS)
+        restantes = max(self.linhas - sum(self.contagem.values()) - fixas, 0)
+        yield self._linha("C001", IND_MOV="0")
+        d_linhas = [] # Os conhecimentos vão para o bloco D, depois de todas as notas
+        geradas = 0
+        # Documentos distribuídos uniformemente pelos dias do mês (DT_DOC crescente, como no arquivo real)
+        while geradas < restantes:
+            dia = 1 + geradas * DIAS_NO_MES // restantes
+            if self.rng.random() < FRACAO_CTE:
+                conhecimento = self._conhecimento(dia)
+                d_linhas.extend(conhecimento)
+                geradas += len(conhecimento)
+            else:
+                nota = self._nota(dia)
+                geradas += len(nota)
+                yield from nota
+        yield self._linha("C990", QTD_LIN_C=self.contagem.get("C100", 0) + self.contagem.get("C170", 0)
+                          + self.contagem.get("C190", 0) + 2)
+
+        yield self._linha("D001", IND_MOV="0" if d_linhas else "1")
+        yield from d_linhas
+        yield self._linha("D990", QTD_LIN_D=len(d_linhas) + 2)
+
+        saldo = self.debitos - self.creditos
+        yield self._linha("E001", IND_MOV="0")
+        yield self._linha("E100", DT_INI=data(1), DT_FIN=data(DIAS_NO_MES))
+        yield self._linha("E110", VL_TOT_DEBITOS=centavos(self.debitos), VL_TOT_CREDITOS=centavos(self.creditos),
+                          VL_SLD_APURADO=centavos(max(saldo, 0)), VL_ICMS_RECOLHER=centavos(max(saldo, 0)),
+                          VL_SLD_CREDOR_TRANSPORTAR=centavos(max(-saldo, 0)))
+        yield self._linha("E990", QTD_LIN_E=4)
+        yield self._linha("H001", IND_MOV="1")
+        yield self._linha("H990", QTD_LIN_H=2)
+        yield self._linha("1001", IND_MOV="1")
+        yield self._linha("1990", QTD_LIN_1=2)
+
+        # Bloco 9: um 9900 por registro presente (incluindo os do próprio bloco 9)
+        yield self._linha("9001", IND_MOV="0")
+        registros = list(self.contagem) + ["9900", "9990", "9999"]
+        contagem_9 = {"9900": len(registros), "9990": 1, "9999": 1}
+        for registro in registros:
+            yield self._linha("9900", REG_BLC=registro, QTD_REG_BLC=contagem_9.get(registro, self.contagem.get(registro)))
+        yield self._linha("9990", QTD_LIN_9=len(registros) + 3)
+        yield self._linha("9999", QTD_LIN=sum(self.contagem.values()) + 1)
+
+
+def _acumulados(pesos):
+    acumulados, soma = [], 0
+    for peso in pesos:
+        soma += peso
+        acumulados.append(soma)
+    return acumulados
+
+
+def assinatura_sintetica(rng, linhas=40):
+    """Bloco de texto no lugar da assinatura digital (linhas que não começam com '|')."""
+    alfabeto = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+    return ["SBRCAAEPDR" + "".join(rng.choice(alfabeto) for _ in range(66))] + \
+           ["".join(rng.choice(alfabeto) for _ in range(76)) for _ in range(linhas - 1)]
+
+
+def gerar_sped(destino, linhas, semente=SEMENTE_PADRAO, assinatura=False, layout=None, tipos=None):
+    """Grava em `destino` um SPED sintético de aproximadamente `linhas` linhas (CRLF, latin-1).
+
+    A última nota pode passar do alvo em algumas linhas. Retorna a quantidade
+    de linhas gravadas (sem a assinatura).
+    """
+    gerador = GeradorSped(linhas, semente, layout, tipos)
+    bloco = []
+    with open(destino, "wb") as f:
+        for linha in gerador:
+            bloco.append(linha)
+            if len(bloco) >= LINHAS_POR_ESCRITA:
+                f.write(("\r\n".join(bloco) + "\r\n").encode("latin-1"))
+                bloco = []
+        if assinatura:
+            bloco += assinatura_sintetica(random.Random(semente))
+        f.write(("\r\n".join(bloco) + "\r\n").encode("latin-1"))
+    return sum(gerador.contagem.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera um arquivo SPED (EFD ICMS/IPI) sintético e determinístico.")
+    parser.add_argument("linhas", type=int, help="Quantidade aproximada de linhas (ex: 10000 a 10000000)")
+    parser.add_argument("-o", "--saida", help="Arquivo gerado (padrão: sped_sintetico_<linhas>.txt)")
+    parser.add_argument("--semente", type=int, default=SEMENTE_PADRAO, help="Semente do gerador (mesma semente, mesmo arquivo)")
+    parser.add_argument("--assinatura", action="store_true", help="Acrescenta um bloco no lugar da assinatura digital")
+    args = parser.parse_args()
+
+    destino = args.saida or f"sped_sintetico_{args.linhas}.txt"
+    inicio = time.perf_counter()
+    gravadas = gerar_sped(destino, args.linhas, args.semente, args.assinatura)
+    print(f"{destino}: {gravadas} linhas, {os.path.getsize(destino) / 1024**2:.1f} MB em {time.perf_counter() - inicio:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
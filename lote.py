@@ -0,0 +1,205 @@
+"""Processamento em lote (sem interface) de arquivos SPED.
+
+Valida, resume e converte cada arquivo em um processo separado (um arquivo
+por processo de cada vez), gravando os resultados na pasta de saída e um
+relatório com o status de cada arquivo.
+
+Uso (na raiz do projeto):
+    python lote.py PASTA_OU_PADRAO [...] -o PASTA_SAIDA [--acoes validar,resumir,converter]
+                   [--formato parquet|xlsx] [-j PROCESSOS] [--arquivos-por-processo N]
+
+Exemplos:
+    python lote.py clientes/2024/ -o saida/
+    python lote.py "clientes/**/SPED_*.txt" -o saida/ --acoes validar -j 16
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from modules.cubo import DIMENSOES
+from modules.documento import abrir_documento
+from modules.exportar import exportar_parquet, exportar_xlsx
+from modules.instrumentacao import concluir_execucao, iniciar_execucao
+from modules.layout import ARQUIVO_LAYOUT, ARQUIVO_TIPOS, carregar_catalogo, ler_tipos
+from modules.validar import validar_formatos
+
+ACOES = ["validar", "resumir", "converter"]
+ARQUIVOS_POR_PROCESSO = 20 # Processos são renovados depois deste número de arquivos (devolve a memória ao sistema)
+CAMPOS_RELATORIO = ["arquivo", "status", "linhas", "celulas_invalidas", "problemas_estrutura", "segundos", "saidas", "erro"]
+
+# Catálogo de layouts (do cache compilado) carregado uma vez em cada processo (ver _inicializar_processo)
+_layout = None
+_tipos = None
+
+
+def _inicializar_processo(arquivo_layout, arquivo_tipos):
+    global _layout, _tipos
+    _layout = carregar_catalogo(arquivo_layout)
+    _tipos = ler_tipos(arquivo_tipos)
+
+
+def listar_arquivos(entradas):
+    """Arquivos .txt das pastas, padrões glob (ex: 'pasta/**/*.txt') e arquivos informados, sem repetição."""
+    arquivos = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            encontrados = sorted(glob.glob(os.path.join(entrada, "*.txt")) + glob.glob(os.path.join(entrada, "*.TXT")))
+        elif os.path.isfile(entrada):
+            encontrados = [entrada]
+        else:
+            encontrados = sorted(glob.glob(entrada, recursive=True))
+        arquivos.extend(os.path.abspath(a) for a in encontrados if os.path.isfile(a))
+    return list(dict.fromkeys(arquivos))
+
+
+def bases_saida(arquivos, pasta_saida):
+    """Prefixo dos resultados de cada arquivo: o caminho relativo à pasta comum das entradas, sem a extensão.
+
+    Arquivos de mesmo nome em pastas diferentes (ex: 'clientes/**/SPED.txt') ficam
+    em subpastas espelhando as de origem. Lança ValueError se dois arquivos ainda
+    assim caírem no mesmo prefixo (ex: 'SPED.txt' e 'SPED.TXT').
+    """
+    raiz = os.path.commonpath([os.path.dirname(arquivo) for arquivo in arquivos])
+    bases = {}
+    usadas = {}
+    for arquivo in arquivos:
+        relativo = os.path.splitext(os.path.relpath(arquivo, raiz))[0]
+        anterior = usadas.setdefault(os.path.normcase(relativo).lower(), arquivo)
+        if anterior != arquivo:
+            raise ValueError(f"{anterior} e {arquivo} gravariam os mesmos arquivos de saída ({relativo}_*)")
+        bases[arquivo] = os.path.join(pasta_saida, relativo)
+    return bases
+
+
+def gravar_validacao(problemas, destino):
+    with open(destino, "w", newline="", encoding="utf-8") as f:
+        escritor = csv.writer(f, delimiter=";")
+        escritor.writerow(["REG", "CAMPO", "LINHA", "VALOR"])
+        for registro, campo, linhas, valores in problemas:
+            escritor.writerows(zip([registro] * len(linhas), [campo] * len(linhas), linhas.tolist(), valores))
+
+
+def processar_arquivo(caminho, base, acoes, formato):
+    """Executa as ações num arquivo (dentro de um processo do pool). Retorna o status para o relatório.
+
+    Os resultados são gravados como `base` + sufixo (ver bases_saida).
+    """
+    inicio = time.perf_counter()
+    iniciar_execucao(rotulo=caminho) # Etapas do arquivo (gravadas em PAINEL_SPED_TEMPOS, se definido)
+    status = {"arquivo": caminho, "status": "ok", "linhas": 0, "celulas_invalidas": "", "problemas_estrutura": "", "saidas": [], "erro": ""}
+    documento = None
+    try:
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        documento = abrir_documento(caminho, _layout, _tipos)
+        status["linhas"] = len(documento)
+
+        if "validar" in acoes:
+            problemas = validar_formatos(documento, liberar_registros=True)
+            status["celulas_invalidas"] = sum(len(linhas) for _, _, linhas, _ in problemas)
+            gravar_validacao(problemas, base + "_validacao.csv")
+            status["saidas"].append(base + "_validacao.csv")
+            estrutura = documento.validacao().tabela()
+            status["problemas_estrutura"] = len(estrutura)
+            estrutura.to_csv(base + "_estrutura.csv", sep=";", index=False, encoding="utf-8")
+            status["saidas"].append(base + "_estrutura.csv")
+
+        if "resumir" in acoes:
+            cubo = documento.cubo_resumo()
+            resumo = cubo.fatia(list(cubo.cubos), ["REG"] + DIMENSOES)
+            resumo.to_csv(base + "_resumo.csv", sep=";", decimal=",", index=False, encoding="utf-8")
+            status["saidas"].append(base + "_resumo.csv")
+
+        if "converter" in acoes:
+            if formato == "xlsx":
+                exportar_xlsx(documento, base + ".xlsx")
+                status["saidas"].append(base + ".xlsx")
+            else:
+                exportar_parquet(documento, base + "_parquet.zip")
+                status["saidas"].append(base + "_parquet.zip")
+    except Exception as e:
+        status["status"] = "erro"
+        status["erro"] = f"{type(e).__name__}: {e}"
+    finally:
+        if documento is not None:
+            documento.corpo.arquivo.fechar()
+        concluir_execucao()
+    status["segundos"] = round(time.perf_counter() - inicio, 2)
+    return status
+
+
+def gravar_relatorio(resultados, destino):
+    with open(destino, "w", newline="", encoding="utf-8") as f:
+        escritor = csv.DictWriter(f, fieldnames=CAMPOS_RELATORIO, delimiter=";")
+        escritor.writeheader()
+        for resultado in resultados:
+            escritor.writerow(dict(resultado, saidas=" ".join(resultado["saidas"])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Valida, resume e converte arquivos SPED em lote.")
+    parser.add_argument("entradas", nargs="+", help="Pastas (arquivos .txt), padrões glob ou arquivos SPED")
+    parser.add_argument("-o", "--saida", required=True, help="Pasta onde os resultados e o relatório são gravados")
+    parser.add_argument("--acoes", default=",".join(ACOES), help=f"Ações separadas por vírgula ({', '.join(ACOES)})")
+    parser.add_argument("--formato", choices=["parquet", "xlsx"], default="parquet", help="Formato da conversão")
+    parser.add_argument("-j", "--processos", type=int, default=os.cpu_count(), help="Arquivos processados em paralelo")
+    parser.add_argument("--arquivos-por-processo", type=int, default=ARQUIVOS_POR_PROCESSO,
+                        help="Arquivos por processo antes de renová-lo (limita a memória acumulada)")
+    parser.add_argument("--layout", default=ARQUIVO_LAYOUT, help="Arquivo descritivo principal do layout")
+    parser.add_argument("--tipos", default=ARQUIVO_TIPOS, help="Arquivo com os tipos dos campos")
+    args = parser.parse_args(argv)
+
+    acoes = [acao.strip() for acao in args.acoes.split(",") if acao.strip()]
+    desconhecidas = [acao for acao in acoes if acao not in ACOES]
+    if desconhecidas:
+        parser.error(f"ações desconhecidas: {', '.join(desconhecidas)}")
+
+    arquivos = listar_arquivos(args.entradas)
+    if not arquivos:
+        print("Nenhum arquivo SPED encontrado.", file=sys.stderr)
+        return 2
+    try:
+        bases = bases_saida(arquivos, args.saida)
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 2
+    os.makedirs(args.saida, exist_ok=True)
+
+    processos = max(1, min(args.processos or 1, len(arquivos)))
+    print(f"{len(arquivos)} arquivos, {processos} processos, ações: {', '.join(acoes)}")
+    inicio = time.perf_counter()
+    resultados = {}
+    with ProcessPoolExecutor(
+        max_workers=processos,
+        initializer=_inicializar_processo,
+        initargs=(args.layout, args.tipos),
+        max_tasks_per_child=args.arquivos_por_processo,
+    ) as pool:
+        futuros = {pool.submit(processar_arquivo, arquivo, bases[arquivo], acoes, args.formato): arquivo for arquivo in arquivos}
+        for n, futuro in enumerate(as_completed(futuros), start=1):
+            arquivo = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e: # Processo interrompido (ex: falta de memória)
+                resultado = {"arquivo": arquivo, "status": "erro", "linhas": 0, "celulas_invalidas": "", "problemas_estrutura": "",
+                             "saidas": [], "erro": f"{type(e).__name__}: {e}", "segundos": ""}
+            resultados[arquivo] = resultado
+            detalhe = resultado["erro"] if resultado["status"] == "erro" else (
+                f"{resultado['linhas']} linhas, {resultado['segundos']} s"
+                + (f", {resultado['celulas_invalidas']} células inválidas" if resultado["celulas_invalidas"] != "" else "")
+                + (f", {resultado['problemas_estrutura']} problemas estruturais" if resultado["problemas_estrutura"] != "" else "")
+            )
+            print(f"[{n}/{len(arquivos)}] {resultado['status'].upper():4} {os.path.relpath(bases[arquivo], args.saida)}: {detalhe}", flush=True)
+
+    relatorio = os.path.join(args.saida, "relatorio_lote.csv")
+    gravar_relatorio([resultados[arquivo] for arquivo in arquivos], relatorio)
+    erros = sum(1 for r in resultados.values() if r["status"] == "erro")
+    print(f"Concluído em {time.perf_counter() - inicio:.1f} s: {len(arquivos) - erros} ok, {erros} com erro. Relatório: {relatorio}")
+    return 1 if erros else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
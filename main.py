@@ -2,78 +2,136 @@ import streamlit as st
 import pandas as pd
 
 # Importar funções dos módulos
-from utils import ler_e_separar_sped, baixar_arquivo
+from utils import (
+    carregar_documento_sped, baixar_arquivo, sincronizar_workspace, conferir_memoria, id_sessao, modo_administrador,
+    obter_cache_documentos, obter_gerenciador_memoria,
+)
 from modules.visualizar import display_file_content
 from modules.alterar import handle_field_modification
 from modules.resumo import generate_summary
 from modules.converter import convert_to_spreadsheet
+from modules.consolidar import generate_consolidated_summary
+from modules.verificar import display_validation_report
+from modules.workspace import Workspace, chave_arquivo
+from modules.administracao import display_memory_panel, display_timing_panel
+from modules.instrumentacao import NIVEIS, NIVEL_PADRAO, concluir_execucao, iniciar_execucao
 
 st.set_page_config(page_title="Painel SPED", layout="wide")
 st.title("🧾 Painel de Manipulação de Arquivo SPED")
 
+# Etapas cronometradas desta execução (rerun), mostradas no fim da barra lateral
+execucao = iniciar_execucao(nivel=NIVEIS.get(st.session_state.get("instrumentacao_nivel"), NIVEL_PADRAO), sessao=id_sessao())
+
 # --- Upload e Leitura do Arquivo ---
-uploaded_file = st.file_uploader("📂 Envie seu arquivo SPED (.txt)", type=["txt"])
+uploaded_files = st.file_uploader(
+    "📂 Envie seu arquivo SPED (.txt) - ou vários, para consolidar períodos/estabelecimentos",
+    type=["txt"], accept_multiple_files=True
+)
+uploaded_file = uploaded_files[0] if uploaded_files else None
+
+if uploaded_files and len(uploaded_files) > 1:
+    # --- Vários arquivos: área de trabalho (lidos em paralelo, só os novos) ---
+    # Identificados pelo id do upload (não pelo nome): trocar um "SPED.txt" por outro também ressincroniza
+    ids_enviados = [chave_arquivo(arquivo) for arquivo in uploaded_files]
+    if st.session_state.get('uploaded_file_ids') != ids_enviados:
+        sincronizar_workspace(st.session_state.setdefault('workspace', Workspace()), uploaded_files)
+        st.session_state.uploaded_file_ids = ids_enviados
+    workspace = st.session_state.workspace
+    if len(workspace):
+        # As ações de arquivo único (visualizar, alterar, converter) usam o arquivo ativo
+        chave_ativa = st.sidebar.selectbox("Arquivo ativo:", [item.chave for item in workspace.ordenados()],
+                                           format_func=lambda chave: workspace[chave].nome, key="arquivo_ativo")
+        st.session_state.documento = workspace[chave_ativa].documento
+        st.session_state.uploaded_filename = workspace[chave_ativa].nome
+    else:
+        st.session_state.documento = None
 
 if uploaded_file is not None:
     # Usar st.session_state para manter os dados entre interações
-    # Recarregar apenas se o nome do arquivo mudar
-    if 'uploaded_filename' not in st.session_state or st.session_state.uploaded_filename != uploaded_file.name:
-        st.session_state.corpo_sped, st.session_state.assinatura = ler_e_separar_sped(uploaded_file)
+    # Recarregar apenas se outro upload chegar (ou se a área de trabalho de vários arquivos foi desfeita).
+    # O upload é identificado pelo id do Streamlit, não pelo nome: dois arquivos "SPED.txt" diferentes não se confundem
+    id_upload = getattr(uploaded_file, "file_id", uploaded_file.name)
+    if len(uploaded_files) == 1 and (
+        st.session_state.get('uploaded_file_id') != id_upload or 'workspace' in st.session_state
+    ):
+        for key in ('workspace', 'uploaded_file_ids'):
+            st.session_state.pop(key, None)
+        # O documento é separado por registro uma única vez; as ações leem dele
+        st.session_state.documento = carregar_documento_sped(uploaded_file)
         st.session_state.uploaded_filename = uploaded_file.name
+        st.session_state.uploaded_file_id = id_upload
         # Mostrar mensagem sobre assinatura após a leitura inicial
-        if st.session_state.assinatura is not None:
-            if st.session_state.assinatura:
-                 st.sidebar.success(f"Assinatura detectada e preservada.")
+        if st.session_state.documento is not None:
+            if st.session_state.documento.assinatura:
+                 st.sidebar.success("Assinatura detectada e preservada.")
             else:
                  st.sidebar.warning("Assinatura não detectada ou formato não reconhecido.")
 
     # --- Menu Lateral e Chamada das Ações ---
-    if st.session_state.get('corpo_sped') is not None: # Verifica se corpo foi carregado
+    if st.session_state.get('documento') is not None: # Verifica se o documento foi carregado
         st.sidebar.title("Menu de Ações")
         acoes = [
             "Visualizar Arquivo",
             "Alterar Campos",
             "Gerar Resumo",
-            "Converter para Excel/CSV"
+            "Converter para Excel/CSV",
+            "Validar Estrutura"
         ]
+        if 'workspace' in st.session_state:
+            acoes.append("Resumo Consolidado")
         acao_selecionada = st.sidebar.radio(
             "Escolha o que deseja fazer:",
             acoes,
             key="acao_radio",
             # index=None # Descomentar se quiser que nada seja selecionado por padrão
         )
+        execucao.rotulo = acao_selecionada
 
         # Container principal para exibir o conteúdo da ação
         main_container = st.container()
 
+        documento = st.session_state.documento
+        documento.iniciar_indice_texto() # Índice de busca de texto montado em segundo plano (só na primeira vez)
+        # Orçamento de memória do servidor: registros frios (desta e de sessões ociosas) vão para o disco se ele estourar
+        if 'workspace' in st.session_state:
+            conferir_memoria({item.nome: item.documento for item in st.session_state.workspace.ordenados()})
+        else:
+            conferir_memoria({st.session_state.uploaded_filename: documento})
+
         with main_container:
             if acao_selecionada == "Visualizar Arquivo":
-                display_file_content(st.session_state.corpo_sped, st.session_state.assinatura)
+                display_file_content(documento)
 
             elif acao_selecionada == "Alterar Campos":
-                # A função de alteração retorna o corpo modificado
-                novo_corpo = handle_field_modification(st.session_state.corpo_sped, st.session_state.assinatura)
-                # Atualiza o estado da sessão se houve modificação REAL
-                if novo_corpo is not st.session_state.corpo_sped: # Usar 'is not' para checar se é o mesmo objeto (lista)
-                    st.session_state.corpo_sped = novo_corpo
+                # A função de alteração modifica o documento da sessão e indica se houve modificação REAL
+                if handle_field_modification(documento):
                     st.success("Estado do arquivo atualizado na sessão.") # Feedback que a sessão foi atualizada
                     # st.rerun() # Opcional: Força rerun para UI refletir imediatamente, pode ter efeitos colaterais
 
             elif acao_selecionada == "Gerar Resumo":
-                generate_summary(st.session_state.corpo_sped, st.session_state.assinatura)
+                generate_summary(documento)
 
             elif acao_selecionada == "Converter para Excel/CSV":
-                convert_to_spreadsheet(st.session_state.corpo_sped, st.session_state.assinatura)
+                convert_to_spreadsheet(documento)
+
+            elif acao_selecionada == "Validar Estrutura":
+                display_validation_report(documento)
+
+            elif acao_selecionada == "Resumo Consolidado":
+                generate_consolidated_summary(st.session_state.workspace)
 
         # --- Download do Arquivo Atual (sempre disponível na sidebar) ---
         st.sidebar.markdown("---")
         st.sidebar.markdown("**Arquivo Atual na Sessão:**")
         # Passa o nome original para o botão de download
         nome_arquivo_download = f"sped_atual_{st.session_state.uploaded_filename}" if st.session_state.get('uploaded_filename') else "sped_atual.txt"
-        baixar_arquivo(st.session_state.corpo_sped, st.session_state.assinatura, nome_arquivo=nome_arquivo_download)
+        baixar_arquivo(documento, nome_arquivo=nome_arquivo_download, key="download_sidebar")
+
+        if modo_administrador():
+            display_memory_panel(obter_gerenciador_memoria(), obter_cache_documentos(), id_sessao())
 
     else:
-        # Se a leitura falhou (corpo_sped é None)
+        # Se a leitura falhou (documento é None)
         st.warning("Não foi possível processar o arquivo. Verifique o formato ou tente novamente.")
         # Limpar estado para permitir novo upload
         for key in list(st.session_state.keys()):
@@ -87,4 +145,6 @@ else:
         for key in list(st.session_state.keys()):
             del st.session_state[key]
     else:
-         st.info("Envie um arquivo SPED .txt para iniciar.") 
\ No newline at end of file
+         st.info("Envie um arquivo SPED .txt para iniciar.") 
+
+display_timing_panel(concluir_execucao())
\ No newline at end of file
@@ -0,0 +1,97 @@
+import time
+from collections import deque
+
+import streamlit as st
+import pandas as pd
+
+from modules.instrumentacao import DESLIGADO, NIVEIS, NIVEL_PADRAO, etapas_fora_de_execucao, jsonl
+
+# --- Painéis de diagnóstico da barra lateral: tempos da execução e memória do servidor (só com PAINEL_SPED_ADMIN=1) ---
+
+EXECUCOES_NO_HISTORICO = 50 # Execuções da sessão guardadas para o download em JSON lines
+
+def _mb(quantidade):
+    return f"{quantidade / 1024**2:,.1f} MB".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def display_memory_panel(gerenciador, cache, sessao_atual=None):
+    """Memória de cada sessão (documentos, registros montados e despejados) e do cache de documentos."""
+    with st.sidebar.expander("🛠️ Memória do servidor"):
+        pegadas = pd.DataFrame(gerenciador.pegadas(), columns=["SESSAO", "ARQUIVO", "BYTES", "REGISTROS", "DESPEJADOS", "OCIOSA_S"])
+        total = int(pegadas["BYTES"].sum()) if len(pegadas) else 0
+        st.metric("Sessões (memória própria)", _mb(total), help=f"Limite: {_mb(gerenciador.limite)}")
+        st.progress(min(total / gerenciador.limite, 1.0) if gerenciador.limite else 1.0)
+
+        if len(pegadas):
+            pegadas["SESSAO"] = [("▶ " if sessao == sessao_atual else "") + str(sessao)[:8] for sessao in pegadas["SESSAO"]]
+            pegadas["MEMORIA"] = pegadas["BYTES"].map(_mb)
+            st.dataframe(
+                pegadas.sort_values("BYTES", ascending=False)[["SESSAO", "ARQUIVO", "MEMORIA", "REGISTROS", "DESPEJADOS", "OCIOSA_S"]],
+                hide_index=True, use_container_width=True,
+            )
+        st.caption(f"{gerenciador.despejos} registro(s) despejados até agora ({_mb(gerenciador.bytes_despejados)}).")
+
+        estatisticas = cache.estatisticas()
+        st.caption(
+            f"Cache de documentos: {estatisticas['documentos_memoria']} em memória ({_mb(estatisticas['bytes_memoria'])}), "
+            f"{estatisticas['documentos_disco']} em disco ({_mb(estatisticas['bytes_disco'])}); "
+            f"{estatisticas['acertos_memoria'] + estatisticas['acertos_disco']} reaberturas sem leitura, {estatisticas['leituras']} leituras."
+        )
+
+        if st.button("Despejar agora os registros frios", key="admin_despejar"):
+            liberados = gerenciador.conferir(sessao_atual, limite=0)
+            st.success(f"{_mb(liberados)} liberados.")
+
+
+def _tabela_etapas(etapas, duracao_total):
+    linhas = []
+    for etapa in sorted(etapas, key=lambda e: e.inicio):
+        segundos = etapa.duracao or 0.0
+        linhas.append({
+            "ETAPA": "· " * etapa.profundidade + etapa.nome,
+            "MS": round(segundos * 1000, 1),
+            "%": round(100 * segundos / duracao_total, 1) if duracao_total and not etapa.profundidade else None,
+            "LINHAS": etapa.linhas,
+            "MB": round(etapa.bytes / 1024**2, 2) if etapa.bytes else None,
+            "MB/S": round(etapa.bytes / 1024**2 / segundos, 1) if etapa.bytes and segundos else None,
+            "DETALHES": ", ".join(f"{chave}={valor}" for chave, valor in etapa.detalhes.items()),
+        })
+    return pd.DataFrame(linhas)
+
+
+def display_timing_panel(execucao):
+    """Etapas cronometradas desta execução (rerun), o nível da instrumentação e o download em JSON lines.
+
+    `execucao` é a Execucao já concluída (ver instrumentacao.concluir_execucao).
+    """
+    historico = st.session_state.setdefault("instrumentacao_historico", deque(maxlen=EXECUCOES_NO_HISTORICO))
+    if execucao is not None and execucao.nivel > DESLIGADO:
+        historico.append(execucao)
+
+    with st.sidebar.expander("⏱️ Tempos desta execução"):
+        nomes_niveis = list(NIVEIS)
+        st.selectbox(
+            "Instrumentação", nomes_niveis, index=nomes_niveis.index(next(n for n, v in NIVEIS.items() if v == NIVEL_PADRAO)),
+            key="instrumentacao_nivel", help="'detalhado' mede também cada bloco/registro e escreve as etapas na saída do servidor."
+        )
+        if execucao is None or execucao.nivel == DESLIGADO:
+            st.caption("Instrumentação desligada.")
+            return
+
+        st.caption(f"Execução '{execucao.rotulo or '-'}': {execucao.duracao * 1000:,.0f} ms, {len(execucao.etapas)} etapa(s).")
+        if execucao.etapas:
+            st.dataframe(_tabela_etapas(execucao.etapas, execucao.duracao), hide_index=True, use_container_width=True)
+        for instante, mensagem, campos in execucao.eventos:
+            st.caption(f"{time.strftime('%H:%M:%S', time.localtime(instante))} {mensagem} "
+                       + " ".join(f"{chave}={valor}" for chave, valor in campos.items()))
+
+        fundo = etapas_fora_de_execucao()
+        if fundo:
+            st.markdown("**Em segundo plano (todas as sessões):**")
+            st.dataframe(_tabela_etapas(fundo[-20:], None), hide_index=True, use_container_width=True)
+
+        st.download_button(
+            "📥 Baixar tempos (JSON lines)",
+            data=lambda: jsonl(list(historico)),
+            file_name="tempos_painel_sped.jsonl", mime="application/x-ndjson", key="instrumentacao_download",
+        )
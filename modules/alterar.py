@@ -1,37 +1,98 @@
 import streamlit as st
+import numpy as np
 import pandas as pd # Importar pandas se for usado para preview ou validação futura
-from utils import baixar_arquivo, load_sped_layout # Importar load_sped_layout
-
-def handle_field_modification(corpo_sped, assinatura):
-    """Interface e lógica para alterar campos específicos no SPED usando layout dinâmico."""
+from utils import baixar_arquivo
+from modules.decodificar import decodificar_coluna, descrever_tipo
+from modules.documento import linhas_em, valor_invalido_para_campo
+from modules.indices import MODOS_FILTRO, filtrar_posicoes
+from modules.instrumentacao import medir
+from modules.selecao import Selecao
+from modules.verificar import exibir_status_validacao
+
+LIMITE_PREVIEW_ALTERADAS = 1000 # Linhas exibidas na pré-visualização após aplicar uma alteração
+CAMPOS_FILTRO_PAI = ["CHV_NFE", "CHV_CTE", "NUM_DOC", "SER", "DT_DOC", "COD_PART", "IND_OPER", "COD_SIT", "DT_INV", "COD_ITEM"]
+
+def obter_selecao(documento, store):
+    """Seleção (bitset) das linhas do registro, guardada na sessão enquanto o documento for o mesmo."""
+    selecoes = st.session_state.get("selecoes")
+    if selecoes is None or selecoes["documento"] is not documento:
+        selecoes = st.session_state.selecoes = {"documento": documento}
+    if store.registro not in selecoes:
+        selecoes[store.registro] = Selecao(len(store))
+    return selecoes[store.registro]
+
+
+def filtrar_por_texto(documento, indices, termo):
+    """Os `indices` cujas linhas contêm `termo` (diferenciando maiúsculas), e as linhas do arquivo todo com ele.
+
+    Com o índice de texto pronto, consulta todas as linhas do arquivo de uma vez; sem ele, verifica o texto apenas
+    das linhas de `indices` e a segunda parte volta None. Os dois caminhos dão o mesmo resultado, inclusive para
+    termos com caracteres fora do latin-1 (que nenhuma linha do arquivo original contém).
+    """
+    indices = np.asarray(indices, dtype=np.uint32)
+    if documento.indice_texto() is not None:
+        linhas_texto = documento.linhas_com_texto(termo, diferenciar_maiusculas=True)
+        return indices[np.isin(indices, linhas_texto)], linhas_texto
+    contem = np.fromiter((termo in l for l in linhas_em(documento.corpo, indices)), dtype=bool, count=len(indices))
+    return indices[contem], None
+
+
+def _alternar_selecao(selecao, posicao, chave_checkbox):
+    if st.session_state[chave_checkbox]:
+        selecao.marcar([posicao])
+    else:
+        selecao.desmarcar([posicao])
+
+
+def exibir_historico_alteracoes(documento):
+    """Botões Desfazer/Refazer e tabela das alterações feitas até agora (journal do documento)."""
+    col_desfazer, col_refazer, col_info = st.columns([1, 1, 4])
+    with col_desfazer:
+        if st.button("↩️ Desfazer", disabled=not documento.pode_desfazer(), key="btn_desfazer"):
+            lote = documento.desfazer()
+            st.success(f"Desfeito: {lote.registro}.{lote.nome_campo} em {len(lote)} linhas.")
+    with col_refazer:
+        if st.button("↪️ Refazer", disabled=not documento.pode_refazer(), key="btn_refazer"):
+            lote = documento.refazer()
+            st.success(f"Refeito: {lote.registro}.{lote.nome_campo} = '{lote.novo_valor}' em {len(lote)} linhas.")
+
+    historico = documento.historico()
+    with col_info:
+        st.caption(f"{len(historico)} alteração(ões) aplicada(s), {sum(len(lote) for lote in historico)} linha(s) modificada(s).")
+    if historico:
+        with st.expander("Ver alterações feitas até agora"):
+            st.dataframe(pd.DataFrame(
+                [(n + 1, lote.registro, lote.nome_campo, lote.novo_valor, len(lote)) for n, lote in enumerate(historico)],
+                columns=["Lote", "Registro", "Campo", "Novo Valor", "Linhas"]
+            ), hide_index=True, use_container_width=True)
+            entradas = documento.alteracoes(limite=LIMITE_PREVIEW_ALTERADAS)
+            st.dataframe(pd.DataFrame(
+                [(idx + 1, reg, campo, antigo, novo) for idx, reg, campo, antigo, novo in entradas],
+                columns=["Linha", "Registro", "Campo", "Valor Antigo", "Valor Novo"]
+            ), hide_index=True, use_container_width=True)
+
+def handle_field_modification(documento):
+    """Interface e lógica para alterar campos específicos no SPED usando layout dinâmico.
+
+    Altera o SpedDocument da sessão diretamente e retorna True se alguma linha foi modificada.
+    """
     st.subheader("✏️ Alterar Campos Específicos")
 
-    # Carrega o layout do arquivo descritivo
-    print("[DEBUG] Entrando em handle_field_modification") # Log
-    sped_layout = load_sped_layout() # Usa o caminho padrão "sped_descricao/sped_descritivo.txt"
+    # O layout já foi carregado junto com o documento (no upload)
+    sped_layout = documento.layout
     if not sped_layout:
         st.error("Não foi possível carregar o layout do SPED. Verifique o arquivo descritivo.")
-        print("[DEBUG] Layout não carregado, saindo de handle_field_modification") # Log
-        return corpo_sped # Não pode continuar sem layout
-    print("[DEBUG] Layout SPED carregado em handle_field_modification") # Log
-
-    # Tenta extrair todos os tipos de registro do corpo
-    tipos_registro = []
-    print("[DEBUG] Iniciando extração de tipos de registro...") # Log
-    try:
-        tipos_registro = sorted(list(set(l.split('|')[1] for l in corpo_sped if l.startswith('|') and len(l.split('|')) > 1 and l.split('|')[1] in sped_layout)))
-        # Filtra para mostrar apenas registros que existem no layout carregado
-        print(f"[DEBUG] Tipos de registro encontrados no SPED e no layout: {tipos_registro}") # Log
-    except IndexError as ie:
-        st.warning("Erro de índice ao processar registros. Verifique o formato do arquivo SPED.")
-        print(f"[DEBUG] Erro de índice ao extrair tipos de registro: {ie}") # Log
-    except Exception as e:
-        st.error(f"Erro inesperado ao ler registros: {e}")
-        print(f"[DEBUG] Erro geral ao extrair tipos de registro: {e}") # Log
+        return False # Não pode continuar sem layout
+
+    # Histórico (journal) das alterações já aplicadas, com desfazer/refazer
+    exibir_historico_alteracoes(documento)
+
+    # Registros presentes no corpo e no layout (já separados na leitura do arquivo)
+    tipos_registro = documento.tipos_registro()
 
     if not tipos_registro:
         st.warning("Nenhum tipo de registro válido (presente no layout) encontrado no corpo do arquivo.")
-        return corpo_sped
+        return False
 
     # --- Seleção de Registro ---
     registro_escolhido = st.selectbox(
@@ -45,7 +106,7 @@ def handle_field_modification(corpo_sped, assinatura):
 
     if not registro_escolhido:
         st.info("Selecione um tipo de registro para definir filtros e campos.")
-        return corpo_sped
+        return False
 
     # --- Filtros Dinâmicos (Baseado nos campos do layout para o registro escolhido) ---
     st.markdown("**2. Filtros (Opcional):**")
@@ -63,119 +124,123 @@ def handle_field_modification(corpo_sped, assinatura):
             with cols[col_idx % 3]:
                  valor_filtro = st.text_input(f"Filtrar por {nome_campo}", key=f"filtro_{registro_escolhido}_{nome_campo}")
                  if valor_filtro:
-                     # Armazena o índice base 1 do layout
-                     indice_campo = campos_registro_atual[nome_campo]
-                     filtros_ativos[indice_campo] = valor_filtro
+                     filtros_ativos[nome_campo] = valor_filtro
             col_idx += 1
 
+    modo_filtro = st.radio(
+        "Como comparar os filtros por campo:",
+        MODOS_FILTRO,
+        horizontal=True,
+        key=f"modo_filtro_{registro_escolhido}",
+        help="'Igual' e 'Começa com' usam o índice do campo diretamente; 'Contém' é o comportamento tradicional."
+    )
+
+    # Filtro pelos campos do registro pai (ex: itens C170 de uma nota C100, pela CHV_NFE ou DT_DOC)
+    registro_pai = documento.registro_pai(registro_escolhido)
+    filtros_pai = {}
+    campos_pai = [c for c in sped_layout.get(registro_pai, {}) if c in CAMPOS_FILTRO_PAI] if registro_pai else []
+    if campos_pai:
+        with st.expander(f"Filtrar pelo registro pai ({registro_pai})"):
+            cols_pai = st.columns(3)
+            for n, nome_campo in enumerate(campos_pai):
+                with cols_pai[n % 3]:
+                    valor_filtro = st.text_input(f"{registro_pai}.{nome_campo}", key=f"filtro_pai_{registro_escolhido}_{nome_campo}")
+                    if valor_filtro:
+                        filtros_pai[nome_campo] = valor_filtro
+
     # Adicionar um filtro genérico por texto (busca em qualquer campo da linha)
     filtro_geral = st.text_input("Filtrar por texto em qualquer parte da linha", key=f"filtro_geral_{registro_escolhido}")
 
     # --- Filtragem das Linhas --- #
-    linhas_filtradas_indices = [] # Guarda tupla (índice original, linha completa)
-    linhas_para_mostrar = []      # Guarda tupla (índice original, texto preview)
-    print(f"[DEBUG] Iniciando filtragem para registro {registro_escolhido}...") # Log
-
-    for idx, l in enumerate(corpo_sped):
-        if l.startswith(f"|{registro_escolhido}|"):
-            # Log a cada X linhas para não poluir muito
-            if idx % 1000 == 0:
-                print(f"[DEBUG] Filtrando linha {idx+1}...")
-            partes = l.split("|")
-            try:
-                match_all_filters = True
-                # Verifica filtros específicos por campo
-                for indice_campo_layout, valor_filtro in filtros_ativos.items():
-                    # Valida se o índice do layout existe na linha atual
-                    if not (indice_campo_layout < len(partes) and valor_filtro in partes[indice_campo_layout]):
-                        match_all_filters = False
-                        break
-                # Verifica filtro geral (se todos os filtros específicos passaram)
-                if match_all_filters and filtro_geral:
-                    if filtro_geral not in l:
-                        match_all_filters = False
-
-                if match_all_filters:
-                    linhas_filtradas_indices.append((idx, l))
-                    # Cria preview mostrando a linha completa, sem número
-                    # Usamos 'l' diretamente pois já é a linha original completa
-                    preview_txt = l
-                    linhas_para_mostrar.append((idx, preview_txt))
-
-            except IndexError:
-                 st.warning(f"Linha {idx+1} do registro {registro_escolhido} parece mal formatada. Pulando filtros.")
-                 print(f"[DEBUG] Warning: Linha {idx+1} mal formatada (IndexError) no filtro: {l[:50]}...") # Log
-                 continue
-            except Exception as e:
-                 st.error(f"Erro ao processar linha {idx+1}: {e}")
-                 print(f"[DEBUG] Erro processando linha {idx+1} no filtro: {e} - Linha: {l[:50]}...") # Log
-                 continue
-
-    print(f"[DEBUG] Filtragem concluída. {len(linhas_filtradas_indices)} linhas encontradas.") # Log
-    st.markdown(f"#### {len(linhas_filtradas_indices)} Registros Encontrados para '{registro_escolhido}' (após filtros)")
+    # Filtros por campo: índices invertidos (valor -> linhas) do registro, montados no primeiro uso
+    store = documento.registro(registro_escolhido)
+    with medir("filtrar", registro=registro_escolhido, filtros=len(filtros_ativos) + len(filtros_pai) + bool(filtro_geral)) as etapa:
+        corpo_sped = documento.corpo
+        posicoes_filtradas = filtrar_posicoes(store, filtros_ativos, modo_filtro)
+        if filtros_pai:
+            # Filhos das linhas do pai que passaram nos filtros (faixas contíguas do índice hierárquico)
+            posicoes_filtradas = np.intersect1d(
+                posicoes_filtradas, documento.filtrar_por_pai(registro_escolhido, registro_pai, filtros_pai, modo_filtro)
+            )
+        indices_filtrados = store.linhas[posicoes_filtradas] # Índices originais (base 0)
+
+        # Filtro geral (ver filtrar_por_texto); com o índice de texto pronto, mostra também em que outros registros
+        # o texto aparece
+        linhas_texto = None
+        if filtro_geral:
+            indices_filtrados, linhas_texto = filtrar_por_texto(documento, indices_filtrados, filtro_geral)
+        if linhas_texto is not None:
+            codigos, quantidades = np.unique(documento.hierarquia.registro_linha[linhas_texto], return_counts=True)
+            outros = [(documento.hierarquia.registros[codigo], qtd) for codigo, qtd in zip(codigos.tolist(), quantidades.tolist())
+                      if codigo >= 0 and documento.hierarquia.registros[codigo] != registro_escolhido]
+            if outros:
+                outros.sort(key=lambda item: -item[1])
+                st.caption("O texto também aparece em: " + ", ".join(f"{reg} ({qtd})" for reg, qtd in outros))
+        etapa.linhas = len(indices_filtrados)
+
+    st.markdown(f"#### {len(indices_filtrados)} Registros Encontrados para '{registro_escolhido}' (após filtros)")
     aplicar_em_todos = st.checkbox("✅ Aplicar a alteração em todos os registros filtrados (ignorar seleção manual)")
 
 
-    if not linhas_filtradas_indices:
+    if not len(indices_filtrados):
         st.info("Nenhuma linha corresponde aos filtros aplicados.")
-        return corpo_sped
+        return False
 
     # --- Seleção de Linhas --- #
+    # A seleção é um bitset sobre as posições do registro (ver Selecao): o tamanho na sessão não depende de
+    # quantas linhas foram marcadas, e os checkboxes usam uma chave por posição na página, não por linha
     st.markdown("**3. Selecione os Registros para Alterar:**")
-    selecionados_indices_set = set(st.session_state.get(f'selecionados_{registro_escolhido}', [])) # Usa um set para gestão
+    selecao = obter_selecao(documento, store)
+    posicoes_visiveis = np.searchsorted(store.linhas, indices_filtrados) # Posições no registro das linhas filtradas
+
+    col_todos, col_nenhum, col_inverter, col_limpar = st.columns(4)
+    if col_todos.button("☑️ Marcar todos os filtrados", key=f"sel_todos_{registro_escolhido}"):
+        selecao.marcar(posicoes_visiveis)
+    if col_nenhum.button("⬜ Desmarcar os filtrados", key=f"sel_nenhum_{registro_escolhido}"):
+        selecao.desmarcar(posicoes_visiveis)
+    if col_inverter.button("🔁 Inverter entre os filtrados", key=f"sel_inverter_{registro_escolhido}"):
+        selecao.inverter(posicoes_visiveis)
+    if col_limpar.button("🧹 Limpar seleção", key=f"sel_limpar_{registro_escolhido}"):
+        selecao.limpar()
+
+    if campos_pai:
+        with st.expander(f"Marcar os {registro_escolhido} de uma lista de registros pai ({registro_pai})"):
+            campo_lista = st.selectbox(f"Campo do {registro_pai}", campos_pai, key=f"sel_pai_campo_{registro_escolhido}")
+            valores_lista = st.text_area("Valores (um por linha)", key=f"sel_pai_valores_{registro_escolhido}")
+            if st.button("Marcar os filhos desses registros", key=f"sel_pai_marcar_{registro_escolhido}"):
+                valores = [valor.strip() for valor in valores_lista.splitlines() if valor.strip()]
+                filhos = documento.filhos_dos_pais(registro_escolhido, registro_pai, campo_lista, valores)
+                selecao.marcar(filhos)
+                st.caption(f"{len(filhos)} linha(s) de {registro_escolhido} marcadas (filhos de {len(valores)} valor(es) informados).")
 
     with st.expander("Mostrar/Ocultar Registros Filtrados", expanded=True):
-        select_all_key = f'select_all_val_{registro_escolhido}'
-        select_all_state = st.session_state.get(select_all_key, False)
-        select_all = st.checkbox("Selecionar/Deselecionar Todos Visíveis Nesta Página", value=select_all_state, key=f"select_all_cb_{registro_escolhido}")
-        st.session_state[select_all_key] = select_all # Atualiza o estado
-
         st.write("--- Registros Filtrados ---")
         # Paginação simples
         items_per_page = 50
-        total_items = len(linhas_para_mostrar)
+        total_items = len(indices_filtrados)
         total_pages = (total_items + items_per_page - 1) // items_per_page
         page_number = st.number_input('Página', min_value=1, max_value=max(1, total_pages), value=1, step=1, key=f'page_{registro_escolhido}')
 
         start_idx = (page_number - 1) * items_per_page
         end_idx = start_idx + items_per_page
-        linhas_pagina_atual = linhas_para_mostrar[start_idx:end_idx]
-        indices_pagina_atual = {idx for idx, _ in linhas_pagina_atual} # Set dos índices na página atual
-
-        # Lógica para aplicar/desaplicar Select All APENAS na página atual
-        aplicar_select_all_nesta_pagina = st.session_state.get(f'select_all_pressed_{registro_escolhido}', False)
-        if select_all != st.session_state.get(f'last_select_all_state_{registro_escolhido}', None):
-             aplicar_select_all_nesta_pagina = True
-             st.session_state[f'last_select_all_state_{registro_escolhido}'] = select_all
-
-        for original_idx, preview_txt in linhas_pagina_atual:
-            chave_checkbox = f"chk_{original_idx}"
-            is_selected = original_idx in selecionados_indices_set
-
-            # Inicializa só no primeiro render daquele item
-            if chave_checkbox not in st.session_state:
-                st.session_state[chave_checkbox] = is_selected
-
-            # >>> ponto crucial: FORCE o estado quando "Selecionar todos" mudar
-            if aplicar_select_all_nesta_pagina:
-                st.session_state[chave_checkbox] = select_all
-
-            # Agora renderiza SEM 'value=', pois o estado já está em session_state
-            selecionado = st.checkbox(preview_txt, key=chave_checkbox)
-
-            # Sincroniza o set global conforme o estado do widget
-            if selecionado:
-                selecionados_indices_set.add(original_idx)
-            else:
-                selecionados_indices_set.discard(original_idx)
-                
-        # Reseta o flag de aplicação do select all da página
-        st.session_state[f'select_all_pressed_{registro_escolhido}'] = False
-
-        # Guarda o set atualizado na session state (convertido para lista para serialização)
-        st.session_state[f'selecionados_{registro_escolhido}'] = list(selecionados_indices_set)
-
-        st.caption(f"Mostrando {len(linhas_pagina_atual)} de {total_items} registros filtrados (Página {page_number}/{total_pages}). Total selecionado: {len(selecionados_indices_set)}")
+        posicoes_pagina = posicoes_visiveis[start_idx:end_idx]
+        col_marcar_pagina, col_desmarcar_pagina = st.columns(2)
+        if col_marcar_pagina.button("Marcar esta página", key=f"sel_pagina_{registro_escolhido}"):
+            selecao.marcar(posicoes_pagina)
+        if col_desmarcar_pagina.button("Desmarcar esta página", key=f"desel_pagina_{registro_escolhido}"):
+            selecao.desmarcar(posicoes_pagina)
+
+        # Decodifica somente as linhas da página atual (preview = linha completa, sem número)
+        indices_pagina = indices_filtrados[start_idx:end_idx]
+        marcadas = selecao.contem(posicoes_pagina).tolist()
+        for slot, (posicao, marcada, preview_txt) in enumerate(zip(posicoes_pagina.tolist(), marcadas, linhas_em(corpo_sped, indices_pagina))):
+            chave_checkbox = f"sel_{registro_escolhido}_{slot}"
+            st.session_state[chave_checkbox] = marcada # O bitset é a referência; o clique volta para ele no callback
+            st.checkbox(preview_txt, key=chave_checkbox, on_change=_alternar_selecao, args=(selecao, posicao, chave_checkbox))
+
+        marcadas_filtradas = int(selecao.contem(posicoes_visiveis).sum())
+        st.caption(f"Mostrando {len(indices_pagina)} de {total_items} registros filtrados (Página {page_number}/{total_pages}). "
+                   f"Total selecionado: {len(selecao)} ({marcadas_filtradas} entre os filtrados)")
 
     st.markdown("---") # Separador visual
 
@@ -185,7 +250,7 @@ def handle_field_modification(corpo_sped, assinatura):
 
     if not campos_alteraveis:
         st.info(f"Não há campos definidos no layout para alteração no registro {registro_escolhido}.")
-        return corpo_sped
+        return False
 
     col_campo, col_valor = st.columns(2)
     with col_campo:
@@ -197,61 +262,56 @@ def handle_field_modification(corpo_sped, assinatura):
             key=f"campo_alt_{registro_escolhido}"
         )
     with col_valor:
+        tipo_campo = documento.tipo_campo(registro_escolhido, campo_nome) if campo_nome else None
         help_text = f"Posição (base 1): {campos_registro_atual.get(campo_nome, 'N/A')} no registro {registro_escolhido}"
+        if tipo_campo is not None:
+            help_text += f" - Formato: {descrever_tipo(tipo_campo)}"
         # Correção da f-string aqui:
         novo_valor = st.text_input(
-            f"Novo valor para '{campo_nome or ""}'?", # f-string corrigida
+            f"Novo valor para '{campo_nome or ''}'?", # f-string corrigida
             help=help_text,
             key=f"valor_alt_{registro_escolhido}"
         )
-
-    # Usa o set atualizado para verificar se algo está selecionado
-    aplicar_desabilitado = not selecionados_indices_set or not campo_nome
+        # '|' ou quebra de linha dentro do valor deslocariam os campos seguintes: a alteração é bloqueada
+        valor_proibido = valor_invalido_para_campo(novo_valor)
+        if valor_proibido:
+            st.error("O novo valor não pode conter '|' nem quebras de linha (separam os campos e as linhas do SPED).")
+        # Mesmo decodificador usado no resumo/exportação: avisa se o valor não segue o formato do layout
+        elif tipo_campo is not None and novo_valor and decodificar_coluna([novo_valor], tipo_campo)[1][0]:
+            st.warning(f"'{novo_valor}' não segue o formato do campo {campo_nome} ({descrever_tipo(tipo_campo)}).")
+
+    aplicar_desabilitado = (not selecao and not aplicar_em_todos) or not campo_nome or valor_proibido
     if st.button("Aplicar Alteração nos Registros Selecionados", disabled=aplicar_desabilitado, key=f"btn_aplicar_{registro_escolhido}"):
 
         if not campo_nome: # Verificação extra
             st.warning("Selecione um campo para alterar.")
-            return corpo_sped
+            return False
 
         indice_campo_alterar = campos_registro_atual[campo_nome] # Índice base 1
-        linhas_modificadas_count = 0
-        novo_corpo_sped = list(corpo_sped) # Cria cópia para modificar
-        linhas_alteradas_preview_list = []
-        erros_alteracao = []
 
-        # Usa os índices do set que está no session state
         if aplicar_em_todos:
-            indices_para_alterar = [idx for idx, _ in linhas_filtradas_indices]
+            indices_para_alterar = indices_filtrados
         else:
-            indices_para_alterar = list(st.session_state.get(f'selecionados_{registro_escolhido}', []))
-            if not indices_para_alterar:
+            indices_para_alterar = store.linhas[selecao.posicoes()]
+            if not len(indices_para_alterar):
                 st.warning("Nenhum registro está selecionado para aplicar a alteração.")
-                return corpo_sped
-
-
-        for idx_original in indices_para_alterar:
-            if idx_original >= len(novo_corpo_sped):
-                erros_alteracao.append(f"Índice {idx_original+1} inválido (maior que o tamanho do arquivo?). Pulando.")
-                continue
-
-            linha_original = novo_corpo_sped[idx_original]
-            # Verifica se a linha ainda é do registro esperado (segurança)
-            if not linha_original.startswith(f"|{registro_escolhido}|"):
-                 erros_alteracao.append(f"Linha {idx_original+1} não parece ser mais do registro {registro_escolhido}. Alteração pulada.")
-                 continue
-
-            partes = linha_original.split("|")
-
-            if indice_campo_alterar < len(partes):
-                # TODO: Adicionar validação do novo_valor baseado no tipo de campo esperado
-                if partes[indice_campo_alterar] != novo_valor:
-                    partes[indice_campo_alterar] = novo_valor
-                    linha_modificada = "|".join(partes)
-                    novo_corpo_sped[idx_original] = linha_modificada
-                    linhas_modificadas_count += 1
-                    linhas_alteradas_preview_list.append(f"L{idx_original+1}: {linha_modificada}")
-            else:
-                erros_alteracao.append(f"Linha {idx_original+1} ('{linha_original[:50]}...') não possui o campo '{campo_nome}' na posição esperada ({indice_campo_alterar}) pelo layout. Alteração pulada.")
+                return False
+
+        # Aplica a alteração em lote: contagem e preview vêm do mesmo resultado
+        try:
+            resultado = documento.alterar_campo_em_lote(registro_escolhido, indices_para_alterar, campo_nome, novo_valor)
+        except ValueError as e:
+            st.error(f"Alteração não aplicada: {e}")
+            return False
+        linhas_modificadas_count = len(resultado)
+
+        erros_alteracao = [f"Índice {idx+1} inválido (maior que o tamanho do arquivo?). Pulando." for idx in resultado.invalidas]
+        # A linha não é mais do registro esperado (segurança)
+        erros_alteracao += [f"Linha {idx+1} não parece ser mais do registro {registro_escolhido}. Alteração pulada." for idx in resultado.fora_do_registro]
+        erros_alteracao += [
+            f"Linha {idx+1} ('{linha_original[:50]}...') não possui o campo '{campo_nome}' na posição esperada ({indice_campo_alterar}) pelo layout. Alteração pulada."
+            for idx, linha_original in zip(resultado.sem_campo, linhas_em(documento.corpo, np.array(resultado.sem_campo, dtype=np.int64)))
+        ]
 
         if erros_alteracao:
             st.markdown("**Avisos durante a alteração:**")
@@ -260,18 +320,22 @@ def handle_field_modification(corpo_sped, assinatura):
 
         if linhas_modificadas_count > 0:
             st.success(f"{linhas_modificadas_count} registros foram atualizados com sucesso na memória!")
+            # Revalidada só nas linhas alteradas e nos pais/contadores afetados
+            exibir_status_validacao(documento)
             with st.expander("Ver Pré-visualização das Linhas Alteradas"):
-                 st.text("\n".join(linhas_alteradas_preview_list))
+                 preview_indices = resultado.indices[:LIMITE_PREVIEW_ALTERADAS].tolist()
+                 st.text("\n".join(f"L{idx+1}: {linha}" for idx, linha in zip(preview_indices, resultado.linhas)))
+                 if linhas_modificadas_count > LIMITE_PREVIEW_ALTERADAS:
+                     st.caption(f"... (mostrando {LIMITE_PREVIEW_ALTERADAS} de {linhas_modificadas_count} linhas alteradas)")
 
             st.markdown("**Download do Arquivo com Alterações:**")
-            baixar_arquivo(novo_corpo_sped, assinatura, nome_arquivo=f"sped_{registro_escolhido}_alterado.txt")
+            baixar_arquivo(documento, nome_arquivo=f"sped_{registro_escolhido}_alterado.txt", key=f"download_alterado_{registro_escolhido}")
             # Limpa seleção após aplicar com sucesso
-            st.session_state[f'selecionados_{registro_escolhido}'] = []
-            st.session_state[select_all_key] = False # Desmarca o select all
+            selecao.limpar()
             # st.rerun() # Opcional: Forçar rerun para limpar checkboxes visualmente
-            return novo_corpo_sped
+            return True
         else:
             st.info("Nenhum registro precisou ser modificado (o novo valor já era o existente ou houve avisos).")
-            return corpo_sped
+            return False
 
-    return corpo_sped 
+    return False 
@@ -0,0 +1,220 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from modules.instrumentacao import evento, medir
+from modules.leitor import ENCODING_SPED, TAMANHO_BLOCO
+
+# --- Índice de trigramas do arquivo (busca de texto em todos os registros) ---
+
+LINHAS_POR_GRUPO = 64 # Granularidade do índice: um trigrama aponta para grupos de linhas, não para cada linha
+CONSULTAS_EM_CACHE = 32 # Resultados das últimas consultas guardados (o arquivo original nunca muda)
+ESPECIAIS_REGEX = set(".^$*+?{}[]\\|()")
+QUANTIFICADORES = set("*?")
+
+# Minúsculas latin-1 (A-Z, À-Þ exceto ×): o índice não diferencia maiúsculas; a conferência final, sim
+_MINUSCULAS = np.arange(256, dtype=np.uint8)
+_MINUSCULAS[65:91] += 32
+_MINUSCULAS[0xC0:0xDF] += 32
+_MINUSCULAS[0xD7] = 0xD7
+
+
+def _trigramas(texto):
+    """Códigos (uint32) dos trigramas de um texto, na mesma normalização do índice."""
+    try:
+        dados = np.frombuffer(texto.encode(ENCODING_SPED), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return None # Caractere que nem existe em latin-1: o arquivo não pode contê-lo
+    if len(dados) < 3:
+        return np.zeros(0, dtype=np.uint32)
+    b = _MINUSCULAS[dados].astype(np.uint32)
+    return np.unique((b[:-2] << 16) | (b[1:-1] << 8) | b[2:])
+
+
+def literais_obrigatorios(expressao):
+    """Trechos literais que toda ocorrência da expressão regular precisa conter (lista possivelmente vazia).
+
+    Análise conservadora: com '|' fora de colchetes nada é garantido; o que
+    está entre parênteses e os caracteres seguidos de ?, * ou {m,n} são ignorados.
+    """
+    literais, atual = [], []
+    profundidade = 0
+    i = 0
+    while i < len(expressao):
+        c = expressao[i]
+        if c == "\\" and i + 1 < len(expressao):
+            proximo = expressao[i + 1]
+            if proximo.isalnum(): # \d, \w, \b, \1...: classe ou âncora, não um literal
+                literais.append("".join(atual))
+                atual = []
+            elif not profundidade:
+                atual.append(proximo)
+            i += 2
+            continue
+        if c == "[":
+            fim = expressao.find("]", i + 2)
+            if fim < 0:
+                return []
+            literais.append("".join(atual))
+            atual = []
+            i = fim + 1
+            continue
+        if c == "{":
+            if atual:
+                atual.pop() # Repetição {m,n} do caractere anterior (que pode não aparecer)
+            literais.append("".join(atual))
+            atual = []
+            fim = expressao.find("}", i)
+            i = fim + 1 if fim >= 0 else len(expressao)
+            continue
+        if c == "|":
+            return []
+        if c == "(":
+            profundidade += 1
+        elif c == ")":
+            profundidade = max(profundidade - 1, 0)
+        if c in QUANTIFICADORES and atual:
+            atual.pop() # O caractere anterior pode não aparecer
+        if c in ESPECIAIS_REGEX or profundidade:
+            literais.append("".join(atual))
+            atual = []
+        else:
+            atual.append(c)
+        i += 1
+    literais.append("".join(atual))
+    return [literal for literal in literais if literal]
+
+
+class IndiceTrigramas:
+    """Índice invertido trigrama -> grupos de LINHAS_POR_GRUPO linhas do arquivo mapeado.
+
+    Montado em segundo plano (uma thread; as operações numpy liberam o GIL)
+    logo depois do upload. Uma consulta pega os grupos que contêm todos os
+    trigramas do termo (ou dos literais obrigatórios da expressão regular) e
+    só então confere o padrão nos bytes desses grupos. Os trigramas ficam sem
+    diferenciar maiúsculas, então o índice serve às duas formas de busca.
+    O índice é do arquivo original; as linhas alteradas são conferidas à parte
+    (ver LinhasSped.conferir_alteradas).
+    """
+
+    def __init__(self, arquivo, linhas_por_grupo=LINHAS_POR_GRUPO):
+        self.arquivo = arquivo
+        self.linhas_por_grupo = linhas_por_grupo
+        self.segmentos = [] # Vetores uint64 ordenados (trigrama << 32 | grupo), um por bloco de ~TAMANHO_BLOCO bytes
+        self.progresso = 0.0
+        self.erro = None
+        self.pronto = threading.Event()
+        self._cache = OrderedDict()
+        self._trava_cache = threading.Lock()
+        self._thread = None
+
+    def iniciar(self):
+        """Começa a montagem numa thread em segundo plano (não bloqueia)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.construir, name="indice-trigramas", daemon=True)
+            self._thread.start()
+        return self
+
+    def construir(self):
+        try:
+            with medir("indexar.trigramas", linhas=len(self.arquivo), bytes=self.arquivo.tamanho):
+                self._construir()
+        except Exception as e: # Ex: arquivo fechado no meio da montagem (sessão descartada)
+            self.erro = e
+            evento("Busca: falha ao montar o índice de texto", erro=str(e))
+        finally:
+            self.pronto.set()
+
+    def _construir(self):
+        arquivo = self.arquivo
+        if not arquivo.tamanho:
+            return
+        buf = np.frombuffer(arquivo._mm, dtype=np.uint8)
+        # Início (em bytes) de cada grupo de linhas; o último marca o fim do arquivo
+        inicios_grupos = arquivo.offsets[::self.linhas_por_grupo].astype(np.int64)
+        inicios_grupos = np.append(inicios_grupos, min(int(arquivo.offsets[-1]), arquivo.tamanho))
+        total_grupos = len(inicios_grupos) - 1
+
+        grupo = 0
+        while grupo < total_grupos:
+            # Segmento: grupos inteiros que somam ~TAMANHO_BLOCO bytes (um grupo nunca fica dividido)
+            ultimo = int(np.searchsorted(inicios_grupos, inicios_grupos[grupo] + TAMANHO_BLOCO, side="right")) - 1
+            ultimo = min(max(ultimo, grupo + 1), total_grupos)
+            ini, fim = int(inicios_grupos[grupo]), int(inicios_grupos[ultimo])
+            bytes_segmento = _MINUSCULAS[buf[ini:fim]]
+            if len(bytes_segmento) >= 3:
+                b = bytes_segmento.astype(np.uint32)
+                trigramas = (b[:-2] << 16) | (b[1:-1] << 8) | b[2:]
+                # Trigramas que atravessam uma quebra de linha não existem em nenhuma linha
+                validos = (bytes_segmento[:-2] != 10) & (bytes_segmento[1:-1] != 10) & (bytes_segmento[2:] != 10)
+                grupos = np.repeat(np.arange(grupo, ultimo, dtype=np.uint64), np.diff(inicios_grupos[grupo:ultimo + 1]))[:-2]
+                self.segmentos.append(np.unique((trigramas[validos].astype(np.uint64) << np.uint64(32)) | grupos[validos]))
+            grupo = ultimo
+            self.progresso = grupo / total_grupos
+        del buf
+
+    def __len__(self):
+        return sum(len(segmento) for segmento in self.segmentos)
+
+    def nbytes(self):
+        return sum(segmento.nbytes for segmento in self.segmentos)
+
+    def _grupos_com(self, trigrama):
+        """Grupos (ordenados) em que o trigrama aparece."""
+        chave = np.uint64(int(trigrama) << 32)
+        limite = np.uint64((int(trigrama) + 1) << 32)
+        partes = [segmento[np.searchsorted(segmento, chave):np.searchsorted(segmento, limite)] & np.uint64(0xFFFFFFFF)
+                  for segmento in self.segmentos]
+        return np.concatenate(partes) if partes else np.zeros(0, dtype=np.uint64)
+
+    def grupos_candidatos(self, literais):
+        """Grupos que contêm todos os trigramas dos literais, ou None se não há trigrama para restringir."""
+        trigramas = [_trigramas(literal) for literal in literais]
+        if any(t is None for t in trigramas):
+            return np.zeros(0, dtype=np.uint64)
+        trigramas = np.unique(np.concatenate(trigramas)) if trigramas else np.zeros(0, dtype=np.uint32)
+        if not len(trigramas):
+            return None
+        postings = sorted((self._grupos_com(t) for t in trigramas.tolist()), key=len)
+        candidatos = postings[0]
+        for grupos in postings[1:]: # Do menor para o maior: a interseção encolhe rápido
+            if not len(candidatos):
+                break
+            candidatos = np.intersect1d(candidatos, grupos, assume_unique=True)
+        return candidatos
+
+    def ocorrencias(self, padrao, literais, inicio, fim):
+        """Linhas [inicio, fim) do arquivo original em que `padrao` (regex sobre bytes) ocorre.
+
+        `literais` são os trechos obrigatórios do padrão (ver literais_obrigatorios).
+        Sem trigramas para restringir, varre o intervalo todo.
+        """
+        chave = (padrao.pattern, padrao.flags, inicio, fim)
+        with self._trava_cache:
+            if chave in self._cache:
+                self._cache.move_to_end(chave)
+                return self._cache[chave]
+
+        candidatos = self.grupos_candidatos(literais)
+        if candidatos is None:
+            linhas = self.arquivo.ocorrencias(padrao, inicio, fim)
+        else:
+            # Grupos consecutivos viram uma só faixa de linhas conferida direto nos bytes
+            candidatos = candidatos.astype(np.int64)
+            quebras = np.flatnonzero(np.diff(candidatos) != 1) + 1
+            primeiros = candidatos[np.concatenate(([0], quebras))] if len(candidatos) else candidatos
+            ultimos = candidatos[np.concatenate((quebras - 1, [len(candidatos) - 1]))] if len(candidatos) else candidatos
+            partes = []
+            for primeiro, ultimo in zip(primeiros.tolist(), ultimos.tolist()):
+                ini = max(primeiro * self.linhas_por_grupo, inicio)
+                fim_faixa = min((ultimo + 1) * self.linhas_por_grupo, fim)
+                if ini < fim_faixa:
+                    partes.append(self.arquivo.ocorrencias(padrao, ini, fim_faixa))
+            linhas = np.concatenate(partes) if partes else np.zeros(0, dtype=np.int64)
+
+        with self._trava_cache:
+            self._cache[chave] = linhas
+            while len(self._cache) > CONSULTAS_EM_CACHE:
+                self._cache.popitem(last=False)
+        return linhas
@@ -0,0 +1,297 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from modules.documento import SpedDocument
+from modules.hierarquia import IndiceHierarquia
+from modules.instrumentacao import evento, medir
+from modules.leitor import ArquivoMapeado, LinhasSped, separar_assinatura
+
+# --- Cache de documentos já lidos, pelo SHA-256 do conteúdo (memória + disco, compartilhado entre sessões) ---
+
+DIRETORIO_CACHE = os.path.join(tempfile.gettempdir(), "painel_sped_cache")
+LIMITE_MEMORIA_CACHE = 2 * 1024**3 # Bytes (estimados) dos documentos base mantidos em memória
+LIMITE_DISCO_CACHE = 20 * 1024**3  # Bytes das entradas em disco (arquivo original + vetores de índice)
+FORMATO_CACHE_DOCUMENTOS = 1       # Muda quando o conteúdo gravado em disco muda de formato
+TAMANHO_BLOCO_HASH = 8 * 1024 * 1024
+ARQUIVO_SPED = "sped.txt"
+ARQUIVO_META = "meta.json"
+VETORES_ARQUIVO = ["offsets", "codigos", "irregulares"]     # ArquivoMapeado.vetores_indice
+VETORES_HIERARQUIA = ["registro_linha", "nivel", "pai", "fim"] # IndiceHierarquia.vetores
+
+
+def hash_conteudo(arquivo):
+    """SHA-256 (hex) do conteúdo de um upload (BytesIO/UploadedFile), arquivo aberto ou caminho."""
+    if isinstance(arquivo, (str, os.PathLike)):
+        with open(arquivo, "rb") as f:
+            return hash_conteudo(f)
+    if hasattr(arquivo, "getbuffer"): # Upload já em memória: uma chamada só, sem cópias
+        return hashlib.sha256(arquivo.getbuffer()).hexdigest()
+    arquivo.seek(0)
+    sha = hashlib.sha256()
+    for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO_HASH), b""):
+        sha.update(bloco)
+    arquivo.seek(0)
+    return sha.hexdigest()
+
+
+def _tamanho(arquivo):
+    """Bytes de um upload (BytesIO/UploadedFile) ou caminho; None se não der para saber sem ler."""
+    if isinstance(arquivo, (str, os.PathLike)):
+        return os.path.getsize(arquivo)
+    if hasattr(arquivo, "getbuffer"):
+        return arquivo.getbuffer().nbytes
+    return getattr(arquivo, "size", None)
+
+
+def _chave_niveis(sped_layout, base=None):
+    """Identifica os níveis de registro usados na hierarquia (ela é refeita se eles mudarem)."""
+    niveis = getattr(base.layout if base is not None else sped_layout, "niveis", {}) or {}
+    return hashlib.sha1(repr(sorted(niveis.items())).encode()).hexdigest()
+
+
+def _tamanho_diretorio(caminho):
+    return sum(entrada.stat().st_size for entrada in os.scandir(caminho) if entrada.is_file())
+
+
+class CacheDocumentos:
+    """Documentos SPED já lidos, pelo SHA-256 do conteúdo, em dois níveis.
+
+    - memória: o documento base (nunca editado) de cada arquivo, com arquivo
+      mapeado, índice de registros, hierarquia e os RegistroStore já montados;
+    - disco: o arquivo e os vetores de índice (.npy, lidos com mmap), que
+      sobrevivem a um reinício do servidor.
+
+    Cada sessão recebe um SpedDocument próprio sobre o base (edições, journal,
+    cubo e validação separados; colunas copiadas só quando editadas). Os dois
+    níveis são LRU com limite de bytes; o mesmo objeto atende todas as sessões
+    do processo (ver utils.obter_cache_documentos).
+    """
+
+    def __init__(self, diretorio=DIRETORIO_CACHE, limite_memoria=LIMITE_MEMORIA_CACHE, limite_disco=LIMITE_DISCO_CACHE):
+        self.diretorio = diretorio
+        self.limite_memoria = limite_memoria
+        self.limite_disco = limite_disco
+        self.memoria = OrderedDict() # chave -> (documento base, id do catálogo de layouts), do menos ao mais recente
+        self.acertos_memoria = 0
+        self.acertos_disco = 0
+        self.leituras = 0
+        self._trava = threading.Lock()
+        self._travas_chave = {} # Uma leitura por arquivo, mesmo com várias sessões enviando o mesmo conteúdo
+        if limite_disco:
+            os.makedirs(diretorio, exist_ok=True)
+
+    def _trava_da(self, chave):
+        with self._trava:
+            return self._travas_chave.setdefault(chave, threading.Lock())
+
+    def abrir(self, arquivo, sped_layout, sped_tipos=None):
+        """SpedDocument novo (da sessão) para o conteúdo de `arquivo`, lendo o arquivo só se ele nunca foi visto."""
+        with medir("cache.hash") as etapa:
+            chave = hash_conteudo(arquivo)
+            etapa.bytes = _tamanho(arquivo)
+        with self._trava_da(chave):
+            base = self._da_memoria(chave, sped_layout)
+            if base is None:
+                base = self._do_disco(chave, sped_layout, sped_tipos)
+                if base is not None:
+                    self.acertos_disco += 1
+                    evento("Cache: documento reaberto do disco", documento=chave[:12])
+                else:
+                    base = self._ler(chave, arquivo, sped_layout, sped_tipos)
+                    self.leituras += 1
+                self._guardar_na_memoria(chave, base, sped_layout)
+            else:
+                self.acertos_memoria += 1
+                evento("Cache: documento reaberto da memória", documento=chave[:12])
+        return SpedDocument.a_partir_de(base, sped_layout, sped_tipos)
+
+    # --- Memória ---
+
+    def _da_memoria(self, chave, sped_layout):
+        with self._trava:
+            entrada = self.memoria.get(chave)
+            if entrada is None or entrada[1] != id(sped_layout): # Catálogo recarregado: o base é refeito
+                return None
+            self.memoria.move_to_end(chave)
+            return entrada[0]
+
+    def _guardar_na_memoria(self, chave, base, sped_layout):
+        with self._trava:
+            self.memoria[chave] = (base, id(sped_layout))
+            self.memoria.move_to_end(chave)
+            # Os stores crescem conforme as sessões pedem registros: o tamanho é medido na hora de despejar
+            tamanhos = {c: entrada[0].memoria_estimada() for c, entrada in self.memoria.items()}
+            total = sum(tamanhos.values())
+            for antiga in list(self.memoria):
+                if total <= self.limite_memoria or antiga == chave:
+                    break
+                total -= tamanhos[antiga]
+                del self.memoria[antiga] # Sessões que ainda usam o documento continuam com a referência
+                evento("Cache: documento removido da memória (LRU)", documento=antiga[:12])
+
+    def bytes_memoria(self):
+        with self._trava:
+            return sum(entrada[0].memoria_estimada() for entrada in self.memoria.values())
+
+    # --- Disco ---
+
+    def _caminho(self, chave):
+        return os.path.join(self.diretorio, chave)
+
+    def _do_disco(self, chave, sped_layout, sped_tipos):
+        """Documento base a partir da entrada em disco (sem reler o arquivo), ou None."""
+        if not self.limite_disco:
+            return None
+        caminho = self._caminho(chave)
+        if not os.path.isfile(os.path.join(caminho, ARQUIVO_META)):
+            return None # Conteúdo nunca gravado (o caso comum, não é erro)
+        try:
+            with open(os.path.join(caminho, ARQUIVO_META), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("formato") != FORMATO_CACHE_DOCUMENTOS:
+                return None
+            vetores = {nome: np.load(os.path.join(caminho, nome + ".npy"), mmap_mode="r")
+                       for nome in VETORES_ARQUIVO + ["linhas_registros"]}
+            arquivo = ArquivoMapeado(os.path.join(caminho, ARQUIVO_SPED), indice=tuple(vetores[nome] for nome in VETORES_ARQUIVO))
+        except (OSError, ValueError, KeyError) as e:
+            evento("Cache: entrada em disco ignorada", documento=chave[:12], erro=str(e))
+            return None
+
+        linhas = LinhasSped(arquivo)
+        corpo, assinatura = linhas.recorte(0, meta["fim_corpo"]), linhas[meta["fim_corpo"]:]
+        limites = meta["limites_registros"]
+        indice_registros = {registro: vetores["linhas_registros"][ini:fim]
+                            for registro, ini, fim in zip(meta["registros"], limites[:-1], limites[1:])}
+        hierarquia = None
+        if meta.get("niveis") == _chave_niveis(sped_layout):
+            try:
+                hierarquia = IndiceHierarquia.de_vetores(indice_registros, *(
+                    np.load(os.path.join(caminho, f"hierarquia_{nome}.npy"), mmap_mode="r") for nome in VETORES_HIERARQUIA
+                ))
+            except (OSError, ValueError):
+                hierarquia = None
+        base = SpedDocument(corpo, assinatura, sped_layout, sped_tipos, indice_registros=indice_registros, hierarquia=hierarquia)
+        if hierarquia is None or meta.get("niveis") != _chave_niveis(None, base):
+            self._gravar_hierarquia(caminho, base) # Níveis mudaram desde a gravação: hierarquia refeita uma vez
+        os.utime(os.path.join(caminho, ARQUIVO_META)) # Último uso, para o LRU do disco
+        evento("Cache: documento aberto do disco", documento=chave[:12], linhas=len(corpo))
+        return base
+
+    def _ler(self, chave, arquivo, sped_layout, sped_tipos):
+        """Lê o arquivo de verdade; com o disco habilitado, o lê já dentro de uma entrada nova do cache."""
+        if not self.limite_disco:
+            corpo, assinatura = separar_assinatura(LinhasSped(ArquivoMapeado(arquivo)))
+            return SpedDocument(corpo, assinatura, sped_layout, sped_tipos)
+
+        temporario = os.path.join(self.diretorio, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(temporario)
+        try:
+            destino = os.path.join(temporario, ARQUIVO_SPED)
+            with medir("leitura.copiar", bytes=_tamanho(arquivo)):
+                if isinstance(arquivo, (str, os.PathLike)):
+                    shutil.copyfile(arquivo, destino)
+                else:
+                    arquivo.seek(0)
+                    with open(destino, "wb") as f:
+                        shutil.copyfileobj(arquivo, f, 1024 * 1024)
+            mapeado = ArquivoMapeado(destino) # Mapeia a cópia do cache (sem uma segunda cópia temporária)
+            corpo, assinatura = separar_assinatura(LinhasSped(mapeado))
+            base = SpedDocument(corpo, assinatura, sped_layout, sped_tipos)
+            with medir("cache.gravar"):
+                self._gravar(temporario, base)
+            try:
+                os.rename(temporario, self._caminho(chave)) # Entrada completa ou nenhuma
+            except OSError: # Outro processo gravou o mesmo conteúdo antes
+                shutil.rmtree(temporario, ignore_errors=True)
+            self._limitar_disco(manter=chave)
+            return base
+        except Exception:
+            shutil.rmtree(temporario, ignore_errors=True)
+            raise
+
+    def _gravar(self, caminho, base):
+        arquivo = base.corpo.arquivo
+        for nome, vetor in zip(VETORES_ARQUIVO, arquivo.vetores_indice()):
+            np.save(os.path.join(caminho, nome + ".npy"), vetor)
+        registros = list(base.indice_registros)
+        linhas = [base.indice_registros[registro] for registro in registros]
+        np.save(os.path.join(caminho, "linhas_registros.npy"),
+                np.concatenate(linhas) if linhas else np.zeros(0, dtype=np.uint32))
+        self._gravar_hierarquia(caminho, base)
+        meta = {
+            "formato": FORMATO_CACHE_DOCUMENTOS,
+            "fim_corpo": len(base.corpo),
+            "linhas": len(arquivo),
+            "registros": registros,
+            "limites_registros": np.concatenate(([0], np.cumsum([len(l) for l in linhas]))).astype(int).tolist(),
+            "niveis": _chave_niveis(None, base),
+            "gravado_em": time.time(),
+        }
+        with open(os.path.join(caminho, ARQUIVO_META), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    def _gravar_hierarquia(self, caminho, base):
+        try:
+            for nome, vetor in zip(VETORES_HIERARQUIA, base.hierarquia.vetores()):
+                destino = os.path.join(caminho, f"hierarquia_{nome}.npy")
+                np.save(destino + ".tmp.npy", vetor)
+                os.replace(destino + ".tmp.npy", destino)
+            caminho_meta = os.path.join(caminho, ARQUIVO_META)
+            if os.path.exists(caminho_meta):
+                with open(caminho_meta, encoding="utf-8") as f:
+                    meta = json.load(f)
+                meta["niveis"] = _chave_niveis(None, base)
+                with open(caminho_meta, "w", encoding="utf-8") as f:
+                    json.dump(meta, f)
+        except OSError as e:
+            evento("Cache: hierarquia não gravada", caminho=caminho, erro=str(e))
+
+    def entradas_disco(self):
+        """[(chave, bytes, último uso)] das entradas em disco, da menos para a mais recente."""
+        entradas = []
+        if not self.limite_disco or not os.path.isdir(self.diretorio):
+            return entradas
+        for entrada in os.scandir(self.diretorio):
+            if not entrada.is_dir() or entrada.name.startswith("."):
+                continue
+            try:
+                uso = os.path.getmtime(os.path.join(entrada.path, ARQUIVO_META))
+                entradas.append((entrada.name, _tamanho_diretorio(entrada.path), uso))
+            except OSError:
+                continue
+        return sorted(entradas, key=lambda e: e[2])
+
+    def _limitar_disco(self, manter=None):
+        entradas = self.entradas_disco()
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for chave, tamanho, _ in entradas:
+            if total <= self.limite_disco:
+                break
+            if chave == manter:
+                continue
+            # Um arquivo ainda mapeado por alguma sessão continua válido para ela (no Windows a remoção falha e fica para depois)
+            shutil.rmtree(self._caminho(chave), ignore_errors=True)
+            if not os.path.exists(self._caminho(chave)):
+                total -= tamanho
+                evento("Cache: documento removido do disco (LRU)", documento=chave[:12])
+
+    def estatisticas(self):
+        entradas = self.entradas_disco()
+        return {
+            "documentos_memoria": len(self.memoria),
+            "bytes_memoria": self.bytes_memoria(),
+            "documentos_disco": len(entradas),
+            "bytes_disco": sum(tamanho for _, tamanho, _ in entradas),
+            "acertos_memoria": self.acertos_memoria,
+            "acertos_disco": self.acertos_disco,
+            "leituras": self.leituras,
+        }
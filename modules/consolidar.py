@@ -0,0 +1,64 @@
+import streamlit as st
+
+from modules.cubo import DIMENSOES
+from modules.instrumentacao import medir
+from modules.resumo import formatar_valor, totais_icms
+from modules.workspace import DIMENSOES_WORKSPACE
+
+# --- Resumo consolidado de vários arquivos SPED (ex: 12 meses, vários estabelecimentos) ---
+
+def generate_consolidated_summary(workspace):
+    """Exibe totais de todos os documentos da área de trabalho, por período e CNPJ."""
+    st.subheader("🗓️ Resumo Consolidado (vários arquivos)")
+
+    if workspace is None or not len(workspace):
+        st.info("Envie dois ou mais arquivos SPED para consolidar.")
+        return
+
+    st.markdown("**Arquivos na área de trabalho:**")
+    st.dataframe(workspace.identificacao(), hide_index=True, use_container_width=True)
+    for (cnpj, periodo), nomes in workspace.periodos_repetidos().items():
+        st.warning(f"CNPJ {cnpj or 'N/A'} tem mais de um arquivo para {periodo or 'período não identificado'}: {', '.join(nomes)}. Os valores serão somados.")
+
+    with st.spinner("Agregando documentos..."), medir("agregar.consolidado", documentos=len(workspace)):
+        # Um valor por documento fiscal (C100/D100), sem os itens que repetiriam os totais
+        por_periodo = workspace.fatia(["C100", "D100"], ["PERIODO", "CNPJ"])
+
+    if not len(por_periodo):
+        st.warning("Nenhum documento fiscal (C100/D100) encontrado nos arquivos.")
+    else:
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Total Base ICMS (C100/D100)", formatar_valor(por_periodo["VL_BC_ICMS"].sum()))
+        col2.metric("Total Valor ICMS (C100/D100)", formatar_valor(por_periodo["VL_ICMS"].sum()))
+        col3.metric("Documentos Fiscais", f"{int(por_periodo['QTD'].sum())}")
+
+        st.markdown("---")
+        st.markdown("**Valor ICMS por Período e CNPJ:**")
+        tabela = por_periodo.pivot_table(index="PERIODO", columns="CNPJ", values="VL_ICMS", aggfunc="sum", fill_value=0.0)
+        st.dataframe(tabela.sort_index(), use_container_width=True)
+
+        st.markdown("**Entradas x Saídas por Período:**")
+        tipo_op = workspace.fatia(["C100", "D100"], ["PERIODO", "IND_OPER"])
+        tipo_op["Tipo_Operacao"] = tipo_op["IND_OPER"].map({'0': 'Entrada', '1': 'Saída'}).fillna('Outro')
+        st.dataframe(
+            totais_icms(tipo_op, ["PERIODO", "Tipo_Operacao"]).sort_values(["PERIODO", "Tipo_Operacao"]),
+            hide_index=True, use_container_width=True
+        )
+
+    # --- Registros analíticos consolidados (C190 / D190 / C590) --- #
+    st.markdown("---")
+    st.markdown("**Resumo Analítico Consolidado (C190 / D190 / C590):**")
+    col_reg, col_dim = st.columns([1, 3])
+    registros = col_reg.multiselect("Registros", ["C190", "D190", "C590"], default=["C190", "D190", "C590"], key="consolidado_registros")
+    agrupar_por = col_dim.multiselect(
+        "Agrupar por", DIMENSOES_WORKSPACE + ["REG"] + DIMENSOES,
+        default=["PERIODO", "CST_ICMS", "CFOP"], key="consolidado_agrupar_por"
+    )
+    if not registros or not agrupar_por:
+        st.info("Selecione ao menos um registro e uma dimensão para agrupar.")
+        return
+    analitico = workspace.fatia(registros, agrupar_por)
+    if len(analitico):
+        st.dataframe(analitico.sort_values(agrupar_por), hide_index=True, use_container_width=True)
+    else:
+        st.info("Nenhum registro analítico encontrado nos arquivos.")
@@ -0,0 +1,236 @@
+import numpy as np
+import pandas as pd
+
+from modules.decodificar import decodificar_coluna
+from modules.instrumentacao import medir
+
+# --- Cubo de agregação do resumo (montado uma vez por documento, atualizado a cada edição) ---
+
+DIMENSOES = ["CFOP", "CST_ICMS", "ALIQ_ICMS", "IND_OPER", "MES"]
+MEDIDAS = ["VL_DOC", "VL_ITEM", "VL_OPR", "VL_BC_ICMS", "VL_ICMS", "VL_BC_ICMS_ST", "VL_ICMS_ST", "VL_RED_BC", "VL_IPI"]
+# Registros do cubo -> registro pai (de onde vêm IND_OPER e o mês quando o registro não tem esses campos)
+REGISTROS_CUBO = {
+    "C100": None, "C170": "C100", "C190": "C100",
+    "C500": None, "C590": "C500",
+    "D100": None, "D190": "D100",
+}
+CAMPO_DATA_MES = "DT_DOC" # Data que define o mês (AAAA-MM) da linha
+SEM_VALOR = ""            # Dimensão vazia ou inexistente no registro
+
+
+def _mes(data):
+    """'DDMMAAAA' -> 'AAAA-MM' (vazio se a data não tiver 8 caracteres)."""
+    return f"{data[4:8]}-{data[2:4]}" if data and len(data) == 8 else SEM_VALOR
+
+
+class CuboRegistro:
+    """Somas das medidas de um registro agrupadas por célula (CFOP x CST x ALIQ x IND_OPER x MÊS).
+
+    Guarda, por linha do RegistroStore, os códigos das dimensões, os valores
+    das medidas e a célula da linha; com isso uma edição só move/ajusta as
+    linhas alteradas, sem recalcular o registro inteiro.
+    """
+
+    def __init__(self, documento, registro, registro_pai=None):
+        self.registro = registro
+        self.registro_pai = registro_pai
+        self.store = documento.registro(registro)
+        self.pai = documento.registro(registro_pai) if registro_pai else None
+        self.medidas = [m for m in MEDIDAS if m in self.store.posicao_campo]
+
+        # De onde vem cada dimensão: campo do próprio registro, do pai ou de nenhum (fica vazia)
+        self.origens = {}
+        for dim in DIMENSOES:
+            campo = CAMPO_DATA_MES if dim == "MES" else dim
+            if campo in self.store.posicao_campo:
+                self.origens[dim] = (self.store, campo)
+            elif self.pai is not None and len(self.pai) and campo in self.pai.posicao_campo:
+                self.origens[dim] = (self.pai, campo)
+            else:
+                self.origens[dim] = (None, campo)
+
+        # Posição (no RegistroStore do pai) do pai de cada linha, pelo índice hierárquico do documento
+        if self.pai is not None:
+            self.posicao_pai = documento.posicoes_pai(self.store, self.pai)
+        else:
+            self.posicao_pai = np.full(len(self.store), -1, dtype=np.int64)
+
+        self.vocabularios = [[] for _ in DIMENSOES]
+        self.codigo_valor = [{} for _ in DIMENSOES]
+        self.codigos = np.empty((len(self.store), len(DIMENSOES)), dtype=np.int32)
+        for j, dim in enumerate(DIMENSOES):
+            self.codigos[:, j] = self._codigos_dimensao(j, dim, None)
+
+        self.valores = {}
+        self.invalidos = {}
+        for medida in self.medidas:
+            valores, invalidos = self.store.coluna_decodificada(medida)
+            self.valores[medida] = np.nan_to_num(valores, nan=0.0)
+            self.invalidos[medida] = invalidos.copy()
+
+        chaves, self.celula = self._agrupar_celulas()
+        self.chaves = [tuple(chave) for chave in chaves.tolist()]
+        self.celula_por_chave = {chave: i for i, chave in enumerate(self.chaves)}
+        self.contagem = np.bincount(self.celula, minlength=len(self.chaves)).astype(np.int64)
+        self.somas = {m: np.bincount(self.celula, weights=self.valores[m], minlength=len(self.chaves)) for m in self.medidas}
+
+    def _agrupar_celulas(self):
+        """(chaves das células, célula de cada linha) a partir dos códigos das dimensões."""
+        tamanhos = [max(len(vocabulario), 1) for vocabulario in self.vocabularios]
+        if np.prod(tamanhos, dtype=float) >= 2**62:
+            chaves, celula = np.unique(self.codigos, axis=0, return_inverse=True)
+            return chaves, celula.reshape(-1)
+        # Chave única por linha (base mista): agrupar um vetor int64 é bem mais rápido que linhas de uma matriz
+        chave = np.zeros(len(self.codigos), dtype=np.int64)
+        for j, tamanho in enumerate(tamanhos):
+            chave = chave * tamanho + self.codigos[:, j]
+        _, primeiras, celula = np.unique(chave, return_index=True, return_inverse=True)
+        return self.codigos[primeiras], celula.reshape(-1)
+
+    def _codigo(self, j, valor):
+        codigo = self.codigo_valor[j].get(valor)
+        if codigo is None:
+            codigo = self.codigo_valor[j][valor] = len(self.vocabularios[j])
+            self.vocabularios[j].append(valor)
+        return codigo
+
+    def _codificar(self, j, dim, valores):
+        """Códigos da dimensão j para uma lista de valores brutos (texto do campo).
+
+        Só os valores distintos passam por Python (strip, data -> mês); o
+        restante é resolvido pelo pd.factorize.
+        """
+        codigos_brutos, distintos = pd.factorize(pd.Series(valores, dtype=object))
+        normalizar = _mes if dim == "MES" else (lambda v: v.strip() if v else SEM_VALOR)
+        # O último elemento atende o código -1 (None: campo ausente na linha)
+        mapa = np.array([self._codigo(j, normalizar(v)) for v in distintos.tolist()] + [self._codigo(j, SEM_VALOR)], dtype=np.int32)
+        return mapa[codigos_brutos]
+
+    def _codigos_dimensao(self, j, dim, posicoes):
+        """Códigos da dimensão para as linhas `posicoes` do registro (None = todas)."""
+        store, campo = self.origens[dim]
+        n = len(self.store) if posicoes is None else len(posicoes)
+        if store is None:
+            return np.full(n, self._codigo(j, SEM_VALOR), dtype=np.int32)
+        coluna = store.coluna(campo)
+        if store is self.store:
+            return self._codificar(j, dim, coluna if posicoes is None else [coluna[p] for p in posicoes.tolist()])
+
+        # Dimensão herdada do pai: codifica as linhas do pai e replica para os filhos
+        pos_pai = self.posicao_pai if posicoes is None else self.posicao_pai[posicoes]
+        if posicoes is None:
+            codigos = self._codificar(j, dim, coluna)[np.maximum(pos_pai, 0)]
+        else:
+            codigos = self._codificar(j, dim, [coluna[p] for p in np.maximum(pos_pai, 0).tolist()])
+        codigos[pos_pai < 0] = self._codigo(j, SEM_VALOR)
+        return codigos
+
+    def _celula(self, chave):
+        """Número da célula da chave (criada vazia se ainda não existir)."""
+        celula = self.celula_por_chave.get(chave)
+        if celula is None:
+            celula = self.celula_por_chave[chave] = len(self.chaves)
+            self.chaves.append(chave)
+            self.contagem = np.append(self.contagem, 0)
+            for medida in self.medidas:
+                self.somas[medida] = np.append(self.somas[medida], 0.0)
+        return celula
+
+    def posicoes_dos_pais(self, posicoes_pai):
+        """Linhas do registro cujo pai está entre `posicoes_pai` (edição no pai muda IND_OPER/mês dos filhos)."""
+        return np.flatnonzero(np.isin(self.posicao_pai, posicoes_pai))
+
+    def atualizar(self, posicoes):
+        """Relê dimensões e medidas das linhas `posicoes` (após uma edição) e ajusta só as células envolvidas."""
+        posicoes = np.asarray(posicoes, dtype=np.int64)
+        if not len(posicoes):
+            return
+        antigas = self.celula[posicoes]
+        np.subtract.at(self.contagem, antigas, 1)
+        for medida in self.medidas:
+            np.subtract.at(self.somas[medida], antigas, self.valores[medida][posicoes])
+
+        for j, dim in enumerate(DIMENSOES):
+            self.codigos[posicoes, j] = self._codigos_dimensao(j, dim, posicoes)
+        for medida in self.medidas:
+            coluna = self.store.coluna(medida)
+            valores, invalidos = decodificar_coluna([coluna[p] for p in posicoes.tolist()], self.store.tipo_campo(medida))
+            self.valores[medida][posicoes] = np.nan_to_num(valores, nan=0.0)
+            self.invalidos[medida][posicoes] = invalidos
+
+        novas = np.fromiter((self._celula(tuple(chave)) for chave in self.codigos[posicoes].tolist()), dtype=np.int64, count=len(posicoes))
+        self.celula[posicoes] = novas
+        np.add.at(self.contagem, novas, 1)
+        for medida in self.medidas:
+            np.add.at(self.somas[medida], novas, self.valores[medida][posicoes])
+
+    def celulas(self):
+        """DataFrame com uma linha por célula não vazia: dimensões, QTD e somas das medidas."""
+        ativas = np.flatnonzero(self.contagem > 0)
+        chaves = np.array(self.chaves, dtype=np.int64).reshape(-1, len(DIMENSOES))[ativas]
+        dados = {"REG": self.registro}
+        for j, dim in enumerate(DIMENSOES):
+            dados[dim] = np.array(self.vocabularios[j], dtype=object)[chaves[:, j]]
+        dados["QTD"] = self.contagem[ativas]
+        for medida in self.medidas:
+            dados[medida] = self.somas[medida][ativas]
+        return pd.DataFrame(dados)
+
+
+class CuboResumo:
+    """Cubo de agregação (registro x CFOP x CST x ALIQ x IND_OPER x MÊS) do documento.
+
+    Montado uma vez (uma passada por registro) e mantido em dia pelas edições
+    do documento; todas as visões do resumo são fatias dele, com custo
+    proporcional ao número de células, não de linhas.
+    """
+
+    def __init__(self, documento):
+        self.versao = documento.versao
+        documento.carregar_registros(REGISTROS_CUBO) # Os pais também são registros do cubo
+        self.cubos = {}
+        for registro, registro_pai in REGISTROS_CUBO.items():
+            store = documento.registro(registro)
+            if store is not None and len(store):
+                self.cubos[registro] = CuboRegistro(documento, registro, registro_pai)
+
+    def atualizar(self, registro, posicoes, versao):
+        """Aplica ao cubo a edição das linhas `posicoes` (no RegistroStore) do registro."""
+        cubo = self.cubos.get(registro)
+        if cubo is not None:
+            cubo.atualizar(posicoes)
+        for filho in self.cubos.values():
+            if filho.registro_pai == registro:
+                filho.atualizar(filho.posicoes_dos_pais(posicoes))
+        self.versao = versao
+
+    def fatia(self, registros, por, filtros=None):
+        """Totais (QTD e medidas) agrupados pelas dimensões `por` (ex: ["CFOP"], ["REG", "MES"]).
+
+        `filtros` restringe as células: {dimensão: valor ou lista de valores}.
+        Medidas inexistentes num registro contam como zero.
+        """
+        partes = [self.cubos[reg].celulas() for reg in registros if reg in self.cubos]
+        if not partes:
+            return pd.DataFrame(columns=list(por) + ["QTD"])
+        with medir("agregar.fatia", por=",".join(por)) as etapa:
+            celulas = pd.concat(partes, ignore_index=True)
+            for dim, valor in (filtros or {}).items():
+                valores = valor if isinstance(valor, (list, tuple, set)) else [valor]
+                celulas = celulas[celulas[dim].isin(valores)]
+            medidas = [c for c in celulas.columns if c == "QTD" or c in MEDIDAS]
+            celulas[medidas] = celulas[medidas].fillna(0)
+            etapa.linhas = len(celulas)
+            return celulas.groupby(list(por), sort=False)[medidas].sum().reset_index()
+
+    def celulas_invalidas(self, registros=None):
+        """Lista de (REG, CAMPO, linhas base 1) com valores das medidas fora do formato do layout."""
+        resultado = []
+        for registro, cubo in self.cubos.items():
+            if registros is not None and registro not in registros:
+                continue
+            for medida in cubo.medidas:
+                invalidos = cubo.invalidos[medida]
+                if invalidos.any():
+                    resultado.append((registro, medida, cubo.store.linhas[invalidos] + 1))
+        return resultado
@@ -0,0 +1,121 @@
+from collections import namedtuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# --- Tipos de campo do layout (Guia Prático) e decodificação vetorizada de colunas ---
+
+# tipo: "N" (numérico), "C" (alfanumérico) ou "D" (data DDMMAAAA);
+# tamanho/decimais: inteiros ou None quando o Guia não define ("-").
+TipoCampo = namedtuple("TipoCampo", ["tipo", "tamanho", "decimais"])
+TIPO_TEXTO = TipoCampo("C", None, None) # Campos sem tipo no layout são tratados como texto
+
+PADRAO_DATA = r"^(0[1-9]|[12][0-9]|3[01])(0[1-9]|1[0-2])[0-9]{4}$"
+PADRAO_DIGITOS = r"^[0-9]*$"
+
+
+def campo_valor(tipo_campo):
+    """Campo numérico com casas decimais definidas (VL_, ALIQ_, QTD...): decodificado como float."""
+    return tipo_campo.tipo == "N" and tipo_campo.decimais is not None
+
+
+def campo_data(tipo_campo):
+    return tipo_campo.tipo == "D"
+
+
+def descrever_tipo(tipo_campo):
+    """Descrição curta do formato esperado (ex: "numérico, até 2 casas decimais")."""
+    if campo_data(tipo_campo):
+        return "data DDMMAAAA"
+    partes = ["numérico" if tipo_campo.tipo == "N" else "texto"]
+    if tipo_campo.tamanho is not None:
+        partes.append(f"até {tipo_campo.tamanho} caracteres")
+    if tipo_campo.decimais:
+        partes.append(f"até {tipo_campo.decimais} casas decimais (vírgula)")
+    elif tipo_campo.decimais == 0:
+        partes.append("inteiro")
+    return ", ".join(partes)
+
+
+def _vazios(texto):
+    """Máscara (Arrow) das células vazias ou ausentes (campo não preenchido não é inválido)."""
+    return pc.fill_null(pc.equal(texto, ""), True)
+
+
+def _maior_que(texto, tamanho):
+    if tamanho is None:
+        return pa.array(np.zeros(len(texto), dtype=bool))
+    return pc.fill_null(pc.greater(pc.utf8_length(texto), tamanho), False)
+
+
+def decodificar_decimal_arrow(coluna, decimais=None):
+    """Converte uma coluna de strings '1234,56' em float64 (Arrow). Retorna (valores, invalidos).
+
+    Aceita apenas o formato do SPED: dígitos, vírgula decimal opcional e no
+    máximo `decimais` casas. Vazios e inválidos viram nulos; os inválidos
+    (preenchidos, mas fora do formato) ficam marcados na máscara.
+    """
+    texto = pa.array(coluna, type=pa.string())
+    if decimais == 0:
+        padrao = r"^-?[0-9]+$"
+    elif decimais:
+        padrao = r"^-?[0-9]+(,[0-9]{1,%d})?$" % decimais
+    else:
+        padrao = r"^-?[0-9]+(,[0-9]+)?$"
+    validos = pc.fill_null(pc.match_substring_regex(texto, padrao), False)
+    valores = pc.cast(pc.replace_substring(pc.if_else(validos, texto, None), ",", "."), pa.float64())
+    invalidos = pc.invert(pc.or_(validos, _vazios(texto)))
+    return valores, invalidos
+
+
+def decodificar_data_arrow(coluna):
+    """Converte uma coluna de strings 'DDMMAAAA' em date32 (Arrow). Retorna (datas, invalidos)."""
+    texto = pa.array(coluna, type=pa.string())
+    candidatos = pc.if_else(pc.fill_null(pc.match_substring_regex(texto, PADRAO_DATA), False), texto, None)
+    datas = pc.strptime(candidatos, format="%d%m%Y", unit="s", error_is_null=True)
+    # strptime aceita dias inexistentes (31022024 vira 02/03): só vale se a ida e volta bate
+    validos = pc.fill_null(pc.equal(pc.strftime(datas, format="%d%m%Y"), candidatos), False)
+    datas = pc.cast(pc.if_else(validos, datas, None), pa.date32())
+    invalidos = pc.invert(pc.or_(validos, _vazios(texto)))
+    return datas, invalidos
+
+
+def validar_texto_arrow(coluna, tipo_campo):
+    """Máscara de células inválidas de um campo mantido como texto.
+
+    Inválidas: maiores que o tamanho do layout ou, em códigos numéricos
+    (CFOP, CST, CNPJ...), com caracteres que não são dígitos.
+    """
+    texto = pa.array(coluna, type=pa.string())
+    invalidos = _maior_que(texto, tipo_campo.tamanho)
+    if tipo_campo.tipo == "N":
+        nao_digitos = pc.invert(pc.fill_null(pc.match_substring_regex(texto, PADRAO_DIGITOS), True))
+        invalidos = pc.or_(invalidos, nao_digitos)
+    return texto, invalidos
+
+
+def decodificar_coluna_arrow(coluna, tipo_campo):
+    """Decodifica a coluna conforme o tipo do campo. Retorna (array Arrow, máscara Arrow de inválidos)."""
+    if campo_valor(tipo_campo):
+        return decodificar_decimal_arrow(coluna, tipo_campo.decimais)
+    if campo_data(tipo_campo):
+        return decodificar_data_arrow(coluna)
+    return validar_texto_arrow(coluna, tipo_campo)
+
+
+def decodificar_coluna(coluna, tipo_campo):
+    """Decodifica a coluna inteira numa chamada. Retorna (valores, invalidos) em numpy.
+
+    - Valores (N com decimais): float64, NaN para vazios/inválidos.
+    - Datas (D): datetime64[D], NaT para vazias/inválidas.
+    - Demais campos: a própria lista de strings.
+    `invalidos` é um vetor bool (True = célula preenchida fora do formato do layout).
+    """
+    valores, invalidos = decodificar_coluna_arrow(coluna, tipo_campo)
+    invalidos = invalidos.to_numpy(zero_copy_only=False)
+    if campo_valor(tipo_campo):
+        return valores.to_numpy(zero_copy_only=False), invalidos
+    if campo_data(tipo_campo):
+        return valores.to_numpy(zero_copy_only=False).astype("datetime64[D]"), invalidos
+    return coluna, invalidos
@@ -0,0 +1,884 @@
+import copy
+import gc
+import os
+import re
+from itertools import chain
+import tempfile
+import shutil
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from modules.busca import IndiceTrigramas, literais_obrigatorios
+from modules.cubo import CuboResumo
+from modules.decodificar import TIPO_TEXTO, campo_valor, decodificar_coluna
+from modules.hierarquia import IndiceHierarquia, concatenar_faixas
+from modules.indices import IndiceCampo, filtrar_posicoes
+from modules.instrumentacao import DETALHADO, medir
+from modules.layout import RegistroCompilado, layout_generico, selecionar_layout
+from modules.leitor import LINHAS_POR_BLOCO_BUSCA, ArquivoMapeado, LinhasSped, padrao_em_bytes, separar_assinatura
+from modules.validar import ValidacaoEstrutural
+
+# --- Modelo de Documento SPED (lido uma única vez no upload) ---
+
+LINHAS_POR_BLOCO_DOWNLOAD = 20000 # Linhas codificadas por vez ao gerar o arquivo para download
+MIN_LINHAS_INDICE_TEXTO = 50000 # Abaixo disso varrer o arquivo na busca já é instantâneo (sem índice de texto)
+REGISTROS_BLOCO_9 = ["9001", "9900", "9990", "9999"] # Bloco 9 final, regravado a partir dos contadores
+BYTES_POR_CELULA = 60 # Estimativa de memória de cada valor (str) das colunas de um RegistroStore
+CARACTERES_PROIBIDOS_CAMPO = ("|", "\r", "\n") # Separador de campos e quebras de linha (deslocariam os campos da linha)
+
+class RegistroStore:
+    """Armazenamento colunar das linhas de um único tipo de registro (ex: C170).
+
+    Cada campo do layout vira uma coluna (lista de strings). A linha i de
+    todas as colunas corresponde à linha do corpo `linhas[i]` (base 0).
+    Campos ausentes na linha (linha mais curta que o layout) ficam como None.
+    """
+
+    def __init__(self, registro, campos_layout, linhas, tipos_campos=None):
+        self.registro = registro
+        # campos_layout: dict NOME_CAMPO -> índice base 1 (posição após split); o RegistroCompilado
+        # do catálogo já traz as tuplas prontas (compartilhadas por todos os documentos)
+        if isinstance(campos_layout, RegistroCompilado):
+            self.campos, self.indices, self.posicao_campo = campos_layout.campos, campos_layout.indices, campos_layout.posicao_campo
+        else:
+            self.campos = tuple(campos_layout.keys())
+            self.indices = tuple(campos_layout.values())
+            self.posicao_campo = {nome: pos for pos, nome in enumerate(self.campos)}
+        self._colunas = [[] for _ in self.campos]
+        self.linhas = linhas # Vetor (ordenado) com o índice original (base 0) de cada linha no corpo
+        self.indices_campo = {} # NOME_CAMPO -> IndiceCampo (montado no primeiro filtro pelo campo)
+        self.tipos_campos = tipos_campos or {} # NOME_CAMPO -> TipoCampo
+        self.decodificadas = {} # NOME_CAMPO -> (valores, invalidos), decodificados no primeiro uso
+        self._colunas_compartilhadas = set() # Posições das colunas ainda compartilhadas com outro store (ver copia)
+        self._base = None # Store do qual este foi copiado (ver copia)
+        # Despejo (ver despejar): colunas liberadas são separadas de novo a partir de `origem` no próximo uso
+        self.origem = None # Corpo do documento dono do store (linhas já com as edições)
+        self._despejadas = set()
+        self._trava = threading.Lock()
+
+    def __len__(self):
+        return len(self.linhas)
+
+    @property
+    def colunas(self):
+        """Uma lista de valores por campo (as colunas despejadas voltam à memória aqui, sem o chamador perceber)."""
+        if self._despejadas:
+            self._recarregar_colunas()
+        return self._colunas
+
+    @colunas.setter
+    def colunas(self, colunas):
+        self._colunas = colunas
+
+    def copia(self):
+        """Store de outro documento sobre as mesmas linhas, compartilhando as colunas até a primeira gravação.
+
+        Cada coluna é copiada só quando o documento dono da cópia grava nela
+        (ver coluna_propria); índices e decodificações já montados são reaproveitados.
+        """
+        copia = copy.copy(self)
+        copia.colunas = list(self.colunas)
+        copia.indices_campo = dict(self.indices_campo)
+        copia.decodificadas = dict(self.decodificadas)
+        copia._colunas_compartilhadas = set(range(len(self.colunas)))
+        copia._base = self
+        copia._despejadas = set()
+        copia._trava = threading.Lock()
+        return copia
+
+    def coluna_propria(self, pos):
+        """Coluna `pos` pronta para gravação (copiada antes, se ainda compartilhada)."""
+        if pos in self._colunas_compartilhadas:
+            self.colunas[pos] = list(self.colunas[pos])
+            self._colunas_compartilhadas.discard(pos)
+        return self.colunas[pos]
+
+    def memoria_estimada(self, propria=False):
+        """Bytes (aproximados) das colunas, decodificações e índices deste store em memória.
+
+        Com `propria`, só o que não é compartilhado com o store de origem (ver copia).
+        """
+        base = self._base if propria else None
+        colunas = len(self._colunas) - len(self._despejadas) - (len(self._colunas_compartilhadas) if propria else 0)
+        total = len(self) * colunas * BYTES_POR_CELULA
+        for nome, decodificada in self.decodificadas.items():
+            if base is not None and base.decodificadas.get(nome) is decodificada:
+                continue
+            total += sum(_bytes_em_memoria(vetor) for vetor in decodificada)
+        indices = [nome for nome, indice in self.indices_campo.items() if base is None or base.indices_campo.get(nome) is not indice]
+        return total + len(indices) * len(self) * 8
+
+    def despejar(self, diretorio):
+        """Libera a memória própria do store; tudo volta, sob demanda, no próximo uso. Retorna os bytes liberados.
+
+        - colunas próprias: descartadas e separadas de novo a partir das linhas
+          do corpo (o arquivo mapeado em disco + as linhas alteradas);
+        - decodificações numéricas: gravadas em .npy em `diretorio` e reabertas
+          com mmap (o sistema operacional traz as páginas de volta quando lidas);
+        - índices por valor: descartados (refeitos no próximo filtro).
+        Colunas compartilhadas com o store de origem não liberariam nada e ficam.
+        """
+        with self._trava:
+            antes = self.memoria_estimada(propria=True)
+            if self.origem is not None:
+                for pos in range(len(self._colunas)):
+                    if pos not in self._colunas_compartilhadas and pos not in self._despejadas:
+                        self._colunas[pos] = None
+                        self._despejadas.add(pos)
+            for nome, decodificada in list(self.decodificadas.items()):
+                if self._base is not None and self._base.decodificadas.get(nome) is decodificada:
+                    continue
+                if any(_bytes_em_memoria(vetor) for vetor in decodificada):
+                    self.decodificadas[nome] = tuple(_vetor_em_disco(vetor, diretorio) for vetor in decodificada)
+            self.indices_campo = {nome: indice for nome, indice in self.indices_campo.items()
+                                  if self._base is not None and self._base.indices_campo.get(nome) is indice}
+            return antes - self.memoria_estimada(propria=True)
+
+    @property
+    def despejado(self):
+        return bool(self._despejadas) or any(isinstance(vetor, np.memmap) for d in self.decodificadas.values() for vetor in d)
+
+    def _recarregar_colunas(self):
+        with self._trava:
+            if not self._despejadas:
+                return
+            posicoes = sorted(self._despejadas)
+            with medir("memoria.recarregar", linhas=len(self), registro=self.registro, colunas=len(posicoes)):
+                self.preencher(linhas_em(self.origem, self.linhas), posicoes)
+            self._despejadas.clear()
+
+    def preencher(self, linhas_texto, posicoes=None):
+        """Separa as linhas do registro (na ordem de `linhas`) e monta uma coluna por campo (ou só as `posicoes`)."""
+        # Milhões de listas pequenas disparam o coletor de lixo repetidamente; pausa durante a montagem
+        gc_ativo = gc.isenabled()
+        gc.disable()
+        try:
+            partes = [linha.split('|') for linha in linhas_texto]
+            for pos in (range(len(self.indices)) if posicoes is None else posicoes):
+                indice = self.indices[pos]
+                try:
+                    self._colunas[pos] = [p[indice] for p in partes]
+                except IndexError:
+                    # Alguma linha é mais curta que o layout
+                    self._colunas[pos] = [p[indice] if indice < len(p) else None for p in partes]
+        finally:
+            if gc_ativo:
+                gc.enable()
+
+    def coluna(self, nome_campo):
+        """Retorna a lista de valores do campo (ou None se o campo não existir no layout)."""
+        pos = self.posicao_campo.get(nome_campo)
+        return self.colunas[pos] if pos is not None else None
+
+    def indice_campo(self, nome_campo):
+        """Índice invertido (valor -> posições) do campo, montado e guardado no primeiro uso."""
+        indice = self.indices_campo.get(nome_campo)
+        if indice is None:
+            coluna = self.coluna(nome_campo)
+            if coluna is None:
+                return None
+            with medir("indexar.campo", linhas=len(coluna), registro=self.registro, campo=nome_campo):
+                indice = self.indices_campo[nome_campo] = IndiceCampo(coluna)
+        return indice
+
+    def tipo_campo(self, nome_campo):
+        return self.tipos_campos.get(nome_campo, TIPO_TEXTO)
+
+    def coluna_decodificada(self, nome_campo):
+        """(valores, invalidos) do campo conforme o tipo do layout (ver decodificar_coluna), ou None.
+
+        A coluna inteira é decodificada de uma vez e guardada até a próxima edição do campo.
+        """
+        decodificada = self.decodificadas.get(nome_campo)
+        if decodificada is None:
+            coluna = self.coluna(nome_campo)
+            if coluna is None:
+                return None
+            with medir("registros.decodificar", linhas=len(coluna), registro=self.registro, campo=nome_campo):
+                decodificada = self.decodificadas[nome_campo] = decodificar_coluna(coluna, self.tipo_campo(nome_campo))
+        return decodificada
+
+    def linha_para_posicao(self, idx_linha):
+        """Converte o índice original da linha na posição dentro do armazenamento."""
+        pos = int(np.searchsorted(self.linhas, idx_linha))
+        if pos < len(self.linhas) and self.linhas[pos] == idx_linha:
+            return pos
+        return None
+
+
+def _bytes_em_memoria(vetor):
+    """Bytes de um vetor decodificado que ocupam memória (0 para listas e vetores já mapeados do disco)."""
+    if not isinstance(vetor, np.ndarray) or isinstance(vetor, np.memmap) or vetor.dtype == object:
+        return 0
+    return vetor.nbytes
+
+
+def _vetor_em_disco(vetor, diretorio):
+    """Grava o vetor num .npy novo em `diretorio` e o devolve mapeado (somente leitura)."""
+    if not _bytes_em_memoria(vetor):
+        return vetor
+    with tempfile.NamedTemporaryFile(dir=diretorio, suffix=".npy", delete=False) as f:
+        np.save(f, vetor)
+    return np.load(f.name, mmap_mode="r")
+
+
+def _remover_arquivo(caminho):
+    try:
+        os.remove(caminho)
+    except OSError:
+        pass
+
+
+def linhas_em(corpo_sped, indices):
+    """Itera as linhas do corpo nos índices informados (acesso direto quando o corpo é mapeado)."""
+    if hasattr(corpo_sped, "linhas_em"):
+        return corpo_sped.linhas_em(indices)
+    return (corpo_sped[idx] for idx in indices.tolist())
+
+
+def indexar_registros(corpo_sped):
+    """Índice REG -> vetor com os números (base 0) das linhas do corpo daquele registro.
+
+    Para corpo mapeado (LinhasSped) o índice já vem da leitura do arquivo;
+    para uma lista de strings é montado aqui, numa única passada.
+    """
+    if hasattr(corpo_sped, "indice_registros"):
+        return corpo_sped.indice_registros()
+    indice = {}
+    for idx, linha in enumerate(corpo_sped):
+        if linha.startswith('|'):
+            indice.setdefault(linha.split('|', 2)[1], []).append(idx)
+    return {registro: np.array(linhas, dtype=np.uint32) for registro, linhas in indice.items()}
+
+
+def valor_invalido_para_campo(valor):
+    """O valor tem '|' ou quebra de linha (não pode ser gravado dentro de um campo)?"""
+    return any(caractere in valor for caractere in CARACTERES_PROIBIDOS_CAMPO)
+
+
+class ResultadoAlteracao:
+    """Resultado de SpedDocument.alterar_campo_em_lote."""
+
+    def __init__(self):
+        self.indices = np.zeros(0, dtype=np.int64) # Linhas efetivamente alteradas (base 0, ordenadas)
+        self.linhas = []             # Novo texto de cada linha alterada (mesma ordem de `indices`)
+        self.invalidas = []          # Índices além do fim do corpo
+        self.fora_do_registro = []   # Linhas que não são do registro informado
+        self.sem_campo = []          # Linhas mais curtas que a posição do campo no layout
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class LoteEdicao:
+    """Entrada do journal de edições: uma atribuição de campo aplicada a várias linhas.
+
+    Equivale às entradas (linha, campo, valor antigo, valor novo) de cada linha
+    de `indices`; o valor novo é o mesmo para todo o lote.
+    """
+
+    def __init__(self, registro, nome_campo, novo_valor, indices, valores_antigos, linhas_antigas):
+        self.registro = registro
+        self.nome_campo = nome_campo
+        self.novo_valor = novo_valor
+        self.indices = indices                 # Linhas alteradas (base 0, ordenadas)
+        self.valores_antigos = valores_antigos # Valor anterior do campo em cada linha
+        self.linhas_antigas = linhas_antigas   # Texto de cada linha antes do lote (restaurado ao desfazer)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def entradas(self):
+        """Itera (linha, campo, valor antigo, valor novo) de cada linha do lote."""
+        for idx, antigo in zip(self.indices.tolist(), self.valores_antigos):
+            yield idx, self.nome_campo, antigo, self.novo_valor
+
+
+class SpedDocument:
+    """Documento SPED separado em corpo/assinatura e em tabelas colunares por registro.
+
+    O corpo pode ser uma lista de strings ou uma LinhasSped (arquivo mapeado,
+    decodificado sob demanda). O índice REG -> linhas é montado na leitura; as
+    tabelas de cada registro são montadas (lendo só as linhas daquele registro)
+    na primeira vez em que um módulo pede por elas e ficam guardadas no documento.
+    """
+
+    def __init__(self, corpo_sped, assinatura, sped_layout, sped_tipos=None, indice_registros=None, hierarquia=None, base=None):
+        self.corpo = corpo_sped
+        self.assinatura = assinatura if assinatura is not None else []
+        # Um CatalogoLayouts é resolvido para o layout da versão do arquivo (0000.COD_VER)
+        self.layout = selecionar_layout(sped_layout, corpo_sped) or {}
+        self.tipos = sped_tipos or {} # REG -> {CAMPO: TipoCampo}
+        # Índices de registros e hierarquia podem vir prontos (documento base em cache, ver a_partir_de)
+        if indice_registros is None:
+            with medir("indexar.registros", linhas=len(corpo_sped)):
+                indice_registros = indexar_registros(corpo_sped)
+        self.indice_registros = indice_registros
+        # Pai e subárvore de cada linha (nível de cada registro vem do catálogo de layouts)
+        if hierarquia is None:
+            with medir("indexar.hierarquia", linhas=len(corpo_sped)):
+                hierarquia = IndiceHierarquia(self.indice_registros, len(corpo_sped), getattr(self.layout, "niveis", {}))
+        self.hierarquia = hierarquia
+        self.base = base # Documento (nunca editado) do qual os RegistroStore são copiados, se houver
+        self._trava_registros = threading.Lock() # Stores de um documento base são montados por várias sessões
+        self.registros = {} # REG -> RegistroStore (montado sob demanda)
+        # Linhas por registro e por bloco no corpo; os encerramentos x990, 9900, 9990 e 9999
+        # do arquivo gerado a partir de um documento editado são regravados a partir delas
+        self.contagem = {registro: len(linhas) for registro, linhas in self.indice_registros.items()}
+        self.contagem_bloco = {}
+        for registro, quantidade in self.contagem.items():
+            self.contagem_bloco[registro[0]] = self.contagem_bloco.get(registro[0], 0) + quantidade
+        self.recalcular_encerramento = True # False: o arquivo gerado mantém os contadores como estão, mesmo editado
+        # Journal de edições sobre o arquivo original (que nunca é modificado):
+        # journal[:posicao_journal] estão aplicados; o restante pode ser refeito.
+        self.journal = []
+        self.posicao_journal = 0
+        # Incrementada a cada alteração no conteúdo (edição, desfazer, refazer)
+        self.versao = 0
+        self._arquivos_gerados = {} # tipo -> (versao, caminho, finalizador) dos arquivos de exportação
+        self._cubo = None # CuboResumo (montado no primeiro resumo, atualizado a cada edição)
+        self._validacao = None # ValidacaoEstrutural (montada na primeira validação, atualizada a cada edição)
+        self._indice_texto = None # IndiceTrigramas (montado em segundo plano, ver iniciar_indice_texto)
+        self.ultimo_uso = {} # REG -> instante (time.monotonic) do último pedido do RegistroStore
+        self._diretorio_despejo = None # Pasta dos vetores despejados (ver despejar_registro), removida com o documento
+
+    def __len__(self):
+        return len(self.corpo)
+
+    @classmethod
+    def a_partir_de(cls, base, sped_layout, sped_tipos=None):
+        """Documento novo (edições, journal e derivados próprios) sobre o mesmo conteúdo de `base`.
+
+        Arquivo mapeado, índice de registros e hierarquia são compartilhados (não
+        mudam com edições); os RegistroStore vêm de `base` e só têm as colunas
+        copiadas quando editadas. Custo proporcional ao número de registros.
+        """
+        corpo = base.corpo
+        corpo = LinhasSped(corpo.arquivo, corpo.inicio, corpo.fim) if isinstance(corpo, LinhasSped) else list(corpo)
+        return cls(corpo, list(base.assinatura), sped_layout, sped_tipos,
+                   indice_registros=base.indice_registros, hierarquia=base.hierarquia, base=base)
+
+    def memoria_estimada(self, propria=False):
+        """Bytes (aproximados) dos vetores de índice, dos RegistroStore montados e das linhas alteradas.
+
+        Com `propria`, só o que é deste documento: o que vem do documento base
+        (índices, hierarquia, colunas não editadas, índice de texto) fica de fora.
+        """
+        total = sum(store.memoria_estimada(propria) for store in self.registros.values())
+        total += sum(len(linha) + 50 for linha in getattr(self.corpo, "alteradas", {}).values())
+        if propria and self.base is not None:
+            return total
+        total += sum(_bytes_em_memoria(linhas) for linhas in self.indice_registros.values())
+        total += sum(_bytes_em_memoria(vetor) for vetor in self.hierarquia.vetores())
+        arquivo = getattr(self.corpo, "arquivo", None)
+        if arquivo is not None:
+            total += sum(_bytes_em_memoria(vetor) for vetor in arquivo.vetores_indice())
+        if self._indice_texto is not None:
+            total += self._indice_texto.nbytes()
+        return total
+
+    def despejar_registro(self, registro, diretorio):
+        """Libera a memória do RegistroStore (ver RegistroStore.despejar). Retorna os bytes liberados."""
+        store = self.registros.get(registro)
+        if store is None:
+            return 0
+        if self._diretorio_despejo is None:
+            os.makedirs(diretorio, exist_ok=True)
+            self._diretorio_despejo = tempfile.mkdtemp(prefix="documento_", dir=diretorio)
+            weakref.finalize(self, shutil.rmtree, self._diretorio_despejo, True)
+        return store.despejar(self._diretorio_despejo)
+
+    def registros_despejados(self):
+        return [registro for registro, store in self.registros.items() if store.despejado]
+
+    def registros_presentes(self):
+        """Todos os REGs do corpo, na ordem da primeira ocorrência."""
+        return sorted(self.indice_registros, key=lambda reg: self.indice_registros[reg][0])
+
+    def tipos_registro(self):
+        """Registros presentes no corpo e no layout (sem os de campos genéricos), em ordem alfabética."""
+        return sorted(self.registros_com_layout())
+
+    def registros_com_layout(self):
+        """Registros do corpo com layout próprio (exclui os de campos genéricos), na ordem da primeira ocorrência."""
+        return [reg for reg in self.registros_presentes() if self.layout.get(reg) and not layout_generico(self.layout[reg])]
+
+    def linhas_em(self, indices):
+        """Texto atual das linhas do corpo nos índices informados."""
+        return linhas_em(self.corpo, indices)
+
+    def linhas_do_registro(self, registro):
+        """Vetor com os números (base 0) das linhas do registro no corpo."""
+        return self.indice_registros.get(registro, np.zeros(0, dtype=np.uint32))
+
+    def linhas_dos_registros(self, registros):
+        """Vetor ordenado com as linhas (base 0) do corpo que são de algum dos `registros`."""
+        codigos = [self.hierarquia.codigo_registro[reg] for reg in registros if reg in self.hierarquia.codigo_registro]
+        return np.flatnonzero(np.isin(self.hierarquia.registro_linha, codigos))
+
+    # --- Busca no corpo ---
+
+    def buscar(self, termo, inicio=0, regex=False, diferenciar_maiusculas=False, registros=None,
+               linhas_por_bloco=LINHAS_POR_BLOCO_BUSCA):
+        """Gera (próxima linha a varrer, linhas com ocorrência) a partir de `inicio`, um bloco por vez.
+
+        Quem consome pode parar a qualquer momento (ex: ao juntar ocorrências
+        suficientes) e continuar depois a partir da última "próxima linha".
+        `registros` restringe as ocorrências às linhas desses REGs. Um `termo`
+        inválido como expressão regular levanta re.error.
+        """
+        padrao = re.compile(termo if regex else re.escape(termo), 0 if diferenciar_maiusculas else re.IGNORECASE)
+        codigos = None
+        if registros:
+            codigos = [self.hierarquia.codigo_registro[reg] for reg in registros if reg in self.hierarquia.codigo_registro]
+
+        indice = self.indice_texto()
+        padrao_bytes = padrao_em_bytes(padrao) if indice is not None else None
+        if padrao_bytes is not None:
+            blocos = self._buscar_indice(indice, padrao, padrao_bytes, literais_obrigatorios(termo) if regex else [termo],
+                                         inicio, linhas_por_bloco)
+        elif hasattr(self.corpo, "buscar"):
+            blocos = self.corpo.buscar(padrao, inicio, linhas_por_bloco)
+        else:
+            blocos = self._buscar_lista(padrao, inicio, linhas_por_bloco)
+        for proxima, linhas in blocos:
+            if codigos is not None:
+                linhas = linhas[np.isin(self.hierarquia.registro_linha[linhas], codigos)]
+            yield proxima, linhas
+
+    def linhas_com_texto(self, termo, regex=False, diferenciar_maiusculas=False, registros=None):
+        """Vetor com todas as linhas do corpo em que o termo ocorre (ver buscar)."""
+        with medir("buscar.texto", indice=self.indice_texto() is not None) as etapa:
+            partes = [linhas for _, linhas in self.buscar(termo, 0, regex, diferenciar_maiusculas, registros)]
+            encontradas = np.concatenate(partes) if partes else np.zeros(0, dtype=np.int64)
+            etapa.linhas = len(encontradas)
+        return encontradas
+
+    def _buscar_indice(self, indice, padrao, padrao_bytes, literais, inicio, linhas_por_bloco):
+        """Mesmo protocolo de LinhasSped.buscar, com as ocorrências do arquivo todo vindas do índice de trigramas."""
+        corpo = self.corpo
+        linhas = indice.ocorrencias(padrao_bytes, literais, corpo.inicio, corpo.fim) - corpo.inicio
+        linhas = corpo.conferir_alteradas(padrao, linhas, 0, len(corpo))
+        for ini_bloco in range(inicio, len(corpo), linhas_por_bloco):
+            fim_bloco = min(ini_bloco + linhas_por_bloco, len(corpo))
+            yield fim_bloco, linhas[np.searchsorted(linhas, ini_bloco):np.searchsorted(linhas, fim_bloco)]
+
+    def iniciar_indice_texto(self):
+        """Começa a montar, em segundo plano, o índice de trigramas do arquivo (só arquivos mapeados grandes)."""
+        if self._indice_texto is None and self.base is not None:
+            self._indice_texto = self.base.iniciar_indice_texto() # Um índice por arquivo, para todas as sessões
+        elif self._indice_texto is None and isinstance(self.corpo, LinhasSped) and len(self.corpo) >= MIN_LINHAS_INDICE_TEXTO:
+            self._indice_texto = IndiceTrigramas(self.corpo.arquivo).iniciar()
+        return self._indice_texto
+
+    def indice_texto(self):
+        """Índice de trigramas pronto para uso, ou None (não pedido, ainda em montagem ou com falha)."""
+        indice = self._indice_texto
+        if indice is None or not indice.pronto.is_set() or indice.erro is not None:
+            return None
+        return indice
+
+    def progresso_indice_texto(self):
+        """Fração (0 a 1) já montada do índice de trigramas, ou None se ele não foi pedido ou falhou."""
+        indice = self._indice_texto
+        if indice is None or indice.erro is not None:
+            return None
+        return 1.0 if indice.pronto.is_set() else indice.progresso
+
+    def _buscar_lista(self, padrao, inicio, linhas_por_bloco):
+        for ini_bloco in range(inicio, len(self.corpo), linhas_por_bloco):
+            fim_bloco = min(ini_bloco + linhas_por_bloco, len(self.corpo))
+            achadas = [i for i in range(ini_bloco, fim_bloco) if padrao.search(self.corpo[i])]
+            yield fim_bloco, np.array(achadas, dtype=np.int64)
+
+    def carregar_registros(self, registros):
+        """Monta os RegistroStore ainda não carregados, lendo apenas as linhas de cada registro."""
+        for registro in registros:
+            if registro in self.registros or registro not in self.layout:
+                continue
+            if self.base is not None:
+                store = self.base.registro_compartilhado(registro)
+                if store is not None:
+                    self.registros[registro] = store = store.copia()
+                    store.origem = self.corpo
+                    continue
+            linhas = self.linhas_do_registro(registro)
+            store = RegistroStore(registro, self.layout[registro], linhas, self.tipos.get(registro))
+            with medir("registros.separar", linhas=len(linhas), registro=registro):
+                store.preencher(linhas_em(self.corpo, linhas))
+            store.origem = self.corpo
+            self.registros[registro] = store
+
+    def tipo_campo(self, registro, nome_campo):
+        """TipoCampo do campo no layout (texto, se o registro/campo não tiver tipo definido)."""
+        return self.tipos.get(registro, {}).get(nome_campo, TIPO_TEXTO)
+
+    def registro(self, registro):
+        """Retorna o RegistroStore do registro (ou None se ele não estiver no layout)."""
+        self.ultimo_uso[registro] = time.monotonic() # Registros sem uso recente são os primeiros despejados
+        if registro not in self.registros:
+            self.carregar_registros([registro])
+        return self.registros.get(registro)
+
+    def registro_compartilhado(self, registro):
+        """RegistroStore deste documento (base) para outros copiarem; montado uma vez mesmo com várias sessões."""
+        with self._trava_registros:
+            return self.registro(registro)
+
+    # --- Navegação entre registros pai e filhos ---
+
+    def registro_pai(self, registro):
+        """Tipo do registro pai de `registro` no arquivo (ex: C170 -> C100), ou None."""
+        pais = self.hierarquia.registros_pai(registro)
+        return pais[0] if len(pais) == 1 else None
+
+    def posicoes_pai(self, store, store_pai):
+        """Posição no RegistroStore `store_pai` do pai de cada linha de `store` (-1 se não houver).
+
+        Sem nível conhecido para os registros, usa o último pai antes da linha no arquivo.
+        """
+        niveis = self.hierarquia.nivel
+        if len(store) and len(store_pai) and niveis[store.linhas[0]] >= 0 and niveis[store_pai.linhas[0]] >= 0:
+            return self.hierarquia.posicoes_pai(store.linhas, store_pai.linhas, store_pai.registro)
+        if not len(store_pai):
+            return np.full(len(store), -1, dtype=np.int64)
+        return np.searchsorted(store_pai.linhas, store.linhas, side="right").astype(np.int64) - 1
+
+    def filtrar_por_pai(self, registro, registro_pai, filtros, modo="Contém"):
+        """Posições (no RegistroStore de `registro`) das linhas cujo pai atende aos filtros {campo: valor}.
+
+        Ex: itens C170 das notas C100 com determinada CHV_NFE ou DT_DOC. Os pais
+        são filtrados pelos índices do registro pai e os filhos saem das faixas
+        contíguas de cada pai, sem olhar as demais linhas.
+        """
+        store, store_pai = self.registro(registro), self.registro(registro_pai)
+        if store is None or store_pai is None:
+            return np.zeros(0, dtype=np.int64)
+        pais = filtrar_posicoes(store_pai, filtros, modo)
+        inicios, fins = self.hierarquia.faixas_filhos(store_pai.linhas[pais], store.linhas)
+        return concatenar_faixas(inicios, fins)
+
+    def filhos_dos_pais(self, registro, registro_pai, campo_pai, valores):
+        """Posições (no RegistroStore de `registro`) dos filhos dos pais cujo `campo_pai` é um dos `valores`.
+
+        Ex: todos os C170 de uma lista de CHV_NFE coladas pelo usuário (uma
+        consulta de igualdade no índice do campo por valor).
+        """
+        store, store_pai = self.registro(registro), self.registro(registro_pai)
+        indice = store_pai.indice_campo(campo_pai) if store_pai is not None else None
+        if store is None or indice is None or not valores:
+            return np.zeros(0, dtype=np.int64)
+        pais = np.unique(np.concatenate([indice.igual(valor) for valor in valores]))
+        inicios, fins = self.hierarquia.faixas_filhos(store_pai.linhas[pais], store.linhas)
+        return concatenar_faixas(inicios, fins)
+
+    def totais_filhos(self, registro_pai, registro, campo):
+        """Soma de `campo` (decodificado) dos filhos `registro` de cada linha de `registro_pai`.
+
+        Retorna um vetor alinhado ao RegistroStore do pai (ex: soma dos VL_ITEM dos C170 de cada C100).
+        """
+        store, store_pai = self.registro(registro), self.registro(registro_pai)
+        if store_pai is None:
+            return np.zeros(0)
+        if store is None or campo not in store.posicao_campo:
+            return np.zeros(len(store_pai))
+        if not campo_valor(store.tipo_campo(campo)):
+            raise ValueError(f"{registro}.{campo} não é um campo de valor no layout")
+        decodificada = store.coluna_decodificada(campo)
+        posicoes = self.posicoes_pai(store, store_pai)
+        com_pai = posicoes >= 0
+        valores = np.nan_to_num(decodificada[0], nan=0.0)
+        return np.bincount(posicoes[com_pai], weights=valores[com_pai], minlength=len(store_pai))
+
+    def alterar_campo(self, registro, idx_linha, nome_campo, novo_valor):
+        """Altera um campo de uma única linha (atalho para alterar_campo_em_lote).
+
+        Retorna True se a linha foi modificada, False se o valor já era o mesmo.
+        Lança KeyError/IndexError se a linha ou o campo não existirem para o registro.
+        """
+        resultado = self.alterar_campo_em_lote(registro, [idx_linha], nome_campo, novo_valor)
+        if resultado.invalidas or resultado.fora_do_registro:
+            raise KeyError(f"Linha {idx_linha+1} não pertence ao registro {registro}")
+        if resultado.sem_campo:
+            raise IndexError(f"Linha {idx_linha+1} não possui o campo {nome_campo}")
+        return bool(len(resultado.indices))
+
+    def alterar_campo_em_lote(self, registro, indices_linhas, nome_campo, novo_valor):
+        """Atribui `novo_valor` ao campo em todas as linhas informadas, de uma vez.
+
+        A coluna do RegistroStore é consultada/atualizada em lote e apenas as
+        linhas cujo valor realmente muda são re-serializadas. Retorna um
+        ResultadoAlteracao com as linhas alteradas (para contagem e preview) e
+        as que foram puladas. Lança KeyError se o registro ou o campo não
+        existirem no layout e ValueError se o valor tiver '|' ou quebra de linha
+        (deslocaria os campos seguintes da linha).
+        """
+        if valor_invalido_para_campo(novo_valor):
+            raise ValueError(f"O valor {novo_valor!r} contém '|' ou quebra de linha, que não podem estar dentro de um campo")
+        store = self.registro(registro)
+        if store is None:
+            raise KeyError(f"Registro {registro} não está no layout")
+        pos_campo = store.posicao_campo[nome_campo]
+        coluna = store.colunas[pos_campo]
+        resultado = ResultadoAlteracao()
+
+        ids = np.unique(np.asarray(indices_linhas, dtype=np.int64))
+        invalidas = ids >= len(self)
+        resultado.invalidas = ids[invalidas].tolist()
+        ids = ids[~invalidas]
+
+        # Posição de cada linha no RegistroStore (linhas de outro registro ficam de fora)
+        if len(store):
+            posicoes = np.searchsorted(store.linhas, ids)
+            pertence = store.linhas[np.minimum(posicoes, len(store) - 1)] == ids
+        else:
+            posicoes = np.zeros(len(ids), dtype=np.int64)
+            pertence = np.zeros(len(ids), dtype=bool)
+        resultado.fora_do_registro = ids[~pertence].tolist()
+        ids, posicoes = ids[pertence], posicoes[pertence]
+
+        valores = [coluna[pos] for pos in posicoes.tolist()]
+        sem_campo = np.fromiter((v is None for v in valores), dtype=bool, count=len(valores))
+        muda = np.fromiter((v is not None and v != novo_valor for v in valores), dtype=bool, count=len(valores))
+        resultado.sem_campo = ids[sem_campo].tolist()
+        ids, posicoes = ids[muda], posicoes[muda]
+        valores_antigos = [v for v, m in zip(valores, muda.tolist()) if m]
+
+        resultado.indices = ids
+        if len(ids):
+            # Nova edição descarta o que havia para refazer e entra no journal (antes da gravação,
+            # para a validação atualizada já ver o documento como editado)
+            del self.journal[self.posicao_journal:]
+            self.journal.append(LoteEdicao(registro, nome_campo, novo_valor, ids, valores_antigos, list(linhas_em(self.corpo, ids))))
+            self.posicao_journal += 1
+        resultado.linhas = self._gravar_valores(store, pos_campo, ids, posicoes, [novo_valor] * len(ids))
+        return resultado
+
+    def _gravar_valores(self, store, pos_campo, ids, posicoes, valores, linhas=None):
+        """Grava valores[i] no campo da linha ids[i] (coluna e texto). Retorna o novo texto das linhas.
+
+        Com `linhas` (ex: o texto original guardado no journal, ao desfazer), o
+        texto de cada linha é o informado, sem remontar a linha atual.
+        """
+        indice_campo = store.indices[pos_campo]
+        coluna = store.coluna_propria(pos_campo)
+        if linhas is not None:
+            novas_linhas = list(linhas)
+        else:
+            # Apenas as linhas tocadas são re-serializadas
+            novas_linhas = []
+            for linha, valor in zip(linhas_em(self.corpo, ids), valores):
+                partes = linha.split('|')
+                partes[indice_campo] = valor
+                novas_linhas.append('|'.join(partes))
+        for pos, valor in zip(posicoes.tolist(), valores):
+            coluna[pos] = valor
+        for idx, linha in zip(ids.tolist(), novas_linhas):
+            self.corpo[idx] = linha
+        if len(ids):
+            cubo_em_dia = self._cubo is not None and self._cubo.versao == self.versao
+            validacao_em_dia = self._validacao is not None and self._validacao.versao == self.versao
+            self.versao += 1
+            if cubo_em_dia:
+                self._cubo.atualizar(store.registro, posicoes, self.versao)
+            # Índice e decodificação do campo ficam desatualizados; são refeitos no próximo uso
+            store.indices_campo.pop(store.campos[pos_campo], None)
+            store.decodificadas.pop(store.campos[pos_campo], None)
+            if validacao_em_dia:
+                self._validacao.atualizar(self, store.registro, ids, posicoes, self.versao)
+        return novas_linhas
+
+    def _reaplicar(self, lote, valores, linhas=None):
+        store = self.registro(lote.registro)
+        posicoes = np.searchsorted(store.linhas, lote.indices)
+        self._gravar_valores(store, store.posicao_campo[lote.nome_campo], lote.indices, posicoes, valores, linhas)
+
+    def pode_desfazer(self):
+        return self.posicao_journal > 0
+
+    def pode_refazer(self):
+        return self.posicao_journal < len(self.journal)
+
+    def desfazer(self):
+        """Desfaz o último lote aplicado (custo proporcional ao tamanho do lote). Retorna o lote ou None."""
+        if not self.pode_desfazer():
+            return None
+        self.posicao_journal -= 1
+        lote = self.journal[self.posicao_journal]
+        self._reaplicar(lote, lote.valores_antigos, lote.linhas_antigas) # Texto exato de antes do lote
+        # Linhas que voltaram ao texto original deixam de ocupar a camada de alterações
+        descartar = getattr(self.corpo, "descartar_iguais_ao_original", None)
+        if descartar is not None:
+            descartar(lote.indices)
+        return lote
+
+    def refazer(self):
+        """Reaplica o próximo lote desfeito. Retorna o lote ou None."""
+        if not self.pode_refazer():
+            return None
+        lote = self.journal[self.posicao_journal]
+        self.posicao_journal += 1
+        self._reaplicar(lote, [lote.novo_valor] * len(lote))
+        return lote
+
+    def historico(self):
+        """Lotes aplicados até agora (do mais antigo ao mais recente)."""
+        return self.journal[:self.posicao_journal]
+
+    def alteracoes(self, limite=None):
+        """Entradas (linha, REG, campo, valor antigo, valor novo) aplicadas até agora, na ordem do journal."""
+        entradas = []
+        for lote in self.historico():
+            for idx, campo, antigo, novo in lote.entradas():
+                if limite is not None and len(entradas) >= limite:
+                    return entradas
+                entradas.append((idx, lote.registro, campo, antigo, novo))
+        return entradas
+
+    # --- Contadores e registros de encerramento ---
+
+    def encerramento_recalculado(self):
+        """O arquivo gerado terá os encerramentos recalculados?
+
+        Só quando `recalcular_encerramento` está ligado e há edições aplicadas:
+        sem edições (ou com todas desfeitas) o arquivo sai exatamente como o original.
+        """
+        return self.recalcular_encerramento and self.posicao_journal > 0
+
+    def _registros_9900(self):
+        """REGs listados no 9900 do arquivo gerado: os do corpo e os do próprio bloco 9.
+
+        Mantém a ordem dos 9900 originais quando eles cobrem exatamente os mesmos registros.
+        """
+        registros = [reg for reg in self.registros_presentes() if self.contagem.get(reg, 0) > 0]
+        registros += [reg for reg in REGISTROS_BLOCO_9 if reg not in registros]
+        originais = [linha.split('|')[2] for linha in self.assinatura if linha.startswith('|9900|') and linha.count('|') >= 3]
+        return originais if sorted(originais) == sorted(registros) else registros
+
+    def encerramentos(self):
+        """({índice no corpo: nova linha} dos x990 desatualizados, linhas do bloco 9 final + assinatura).
+
+        Tudo sai dos contadores (custo proporcional ao número de registros, não de
+        linhas). Sem bloco 9 no arquivo original, nada é acrescentado ao final.
+        """
+        substituicoes = {}
+        for registro, linhas in self.indice_registros.items():
+            if len(registro) == 4 and registro.endswith("990") and registro[0] != "9":
+                nova = f"|{registro}|{self.contagem_bloco.get(registro[0], 0)}|"
+                for idx, linha in zip(linhas.tolist(), self.linhas_em(linhas)):
+                    if linha != nova:
+                        substituicoes[idx] = nova
+
+        fim_bloco_9 = next((i for i, linha in enumerate(self.assinatura) if linha.startswith('|9999|')), None)
+        if fim_bloco_9 is None:
+            return substituicoes, self.assinatura
+        registros_9900 = self._registros_9900()
+        contagem = {registro: quantidade for registro, quantidade in self.contagem.items() if quantidade > 0}
+        contagem.update({"9001": 1, "9900": len(registros_9900), "9990": 1, "9999": 1})
+        linhas_bloco_9 = len(registros_9900) + 3
+        bloco_9 = ["|9001|0|"]
+        bloco_9 += [f"|9900|{registro}|{contagem.get(registro, 0)}|" for registro in registros_9900]
+        bloco_9 += [f"|9990|{linhas_bloco_9}|", f"|9999|{sum(self.contagem_bloco.values()) + linhas_bloco_9}|"]
+        return substituicoes, bloco_9 + self.assinatura[fim_bloco_9 + 1:]
+
+    def _linhas_geradas(self):
+        """Linhas do arquivo gerado: corpo (x990 recalculados) + bloco 9 recalculado + assinatura."""
+        if not self.encerramento_recalculado():
+            return chain(self.corpo, self.assinatura)
+        substituicoes, final = self.encerramentos()
+        if not substituicoes:
+            return chain(self.corpo, final)
+
+        def corpo():
+            for idx, linha in enumerate(self.corpo):
+                yield substituicoes.get(idx, linha)
+        return chain(corpo(), final)
+
+    def iter_bytes(self, linhas_por_bloco=LINHAS_POR_BLOCO_DOWNLOAD):
+        """Conteúdo do arquivo gerado (corpo + assinatura, unidos por '\\n') em blocos de bytes latin-1.
+
+        Em documentos editados (ver encerramento_recalculado), os contadores
+        x990/9900/9990/9999 saem dos contadores do documento (ver encerramentos).
+        """
+        primeiro = True
+        bloco = []
+        for linha in self._linhas_geradas():
+            bloco.append(linha)
+            if len(bloco) >= linhas_por_bloco:
+                with medir("download.codificar", linhas=len(bloco), nivel=DETALHADO):
+                    dados = (("" if primeiro else "\n") + "\n".join(bloco)).encode("latin-1", errors="replace")
+                yield dados
+                primeiro = False
+                bloco = []
+        if bloco:
+            yield (("" if primeiro else "\n") + "\n".join(bloco)).encode("latin-1", errors="replace")
+
+    def cubo_resumo(self):
+        """Cubo de agregação do resumo, montado na primeira chamada e reaproveitado entre reruns.
+
+        As edições o atualizam só nas linhas alteradas; se ficar para trás da
+        versão do documento por qualquer motivo, é remontado.
+        """
+        if self._cubo is None or self._cubo.versao != self.versao:
+            with medir("agregar.cubo", linhas=len(self)):
+                self._cubo = CuboResumo(self)
+        return self._cubo
+
+    def validacao(self):
+        """Validação estrutural (ValidacaoEstrutural), feita na primeira chamada e mantida em dia pelas edições."""
+        if self._validacao is None or self._validacao.versao != self.versao:
+            with medir("validar.estrutura", linhas=len(self)) as etapa:
+                self._validacao = ValidacaoEstrutural(self)
+                etapa.anotar(problemas=len(self._validacao))
+        return self._validacao
+
+    def validacao_atual(self):
+        """A validação estrutural, se já foi feita e está em dia; None caso contrário (não valida)."""
+        if self._validacao is not None and self._validacao.versao == self.versao:
+            return self._validacao
+        return None
+
+    def arquivo_gerado(self, tipo):
+        """Caminho do arquivo `tipo` (ex: "download", "xlsx") gerado para a versão atual, ou None."""
+        gerado = self._arquivos_gerados.get(tipo)
+        if gerado is not None and gerado[0] == self.versao:
+            return gerado[1]
+        return None
+
+    def registrar_arquivo_gerado(self, tipo, caminho):
+        """Guarda o arquivo `tipo` gerado para a versão atual, descartando o anterior do mesmo tipo.
+
+        O arquivo é removido quando for substituído ou quando o documento for descartado.
+        """
+        anterior = self._arquivos_gerados.get(tipo)
+        if anterior is not None and anterior[1] != caminho:
+            anterior[2]()
+        finalizador = weakref.finalize(self, _remover_arquivo, caminho)
+        self._arquivos_gerados[tipo] = (self.versao, caminho, finalizador)
+
+    def caminho_download(self):
+        """Arquivo temporário com o conteúdo da versão atual, gerado só quando pedido e reaproveitado
+        enquanto o documento não for alterado."""
+        caminho = self.arquivo_gerado("download")
+        if caminho is not None:
+            return caminho
+
+        arquivo_tmp = tempfile.NamedTemporaryFile(prefix="sped_download_", suffix=".txt", delete=False)
+        with arquivo_tmp, medir("download.gerar", linhas=len(self) + len(self.assinatura)) as etapa:
+            for bloco in self.iter_bytes():
+                arquivo_tmp.write(bloco)
+            etapa.bytes = arquivo_tmp.tell()
+        self.registrar_arquivo_gerado("download", arquivo_tmp.name)
+        return arquivo_tmp.name
+
+
+def abrir_documento(arquivo, sped_layout, sped_tipos=None):
+    """Lê um SPED (caminho ou arquivo aberto), separa a assinatura e monta o SpedDocument.
+
+    Versão sem interface de utils.carregar_documento_sped: erros de leitura são lançados.
+    """
+    corpo_sped, assinatura = separar_assinatura(LinhasSped(ArquivoMapeado(arquivo)))
+    return SpedDocument(corpo_sped, assinatura, sped_layout, sped_tipos)
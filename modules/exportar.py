@@ -0,0 +1,184 @@
+import zipfile
+from itertools import islice
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+from modules.decodificar import decodificar_coluna_arrow
+from modules.documento import RegistroStore, linhas_em
+from modules.layout import RegistroCompilado
+
+# --- Exportação do SPED em planilha (escrita em streaming, memória constante) ---
+
+LIMITE_LINHAS_EXCEL = 1_048_576 # Linhas por aba no Excel, incluindo o cabeçalho
+INTERVALO_PROGRESSO = 10_000    # Linhas escritas entre duas chamadas de progresso
+LINHAS_POR_LOTE_PARQUET = 250_000 # Linhas por row group no Parquet (limita a memória por registro)
+TAMANHO_MAXIMO_CODIGO = 6        # Campos de código até este tamanho são gravados como dicionário no Parquet
+
+
+def nome_aba(registro):
+    """Nome de aba válido no Excel (sem caracteres inválidos, até 31 caracteres)."""
+    return registro.replace(':', '_').replace('/', '_')[:31]
+
+
+def iter_valores_registro(documento, registro):
+    """Itera as linhas do registro como tuplas de valores na ordem do layout.
+
+    Usa o RegistroStore se ele já foi montado; caso contrário separa as linhas
+    do registro na hora, sem guardar nada (memória constante).
+    """
+    store = documento.registros.get(registro)
+    if store is not None:
+        return zip(*store.colunas)
+
+    campos_layout = documento.layout[registro]
+    if not isinstance(campos_layout, RegistroCompilado):
+        campos_layout = RegistroCompilado(registro, campos_layout)
+    indices = campos_layout.indices
+    extrair = campos_layout.extrair
+    maior_indice = max(indices)
+
+    def gerar():
+        for linha in linhas_em(documento.corpo, documento.linhas_do_registro(registro)):
+            partes = linha.split('|')
+            if len(partes) > maior_indice:
+                yield extrair(partes)
+            else: # Linha mais curta que o layout
+                yield tuple(partes[i] if i < len(partes) else None for i in indices)
+    return gerar()
+
+
+def exportar_xlsx(documento, destino, progresso=None):
+    """Grava o corpo do SPED em `destino` (.xlsx) com uma aba por registro do layout.
+
+    Usa o modo constant_memory do XlsxWriter: cada linha vai direto para o
+    arquivo, sem DataFrame intermediário. Registros com mais linhas do que
+    cabem numa aba são divididos em C170_1, C170_2, ...
+    `progresso(fracao, mensagem)` é chamado periodicamente, se informado.
+    Retorna a lista de abas criadas.
+    """
+    sped_layout = documento.layout
+    registros = documento.registros_com_layout()
+    total_linhas = sum(len(documento.linhas_do_registro(reg)) for reg in registros) or 1
+    linhas_por_aba = LIMITE_LINHAS_EXCEL - 1
+
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True, 'strings_to_urls': False})
+    formato_cabecalho = workbook.add_format({'bold': True, 'border': 1})
+    abas_criadas = []
+    escritas = 0
+    try:
+        for registro in registros:
+            campos = list(sped_layout[registro].keys())
+            qtd_linhas = len(documento.linhas_do_registro(registro))
+            qtd_abas = max(1, -(-qtd_linhas // linhas_por_aba))
+            valores = iter_valores_registro(documento, registro)
+
+            for n_aba in range(qtd_abas):
+                nome = nome_aba(registro) if qtd_abas == 1 else f"{nome_aba(registro)[:25]}_{n_aba + 1}"
+                worksheet = workbook.add_worksheet(nome)
+                worksheet.write_row(0, 0, campos, formato_cabecalho)
+                abas_criadas.append(nome)
+
+                for linha_excel, linha_valores in enumerate(islice(valores, linhas_por_aba), start=1):
+                    worksheet.write_row(linha_excel, 0, linha_valores)
+                    escritas += 1
+                    if progresso and escritas % INTERVALO_PROGRESSO == 0:
+                        progresso(escritas / total_linhas, f"Aba {nome}: {escritas} de {total_linhas} linhas escritas")
+    finally:
+        workbook.close()
+
+    if progresso:
+        progresso(1.0, f"{escritas} linhas escritas em {len(abas_criadas)} abas")
+    return abas_criadas
+
+
+# --- Exportação tipada em Parquet (um arquivo por registro, dentro de um .zip) ---
+
+def campo_codigo(tipo):
+    """Campos curtos de código (CFOP, CST, IND_, COD_MOD, SER...), gravados como dicionário."""
+    return tipo.tipo in ("C", "N") and tipo.decimais is None and tipo.tamanho is not None and tipo.tamanho <= TAMANHO_MAXIMO_CODIGO
+
+
+def coluna_arrow(tipo, valores):
+    """Converte uma coluna de strings do SPED para um array Arrow do tipo do campo (inválidos viram nulos)."""
+    array, _ = decodificar_coluna_arrow(valores, tipo)
+    return array.dictionary_encode() if campo_codigo(tipo) else array
+
+
+def iter_lotes_registro(documento, registro, linhas_por_lote=LINHAS_POR_LOTE_PARQUET):
+    """Colunas (listas de strings, na ordem do layout) do registro em lotes de até `linhas_por_lote` linhas."""
+    store = documento.registros.get(registro)
+    if store is not None:
+        for inicio in range(0, len(store), linhas_por_lote):
+            yield [coluna[inicio:inicio + linhas_por_lote] for coluna in store.colunas]
+        return
+
+    # Registro ainda não carregado: separa um lote por vez, sem guardar no documento
+    linhas = documento.linhas_do_registro(registro)
+    for inicio in range(0, len(linhas), linhas_por_lote):
+        lote = RegistroStore(registro, documento.layout[registro], linhas[inicio:inicio + linhas_por_lote])
+        lote.preencher(linhas_em(documento.corpo, lote.linhas))
+        yield lote.colunas
+
+
+def exportar_parquet(documento, destino, progresso=None, compressao="zstd"):
+    """Grava em `destino` um .zip com um arquivo Parquet por registro do layout (ex: C170.parquet).
+
+    Colunas com os nomes e os tipos do layout (sped_tipos_campos.txt): valores
+    como float64, datas como date32, códigos curtos (CFOP, CST, IND_...) como
+    dicionário e o restante como texto. Cada registro é gravado em row groups
+    de LINHAS_POR_LOTE_PARQUET linhas.
+    Retorna a lista de arquivos gravados no .zip.
+    """
+    sped_layout = documento.layout
+    registros = documento.registros_com_layout()
+    total_linhas = sum(len(documento.linhas_do_registro(reg)) for reg in registros) or 1
+    arquivos = []
+    escritas = 0
+
+    # Parquet já é comprimido: o .zip apenas agrupa os arquivos
+    with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_STORED) as arquivo_zip:
+        for registro in registros:
+            campos = list(sped_layout[registro].keys())
+            tipos = [documento.tipo_campo(registro, nome) for nome in campos]
+            nome_arquivo = f"{nome_aba(registro)}.parquet"
+            writer = None
+            with arquivo_zip.open(nome_arquivo, "w", force_zip64=True) as saida:
+                try:
+                    for colunas in iter_lotes_registro(documento, registro):
+                        tabela = pa.Table.from_arrays(
+                            [coluna_arrow(tipo, valores) for tipo, valores in zip(tipos, colunas)],
+                            names=campos
+                        )
+                        if writer is None:
+                            writer = pq.ParquetWriter(saida, tabela.schema, compression=compressao)
+                        writer.write_table(tabela)
+                        escritas += tabela.num_rows
+                        if progresso:
+                            progresso(escritas / total_linhas, f"{nome_arquivo}: {escritas} de {total_linhas} linhas gravadas")
+                finally:
+                    if writer is not None:
+                        writer.close()
+            arquivos.append(nome_arquivo)
+
+    if progresso:
+        progresso(1.0, f"{escritas} linhas gravadas em {len(arquivos)} arquivos Parquet")
+    return arquivos
+
+
+# --- CSV no formato original (separado por ponto e vírgula) ---
+
+def gerar_csv(corpo_sped):
+    """Conteúdo CSV (latin-1) das linhas: '|C170|1|ITEM|' vira 'C170;1;ITEM' (sem os '|' das pontas)."""
+    linhas_modificadas = []
+    for linha in corpo_sped:
+        linha_limpa = linha
+        if linha.startswith('|'):
+            linha_limpa = linha_limpa[1:]
+        if linha.endswith('|'):
+            linha_limpa = linha_limpa[:-1]
+        linhas_modificadas.append(linha_limpa.replace("|", ";"))
+
+    # Latin-1 mantém a consistência com o SPED (caracteres fora dele viram '?')
+    return "\n".join(linhas_modificadas).encode('latin-1', errors='replace')
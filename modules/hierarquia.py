@@ -0,0 +1,148 @@
+import numpy as np
+
+# --- Índice hierárquico do corpo (C100 -> C170/C190, D100 -> D190, H005 -> H010, ...) ---
+
+SEM_PAI = -1
+
+
+class IndiceHierarquia:
+    """Pai e fim da subárvore de cada linha do corpo, a partir do nível de cada registro.
+
+    O pai de uma linha de nível N é a linha anterior mais próxima de nível
+    N-1 (sem nenhuma linha de nível menor que N no meio); os descendentes de
+    uma linha ocupam as linhas (linha, fim[linha]). Tudo fica em vetores
+    int32 do tamanho do corpo, montados com operações numpy (uma passada por
+    nível), então subir ou descer um nível é uma consulta O(1).
+    Linhas de registros sem nível conhecido ficam fora da hierarquia.
+    """
+
+    def __init__(self, indice_registros, total_linhas, niveis):
+        self.indice_registros = indice_registros # REG -> vetor ordenado das linhas (o mesmo do documento)
+        self.total_linhas = total_linhas
+        self.registros = sorted(indice_registros) # Código (int16) -> REG
+        self.codigo_registro = {registro: codigo for codigo, registro in enumerate(self.registros)}
+
+        self.registro_linha = np.full(total_linhas, -1, dtype=np.int16)
+        self.nivel = np.full(total_linhas, -1, dtype=np.int8)
+        for registro, linhas in indice_registros.items():
+            self.registro_linha[linhas] = self.codigo_registro[registro]
+            nivel = niveis.get(registro)
+            if nivel is not None:
+                self.nivel[linhas] = nivel
+
+        self.pai = np.full(total_linhas, SEM_PAI, dtype=np.int32)
+        self.fim = np.full(total_linhas, total_linhas, dtype=np.int32)
+        if not total_linhas:
+            return
+        numeros = np.arange(total_linhas, dtype=np.int32)
+        conhecido = self.nivel >= 0
+        for nivel in range(int(self.nivel.max()) + 1):
+            linhas = np.flatnonzero(self.nivel == nivel)
+            if not len(linhas):
+                continue
+            if nivel > 0:
+                # Última linha de nível menor antes de cada uma: é o pai se tiver exatamente nível - 1
+                anteriores = np.maximum.accumulate(np.where(conhecido & (self.nivel < nivel), numeros, -1))[linhas]
+                nivel_anterior = self.nivel[np.maximum(anteriores, 0)]
+                self.pai[linhas] = np.where((anteriores >= 0) & (nivel_anterior == nivel - 1), anteriores, SEM_PAI)
+            # Primeira linha depois de cada uma com nível menor ou igual: fim da subárvore
+            proximas = np.minimum.accumulate(np.where(conhecido & (self.nivel <= nivel), numeros, total_linhas)[::-1])[::-1]
+            self.fim[linhas] = np.append(proximas, total_linhas)[linhas + 1]
+
+    @classmethod
+    def de_vetores(cls, indice_registros, registro_linha, nivel, pai, fim):
+        """Índice já montado antes (ex: lido do cache em disco), sem refazer as passadas por nível."""
+        indice = cls.__new__(cls)
+        indice.indice_registros = indice_registros
+        indice.total_linhas = len(registro_linha)
+        indice.registros = sorted(indice_registros)
+        indice.codigo_registro = {registro: codigo for codigo, registro in enumerate(indice.registros)}
+        indice.registro_linha, indice.nivel, indice.pai, indice.fim = registro_linha, nivel, pai, fim
+        return indice
+
+    def vetores(self):
+        """(registro_linha, nivel, pai, fim), na ordem de de_vetores."""
+        return self.registro_linha, self.nivel, self.pai, self.fim
+
+    def registro_da_linha(self, idx):
+        codigo = int(self.registro_linha[idx])
+        return self.registros[codigo] if codigo >= 0 else None
+
+    def pai_da_linha(self, idx):
+        """Linha (base 0) do pai da linha `idx`, ou None."""
+        pai = int(self.pai[idx])
+        return pai if pai != SEM_PAI else None
+
+    def ancestrais(self, linhas, registro):
+        """Para cada linha, a linha do ancestral do tipo `registro` (SEM_PAI se não houver). Vetorizado."""
+        linhas = np.asarray(linhas, dtype=np.int64)
+        codigo = self.codigo_registro.get(registro)
+        resultado = np.full(len(linhas), SEM_PAI, dtype=np.int64)
+        if codigo is None or not len(linhas):
+            return resultado
+        atuais = self.pai[linhas].astype(np.int64)
+        pendentes = np.flatnonzero(atuais != SEM_PAI)
+        while len(pendentes): # No máximo uma volta por nível
+            candidatos = atuais[pendentes]
+            achou = self.registro_linha[candidatos] == codigo
+            resultado[pendentes[achou]] = candidatos[achou]
+            pendentes = pendentes[~achou]
+            atuais[pendentes] = self.pai[atuais[pendentes]]
+            pendentes = pendentes[atuais[pendentes] != SEM_PAI]
+        return resultado
+
+    def ancestral(self, idx, registro):
+        """Linha do ancestral do tipo `registro` (ex: o C100 dono de um C170), ou None."""
+        linha = int(self.ancestrais([idx], registro)[0])
+        return linha if linha != SEM_PAI else None
+
+    def descendentes(self, idx):
+        """Faixa (início, fim) das linhas abaixo de `idx` na hierarquia (fim exclusivo)."""
+        return idx + 1, int(self.fim[idx])
+
+    def filhos(self, idx, registro=None):
+        """Linhas dos filhos diretos de `idx` (só do tipo `registro`, se informado)."""
+        inicio, fim = self.descendentes(idx)
+        if registro is None:
+            return inicio + np.flatnonzero(self.pai[inicio:fim] == idx)
+        linhas = self.indice_registros.get(registro, np.zeros(0, dtype=np.uint32))
+        faixa = linhas[np.searchsorted(linhas, inicio):np.searchsorted(linhas, fim)]
+        return faixa[self.pai[faixa] == idx]
+
+    def registros_pai(self, registro):
+        """Tipos de registro que aparecem como pai das linhas de `registro` (normalmente um só)."""
+        linhas = self.indice_registros.get(registro)
+        if linhas is None or not len(linhas):
+            return []
+        pais = self.pai[linhas]
+        codigos = np.unique(self.registro_linha[pais[pais != SEM_PAI]])
+        return [self.registros[codigo] for codigo in codigos.tolist()]
+
+    def posicoes_pai(self, linhas_filho, linhas_pai, registro_pai):
+        """Posição, em `linhas_pai` (linhas do registro pai), do ancestral `registro_pai` de cada linha filha (-1 se não houver)."""
+        ancestrais = self.ancestrais(linhas_filho, registro_pai)
+        posicoes = np.searchsorted(linhas_pai, np.maximum(ancestrais, 0)).astype(np.int64)
+        posicoes[ancestrais == SEM_PAI] = -1
+        return posicoes
+
+    def faixas_filhos(self, linhas_pai, linhas_filho):
+        """(inícios, fins): as linhas filhas de linhas_pai[i] são linhas_filho[inícios[i]:fins[i]].
+
+        Vale para qualquer descendente (filhos, netos) do tipo de `linhas_filho`,
+        que ficam contíguos porque estão dentro da subárvore do pai.
+        """
+        linhas_pai = np.asarray(linhas_pai, dtype=np.int64)
+        inicios = np.searchsorted(linhas_filho, linhas_pai, side="right")
+        fins = np.searchsorted(linhas_filho, self.fim[linhas_pai], side="left")
+        return inicios, np.maximum(fins, inicios)
+
+
+def concatenar_faixas(inicios, fins):
+    """Vetor com todas as posições das faixas [inícios[i], fins[i]) (sem laço em Python)."""
+    tamanhos = fins - inicios
+    total = int(tamanhos.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    # Posição k da saída = início da sua faixa + deslocamento dentro dela
+    deslocamentos = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(tamanhos) - tamanhos, tamanhos)
+    return np.repeat(inicios, tamanhos).astype(np.int64) + deslocamentos
@@ -0,0 +1,143 @@
+from bisect import bisect_left
+
+import numpy as np
+
+# --- Índices invertidos (valor -> linhas) por campo de um registro ---
+
+MODOS_FILTRO = ["Contém", "Igual", "Começa com"]
+
+# Acima desta proporção de valores distintos / linhas, o filtro "Contém" varre as
+# linhas já restritas pelos outros filtros em vez do vocabulário do índice (ex: CHV_NFE).
+LIMITE_VOCABULARIO_CONTEM = 0.25
+TAMANHO_CACHE_CONSULTAS = 64
+LINHAS_POR_BLOCO_DISTINTOS = 65536 # Contagem de distintos em blocos: para assim que passa do limite
+
+
+def vocabulario_pequeno(coluna):
+    """A coluna tem poucos valores distintos (vale montar o índice para o filtro "Contém")?
+
+    Conta os distintos com um set em blocos, sem montar o índice, e para no
+    primeiro bloco em que o limite é ultrapassado (ex: CHV_NFE para em ~25% das linhas).
+    """
+    limite = max(1, len(coluna) * LIMITE_VOCABULARIO_CONTEM)
+    distintos = set()
+    for inicio in range(0, len(coluna), LINHAS_POR_BLOCO_DISTINTOS):
+        distintos.update(coluna[inicio:inicio + LINHAS_POR_BLOCO_DISTINTOS])
+        if len(distintos) - (None in distintos) > limite:
+            return False
+    return True
+
+
+class IndiceCampo:
+    """Índice invertido de uma coluna: valor -> vetor ordenado de posições no RegistroStore.
+
+    Montado uma vez (sob demanda) a partir da coluna; consultas por igualdade e
+    prefixo não olham as linhas, e "contém" varre apenas os valores distintos.
+    """
+
+    def __init__(self, coluna):
+        # Numera os valores distintos e ordena as posições por valor: as listas de
+        # posições de cada valor são fatias (sem cópia) de um único vetor `ordem`.
+        codigo_valor = {}
+        codigos = np.fromiter(
+            (codigo_valor.setdefault(valor, len(codigo_valor)) if valor is not None else -1 for valor in coluna),
+            dtype=np.int64, count=len(coluna)
+        )
+        ordem = np.argsort(codigos, kind="stable").astype(np.uint32)
+        contagens = np.bincount(codigos[codigos >= 0], minlength=len(codigo_valor))
+        ausentes = len(coluna) - int(contagens.sum()) # Campo ausente na linha nunca casa com filtro
+        fins = np.cumsum(contagens) + ausentes
+
+        self.total_linhas = len(coluna)
+        self.ordem = ordem
+        self.codigo_valor = codigo_valor
+        self.inicios = (fins - contagens).tolist()
+        self.fins = fins.tolist()
+        self.valores_ordenados = sorted(codigo_valor)
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.codigo_valor)
+
+    def vocabulario_pequeno(self):
+        return len(self.codigo_valor) <= max(1, self.total_linhas * LIMITE_VOCABULARIO_CONTEM)
+
+    def posicoes(self, valor):
+        codigo = self.codigo_valor.get(valor)
+        if codigo is None:
+            return np.zeros(0, dtype=np.uint32)
+        return self.ordem[self.inicios[codigo]:self.fins[codigo]]
+
+    def _unir(self, valores):
+        vetores = [self.posicoes(v) for v in valores]
+        if not vetores:
+            return np.zeros(0, dtype=np.uint32)
+        if len(vetores) == 1:
+            return vetores[0]
+        return np.sort(np.concatenate(vetores))
+
+    def igual(self, valor):
+        return self.posicoes(valor)
+
+    def comeca_com(self, prefixo):
+        inicio = bisect_left(self.valores_ordenados, prefixo)
+        valores = []
+        for valor in self.valores_ordenados[inicio:]:
+            if not valor.startswith(prefixo):
+                break
+            valores.append(valor)
+        return self._unir(valores)
+
+    def contem(self, trecho):
+        return self._unir([valor for valor in self.valores_ordenados if trecho in valor])
+
+    def consultar(self, modo, valor):
+        """Posições que casam com o filtro (modo em MODOS_FILTRO). Consultas recentes ficam em cache."""
+        chave = (modo, valor)
+        resultado = self._cache.get(chave)
+        if resultado is None:
+            if modo == "Igual":
+                resultado = self.igual(valor)
+            elif modo == "Começa com":
+                resultado = self.comeca_com(valor)
+            else:
+                resultado = self.contem(valor)
+            if len(self._cache) >= TAMANHO_CACHE_CONSULTAS:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[chave] = resultado
+        return resultado
+
+
+def filtrar_posicoes(store, filtros, modo="Contém"):
+    """Posições (vetor ordenado) do RegistroStore que atendem a todos os filtros {campo: valor}.
+
+    Filtros resolvidos pelo índice (igualdade, prefixo, ou "contém" em campos de
+    poucos valores distintos) são intersectados primeiro; os demais "contém"
+    varrem apenas as posições que sobraram.
+    """
+    posicoes = None
+    filtros_varredura = []
+    for nome_campo, valor in filtros.items():
+        coluna = store.coluna(nome_campo)
+        if coluna is None:
+            return np.zeros(0, dtype=np.uint32) # Campo não existe no layout do registro
+        if modo == "Contém":
+            # O índice só é montado se for usado: em campos de muitos valores distintos o "contém" varre a coluna
+            indice = store.indices_campo.get(nome_campo)
+            if not (indice.vocabulario_pequeno() if indice is not None else vocabulario_pequeno(coluna)):
+                filtros_varredura.append((coluna, valor))
+                continue
+        encontrados = store.indice_campo(nome_campo).consultar(modo, valor)
+        posicoes = encontrados if posicoes is None else np.intersect1d(posicoes, encontrados, assume_unique=True)
+        if not len(posicoes):
+            return posicoes
+
+    for coluna, trecho in filtros_varredura:
+        if posicoes is None: # Nenhum filtro pelo índice: varre a coluna inteira, sem lista de posições
+            casa = np.fromiter((v is not None and trecho in v for v in coluna), dtype=bool, count=len(coluna))
+            posicoes = np.flatnonzero(casa).astype(np.uint32)
+        else:
+            posicoes = np.array([pos for pos in posicoes.tolist() if coluna[pos] is not None and trecho in coluna[pos]], dtype=np.uint32)
+    if posicoes is None:
+        posicoes = np.arange(len(store), dtype=np.uint32)
+    return posicoes
@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+# --- Instrumentação: etapas cronometradas (linhas, bytes) por execução do app, no lugar dos prints de depuração ---
+
+DESLIGADO, ETAPAS, DETALHADO = 0, 1, 2
+NIVEIS = {"desligado": DESLIGADO, "etapas": ETAPAS, "detalhado": DETALHADO}
+# Nível de quem não está numa execução do app (linha de comando, threads em segundo plano) e o inicial das sessões
+NIVEL_PADRAO = NIVEIS.get(os.environ.get("PAINEL_SPED_INSTRUMENTACAO", "etapas"), ETAPAS)
+ARQUIVO_JSONL = os.environ.get("PAINEL_SPED_TEMPOS") # Se definido, cada execução concluída é acrescentada a este arquivo
+ETAPAS_FORA_DE_EXECUCAO = 500 # Etapas guardadas das threads sem execução (ex: índice de texto em segundo plano)
+
+_local = threading.local()
+_fora_de_execucao = deque(maxlen=ETAPAS_FORA_DE_EXECUCAO)
+_trava_arquivo = threading.Lock()
+
+
+class Etapa:
+    """Um trecho cronometrado. `linhas` e `bytes` podem ser preenchidos durante a etapa."""
+
+    __slots__ = ("nome", "inicio", "duracao", "linhas", "bytes", "nivel", "profundidade", "detalhes", "_execucao", "_inicio_relogio")
+
+    def __init__(self, nome, execucao, nivel, linhas=None, bytes=None, **detalhes):
+        self.nome = nome
+        self.linhas = linhas
+        self.bytes = bytes
+        self.nivel = nivel
+        self.detalhes = detalhes
+        self.duracao = None
+        self._execucao = execucao
+
+    def __enter__(self):
+        pilha = _pilha()
+        self.profundidade = len(pilha)
+        pilha.append(self)
+        self.inicio = time.time()
+        self._inicio_relogio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, erro, rastreio):
+        self.duracao = time.perf_counter() - self._inicio_relogio
+        _pilha().pop()
+        if erro is not None:
+            self.detalhes["erro"] = f"{tipo.__name__}: {erro}"
+        _guardar(self._execucao, self)
+        return False
+
+    def anotar(self, **detalhes):
+        """Acrescenta detalhes (ex: quantidade de problemas) à etapa em andamento."""
+        self.detalhes.update(detalhes)
+
+    def registro(self):
+        """Dicionário (serializável em JSON) da etapa."""
+        return {
+            "etapa": self.nome, "inicio": round(self.inicio, 6),
+            "ms": round(self.duracao * 1000, 3) if self.duracao is not None else None,
+            "linhas": self.linhas, "bytes": self.bytes, "profundidade": self.profundidade, **self.detalhes,
+        }
+
+
+class _EtapaNula:
+    """Etapa abaixo do nível ativo: não mede nada (atribuições de linhas/bytes são descartadas)."""
+
+    linhas = bytes = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, erro, rastreio):
+        return False
+
+    def __setattr__(self, nome, valor):
+        pass
+
+    def anotar(self, **detalhes):
+        pass
+
+
+_NULA = _EtapaNula()
+
+
+class Execucao:
+    """Etapas e eventos de uma execução (rerun) do app numa sessão."""
+
+    def __init__(self, rotulo="", nivel=NIVEL_PADRAO, sessao=None):
+        self.rotulo = rotulo
+        self.nivel = nivel
+        self.sessao = sessao
+        self.inicio = time.time()
+        self.etapas = []  # Etapas concluídas, na ordem de término
+        self.eventos = [] # (instante, mensagem, campos)
+        self.duracao = None
+
+    def concluir(self):
+        self.duracao = time.time() - self.inicio
+        if ARQUIVO_JSONL and self.nivel > DESLIGADO:
+            try:
+                exportar_jsonl([self], ARQUIVO_JSONL)
+            except OSError as e:
+                self.eventos.append((time.time(), f"Tempos não gravados em {ARQUIVO_JSONL}: {e}", {}))
+        return self
+
+    def registros(self):
+        """Linhas JSON da execução: uma por etapa e por evento, com o rótulo e a sessão."""
+        comum = {"execucao": round(self.inicio, 6), "rotulo": self.rotulo, "sessao": self.sessao}
+        linhas = [dict(comum, tipo="etapa", **etapa.registro()) for etapa in self.etapas]
+        linhas += [dict(comum, tipo="evento", inicio=round(instante, 6), mensagem=mensagem, **campos)
+                   for instante, mensagem, campos in self.eventos]
+        if self.duracao is not None:
+            linhas.append(dict(comum, tipo="execucao", ms=round(self.duracao * 1000, 3)))
+        return linhas
+
+    def totais(self):
+        """{nome da etapa: (vezes, segundos, linhas, bytes)} somando as etapas de mesmo nome."""
+        totais = {}
+        for etapa in self.etapas:
+            vezes, segundos, linhas, bytes_ = totais.get(etapa.nome, (0, 0.0, 0, 0))
+            totais[etapa.nome] = (vezes + 1, segundos + etapa.duracao, linhas + (etapa.linhas or 0), bytes_ + (etapa.bytes or 0))
+        return totais
+
+
+def _pilha():
+    pilha = getattr(_local, "pilha", None)
+    if pilha is None:
+        pilha = _local.pilha = []
+    return pilha
+
+
+def _guardar(execucao, etapa):
+    if execucao is not None:
+        execucao.etapas.append(etapa)
+    else:
+        _fora_de_execucao.append(etapa)
+    if _nivel(execucao) >= DETALHADO:
+        extras = "".join(f" {chave}={valor}" for chave, valor in
+                         (("linhas", etapa.linhas), ("bytes", etapa.bytes), *etapa.detalhes.items()) if valor is not None)
+        print(f"[Etapa] {'  ' * etapa.profundidade}{etapa.nome}: {etapa.duracao * 1000:.1f} ms{extras}")
+
+
+def _nivel(execucao):
+    return execucao.nivel if execucao is not None else NIVEL_PADRAO
+
+
+def iniciar_execucao(rotulo="", nivel=NIVEL_PADRAO, sessao=None):
+    """Começa a coleta de uma execução do app nesta thread (a anterior, se houver, é descartada)."""
+    execucao = _local.execucao = Execucao(rotulo, nivel, sessao)
+    _local.pilha = []
+    return execucao
+
+
+def execucao_atual():
+    return getattr(_local, "execucao", None)
+
+
+def concluir_execucao():
+    """Encerra a execução desta thread (gravando-a no JSON-lines, se configurado) e a retorna."""
+    execucao = execucao_atual()
+    _local.execucao = None
+    return execucao.concluir() if execucao is not None else None
+
+
+def medir(nome, linhas=None, bytes=None, nivel=ETAPAS, **detalhes):
+    """Etapa cronometrada (`with medir("leitura.indexar", bytes=n) as etapa: ...; etapa.linhas = ...`).
+
+    Etapas de `nivel` acima do ativo não custam nada além desta chamada; use
+    nivel=DETALHADO para as que rodam muitas vezes numa execução (por registro, por bloco).
+    """
+    execucao = execucao_atual()
+    if nivel > _nivel(execucao):
+        return _NULA
+    return Etapa(nome, execucao, nivel, linhas, bytes, **detalhes)
+
+
+def medido(nome, nivel=ETAPAS):
+    """Decorador: cada chamada da função vira uma etapa `nome`."""
+    def decorador(funcao):
+        @wraps(funcao)
+        def envolvida(*args, **kwargs):
+            with medir(nome, nivel=nivel):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+def evento(mensagem, nivel=ETAPAS, **campos):
+    """Fato pontual (cache usado, arquivo ignorado, erro tratado...) registrado junto com as etapas."""
+    execucao = execucao_atual()
+    if nivel > _nivel(execucao):
+        return
+    if execucao is not None:
+        execucao.eventos.append((time.time(), mensagem, campos))
+    if execucao is None or execucao.nivel >= DETALHADO: # Fora do app (linha de comando), o evento vai para a saída
+        print(f"[Evento] {mensagem}" + "".join(f" {chave}={valor}" for chave, valor in campos.items()))
+
+
+def etapas_fora_de_execucao():
+    """Etapas recentes das threads sem execução (ex: índice de texto montado em segundo plano)."""
+    return list(_fora_de_execucao)
+
+
+def jsonl(execucoes):
+    """Texto JSON lines com as etapas e eventos das execuções (uma linha por item)."""
+    return "".join(json.dumps(registro, ensure_ascii=False, default=str) + "\n"
+                   for execucao in execucoes for registro in execucao.registros())
+
+
+def exportar_jsonl(execucoes, caminho):
+    """Acrescenta as etapas e eventos das execuções em `caminho`."""
+    with _trava_arquivo, open(caminho, "a", encoding="utf-8") as f:
+        f.write(jsonl(execucoes))
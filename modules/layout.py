@@ -0,0 +1,284 @@
+import csv
+import glob
+import operator
+import os
+import pickle
+
+from modules.decodificar import TipoCampo
+from modules.instrumentacao import evento, medir
+
+# --- Leitura dos arquivos de layout (sem dependência do Streamlit: usada também pela linha de comando) ---
+
+DIRETORIO_LAYOUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sped_descricao")
+ARQUIVO_LAYOUT = os.path.join(DIRETORIO_LAYOUT, "sped_descritivo.txt")
+ARQUIVO_TIPOS = os.path.join(DIRETORIO_LAYOUT, "sped_tipos_campos.txt")
+ARQUIVO_NIVEIS = os.path.join(DIRETORIO_LAYOUT, "sped_niveis.txt")
+ARQUIVO_CONFERIDOS = os.path.join(DIRETORIO_LAYOUT, "sped_conferidos.txt") # Registros conferidos com o Guia Prático
+DIRETORIO_FONTES = os.path.join(DIRETORIO_LAYOUT, "Nova pasta") # Descritivos por bloco (*_CORRIGIDO.txt) e o CSV de todos os registros
+ARQUIVO_CSV_REGISTROS = os.path.join(DIRETORIO_FONTES, "Layout_Descritivo_de_Todos_os_Registros_SPED.csv")
+DIRETORIO_VERSOES = os.path.join(DIRETORIO_LAYOUT, "versoes") # Descritivos só dos registros que mudam numa versão (ex: 016.txt)
+ARQUIVO_CACHE = os.path.join(DIRETORIO_LAYOUT, "layout_compilado.pickle")
+FORMATO_CACHE = 3 # Incrementar quando a estrutura compilada mudar (invalida os caches gravados)
+
+
+def ler_layout(file_path=ARQUIVO_LAYOUT):
+    """ Lê o arquivo descritivo do layout SPED e retorna um dicionário
+        mapeando REGISTRO -> {NOME_CAMPO: indice_base_1}.
+        Lança FileNotFoundError se o arquivo não existir.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f: # Usar utf-8 por segurança
+        return _ler_linhas_layout(f, file_path)
+
+
+def _ler_linhas_layout(linhas, origem):
+    """Monta REGISTRO -> {NOME_CAMPO: indice_base_1} a partir de linhas '|REG|CAMPO1|CAMPO2|...||'."""
+    layout = {}
+    ignoradas = 0
+    for line in linhas:
+        line = line.strip()
+        if not line or not line.startswith('|'):
+            continue
+        parts = line.split('|')
+        # Esperado: ['', REGISTRO, CAMPO1, CAMPO2, ..., '', ''] (a linha termina com ||)
+        if len(parts) < 4 or not parts[1]:
+            ignoradas += 1
+            continue
+        layout[parts[1]] = {nome_campo: i + 2 for i, nome_campo in enumerate(parts[2:-2]) if nome_campo} # Índice base 1 (posição após split)
+    if ignoradas:
+        evento("Layout: linhas inválidas ignoradas", origem=origem, linhas=ignoradas)
+    return layout
+
+
+def ler_tipos(file_path=ARQUIVO_TIPOS):
+    """ Lê o arquivo com o tipo de cada campo do layout e retorna um dicionário
+        mapeando REGISTRO -> {NOME_CAMPO: TipoCampo(tipo, tamanho, decimais)}.
+        Formato das linhas: |REG|CAMPO:TIPO:TAMANHO:DECIMAIS|...|| ('-' = não se aplica).
+        Lança FileNotFoundError se o arquivo não existir.
+    """
+    tipos = {}
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f):
+            line = line.strip()
+            if not line.startswith('|'):
+                continue # Comentários e linhas em branco
+            parts = line.split('|')
+            registro = parts[1]
+            if not registro:
+                continue
+            tipos[registro] = {}
+            for definicao in parts[2:-2]:
+                try:
+                    nome_campo, tipo, tamanho, decimais = definicao.split(':')
+                    tipos[registro][nome_campo] = TipoCampo(
+                        tipo,
+                        None if tamanho == '-' else int(tamanho),
+                        None if decimais == '-' else int(decimais)
+                    )
+                except ValueError:
+                    evento("Tipos: definição inválida ignorada", linha=line_num + 1, definicao=definicao)
+    return tipos
+
+
+def ler_niveis(file_path=ARQUIVO_NIVEIS):
+    """ Lê o nível hierárquico de cada registro e retorna um dicionário REGISTRO -> nível (int).
+        Formato das linhas: |REG|NIVEL||. Lança FileNotFoundError se o arquivo não existir.
+    """
+    niveis = {}
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.strip().split('|')
+            if len(parts) >= 4 and parts[1] and parts[2].isdigit():
+                niveis[parts[1]] = int(parts[2])
+    return niveis
+
+
+def ler_conferidos(file_path=ARQUIVO_CONFERIDOS):
+    """ Lê os registros cujo layout foi conferido com o Guia Prático e retorna o conjunto de REGs.
+        Formato das linhas: |REG||. Lança FileNotFoundError se o arquivo não existir.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return {parts[1] for parts in (line.strip().split('|') for line in f) if len(parts) >= 3 and parts[1]}
+
+
+# --- Catálogo de layouts compilados, por versão do leiaute (0000.COD_VER) ---
+
+class RegistroCompilado(dict):
+    """Layout de um registro (NOME_CAMPO -> índice base 1) com as estruturas usadas na leitura já prontas.
+
+    Continua sendo o dicionário de sempre; além dele guarda os nomes e as
+    posições como tuplas, a posição de cada campo na tupla e um extrator
+    (operator.itemgetter) que separa todos os campos de uma linha de uma vez.
+    """
+
+    def __init__(self, registro, campos_layout, origem="", conferido=False):
+        super().__init__(campos_layout)
+        self.registro = registro
+        self.origem = origem # Arquivo de onde veio a definição (campos genéricos quando vem do CSV)
+        self.conferido = conferido # Campos conferidos com o Guia Prático (ver sped_conferidos.txt)
+        self.campos = tuple(self.keys())
+        self.indices = tuple(self.values())
+        self.posicao_campo = {nome: pos for pos, nome in enumerate(self.campos)}
+        self.extrator = operator.itemgetter(*self.indices) if len(self.indices) > 1 else None
+
+    def extrair(self, partes):
+        """Tupla com os campos da linha já separada (`partes`), na ordem do layout."""
+        if self.extrator is None:
+            return tuple(partes[i] for i in self.indices)
+        return self.extrator(partes)
+
+
+class LayoutVersao(dict):
+    """Layout completo (REGISTRO -> RegistroCompilado) de uma versão do leiaute, com o nível de cada registro."""
+
+    def __init__(self, registros, cod_ver=None, niveis=None):
+        super().__init__(registros)
+        self.cod_ver = cod_ver # None = layout base (sem ajustes de versão)
+        self.niveis = niveis or {} # REGISTRO -> nível hierárquico (ver modules/hierarquia.py)
+
+
+class CatalogoLayouts:
+    """Layouts compilados de todas as fontes do diretório sped_descricao.
+
+    O layout base junta, nesta ordem de prioridade, o descritivo principal
+    (sped_descritivo.txt), os descritivos por bloco (*_CORRIGIDO.txt) e o CSV
+    com todos os registros (que só traz nomes genéricos de campo). Cada
+    arquivo de versoes/<COD_VER>.txt substitui os registros que mudaram
+    naquela versão. Os registros de sped_conferidos.txt saem marcados como
+    conferidos com o Guia Prático (RegistroCompilado.conferido).
+    """
+
+    def __init__(self, base, ajustes_versao=None):
+        self.base = base
+        self.ajustes_versao = ajustes_versao or {} # COD_VER -> {REGISTRO: RegistroCompilado}
+        self._por_versao = {}
+
+    def __len__(self):
+        return len(self.base)
+
+    def versoes(self):
+        return sorted(self.ajustes_versao)
+
+    def para_versao(self, cod_ver):
+        """LayoutVersao do arquivo com esse COD_VER (o layout base, se a versão não tiver ajustes)."""
+        ajustes = self.ajustes_versao.get(cod_ver)
+        if not ajustes:
+            return self.base
+        layout = self._por_versao.get(cod_ver)
+        if layout is None:
+            layout = self._por_versao[cod_ver] = LayoutVersao({**self.base, **ajustes}, cod_ver, self.base.niveis)
+        return layout
+
+
+def _compilar(layout, origem, conferidos=frozenset()):
+    generico = origem.endswith(".csv")
+    return {registro: RegistroCompilado(registro, campos, origem, not generico and registro in conferidos)
+            for registro, campos in layout.items()}
+
+
+def layout_generico(campos_layout):
+    """O layout do registro só tem nomes genéricos de campo (veio do CSV de todos os registros)?
+
+    Esses layouts servem para reconhecer o registro, mas não para editar,
+    exportar ou validar a quantidade de campos das linhas.
+    """
+    return getattr(campos_layout, "origem", "").endswith(".csv")
+
+
+def layout_conferido(campos_layout):
+    """O layout do registro foi conferido com o Guia Prático (quantidade e posição dos campos confiáveis)?"""
+    return getattr(campos_layout, "conferido", False)
+
+
+def ler_csv_registros(file_path=ARQUIVO_CSV_REGISTROS):
+    """Layout (REGISTRO -> {NOME_CAMPO: índice}) da coluna 'Layout Descritivo' do CSV de todos os registros."""
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        return _ler_linhas_layout((linha.get("Layout Descritivo") or "" for linha in csv.DictReader(f)), file_path)
+
+
+def _fontes_layout(arquivo_layout, diretorio_fontes, diretorio_versoes):
+    """Arquivos que compõem o catálogo, do menos para o mais prioritário (níveis e versões vêm à parte)."""
+    fontes = []
+    if diretorio_fontes and os.path.isdir(diretorio_fontes):
+        csv_registros = os.path.join(diretorio_fontes, os.path.basename(ARQUIVO_CSV_REGISTROS))
+        if os.path.isfile(csv_registros):
+            fontes.append(csv_registros)
+        fontes.extend(sorted(glob.glob(os.path.join(diretorio_fontes, "*_CORRIGIDO.txt"))))
+    fontes.append(arquivo_layout)
+    versoes = sorted(glob.glob(os.path.join(diretorio_versoes, "*.txt"))) if diretorio_versoes and os.path.isdir(diretorio_versoes) else []
+    return fontes, versoes
+
+
+def compilar_catalogo(arquivo_layout=ARQUIVO_LAYOUT, diretorio_fontes=DIRETORIO_FONTES, diretorio_versoes=DIRETORIO_VERSOES):
+    """Lê e junta todas as fontes do layout e devolve o CatalogoLayouts compilado.
+
+    Lança FileNotFoundError se o descritivo principal não existir.
+    """
+    fontes, versoes = _fontes_layout(arquivo_layout, diretorio_fontes, diretorio_versoes)
+    niveis = ler_niveis(ARQUIVO_NIVEIS) if os.path.isfile(ARQUIVO_NIVEIS) else {}
+    conferidos = ler_conferidos(ARQUIVO_CONFERIDOS) if os.path.isfile(ARQUIVO_CONFERIDOS) else set()
+    base = {}
+    for fonte in fontes:
+        layout = ler_csv_registros(fonte) if fonte.endswith(".csv") else ler_layout(fonte)
+        base.update(_compilar(layout, os.path.basename(fonte), conferidos))
+    ajustes_versao = {
+        os.path.splitext(os.path.basename(arquivo))[0]: _compilar(ler_layout(arquivo), os.path.basename(arquivo), conferidos)
+        for arquivo in versoes
+    }
+    return CatalogoLayouts(LayoutVersao(base, niveis=niveis), ajustes_versao)
+
+
+def _chave_cache(arquivos):
+    """Identifica o conteúdo das fontes (caminho, tamanho, data de modificação) para validar o cache."""
+    chave = [FORMATO_CACHE]
+    for arquivo in arquivos:
+        estado = os.stat(arquivo)
+        chave.append((os.path.abspath(arquivo), estado.st_size, estado.st_mtime_ns))
+    return tuple(chave)
+
+
+def carregar_catalogo(arquivo_layout=ARQUIVO_LAYOUT, diretorio_fontes=DIRETORIO_FONTES,
+                      diretorio_versoes=DIRETORIO_VERSOES, arquivo_cache=ARQUIVO_CACHE):
+    """CatalogoLayouts a partir do cache compilado, recompilando só se alguma fonte mudou.
+
+    O cache é gravado ao lado das fontes (`arquivo_cache`; None desativa); se
+    não puder ser lido ou gravado, o catálogo é simplesmente recompilado.
+    """
+    fontes, versoes = _fontes_layout(arquivo_layout, diretorio_fontes, diretorio_versoes)
+    chave = _chave_cache(fontes + versoes + [arquivo for arquivo in [ARQUIVO_NIVEIS, ARQUIVO_CONFERIDOS] if os.path.isfile(arquivo)])
+    if arquivo_cache and os.path.isfile(arquivo_cache):
+        try:
+            with open(arquivo_cache, 'rb') as f:
+                chave_gravada, catalogo = pickle.load(f)
+            if chave_gravada == chave:
+                return catalogo
+        except Exception as e: # Cache de outra versão do programa ou corrompido
+            evento("Layout: cache compilado ignorado", erro=str(e))
+
+    with medir("layout.compilar", arquivos=len(fontes) + len(versoes)):
+        catalogo = compilar_catalogo(arquivo_layout, diretorio_fontes, diretorio_versoes)
+    if arquivo_cache:
+        temporario = f"{arquivo_cache}.{os.getpid()}.tmp"
+        try:
+            with open(temporario, 'wb') as f:
+                pickle.dump((chave, catalogo), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporario, arquivo_cache) # Outros processos nunca veem o arquivo pela metade
+        except OSError as e:
+            evento("Layout: não foi possível gravar o cache compilado", erro=str(e))
+            if os.path.exists(temporario):
+                os.remove(temporario)
+    return catalogo
+
+
+def versao_do_corpo(corpo_sped):
+    """COD_VER do registro 0000 (primeira linha do corpo), ou None."""
+    if not len(corpo_sped):
+        return None
+    partes = corpo_sped[0].split('|')
+    return partes[2] if len(partes) > 2 and partes[1] == "0000" and partes[2] else None
+
+
+def selecionar_layout(sped_layout, corpo_sped):
+    """Layout do documento: o da versão do arquivo, quando `sped_layout` é um CatalogoLayouts."""
+    if isinstance(sped_layout, CatalogoLayouts):
+        return sped_layout.para_versao(versao_do_corpo(corpo_sped))
+    return sped_layout
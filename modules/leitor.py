@@ -0,0 +1,448 @@
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+from modules.instrumentacao import medir
+
+# --- Leitura do SPED via arquivo temporário mapeado em memória ---
+
+TAMANHO_BLOCO = 16 * 1024 * 1024 # Bytes processados por vez ao indexar o arquivo
+TAMANHO_BLOCO_LEITURA = 4 * 1024 * 1024 # Bytes decodificados por vez ao iterar as linhas
+LINHAS_POR_BLOCO_BUSCA = 100000 # Linhas varridas por vez na busca (cada bloco devolve suas ocorrências)
+ENCODING_SPED = "latin-1"
+
+
+def _remover_arquivo(caminho):
+    try:
+        os.remove(caminho)
+    except OSError:
+        pass
+
+
+class ArquivoMapeado:
+    """Arquivo SPED copiado (em blocos) para um arquivo temporário e mapeado com mmap.
+
+    Se receber um caminho (str/PathLike) em vez de um arquivo aberto, mapeia o
+    próprio arquivo, sem copiar. Com `indice` (vetores de um mapeamento anterior
+    do mesmo conteúdo, ver vetores_indice), a passada de indexação é pulada.
+
+    Guarda apenas um vetor compacto com o offset de início de cada linha
+    (uint32 para arquivos < 4 GB, uint64 acima disso). O texto das linhas é
+    decodificado somente quando alguém pede a linha.
+    """
+
+    def __init__(self, uploaded_file, diretorio=None, indice=None):
+        if isinstance(uploaded_file, (str, os.PathLike)):
+            # Arquivo já em disco (linha de comando): mapeado direto, sem cópia e sem remoção no final
+            self.caminho = os.fspath(uploaded_file)
+            self._finalizador = weakref.finalize(self, lambda: None)
+        else:
+            if hasattr(uploaded_file, "seek"):
+                uploaded_file.seek(0)
+            arquivo_tmp = tempfile.NamedTemporaryFile(prefix="sped_", suffix=".txt", dir=diretorio, delete=False)
+            self.caminho = arquivo_tmp.name
+            # Remove o arquivo temporário quando o objeto for descartado (ex: sessão limpa)
+            self._finalizador = weakref.finalize(self, _remover_arquivo, self.caminho)
+            with arquivo_tmp, medir("leitura.copiar") as etapa:
+                shutil.copyfileobj(uploaded_file, arquivo_tmp, 1024 * 1024)
+                etapa.bytes = arquivo_tmp.tell()
+
+        self.tamanho = os.path.getsize(self.caminho)
+        self._mm = None
+        self._separadores = None # Quantidade de '|' por linha (ver separadores_por_linha)
+        if self.tamanho:
+            with open(self.caminho, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if indice is not None:
+            self.offsets, self.codigos, self._linhas_reg_irregular = indice
+        else:
+            with medir("leitura.indexar", bytes=self.tamanho) as etapa:
+                self.offsets = self._indexar_linhas()
+                etapa.linhas = len(self.offsets) - 1
+
+    def _indexar_linhas(self):
+        """Monta, numa única passada pelos bytes do arquivo, o índice de linhas e de registros.
+
+        - offsets[i] = início da linha i; offsets[n] marca o fim da última linha (+1).
+        - codigos[i] = código do REG da linha i (4 bytes de '|XXXX|' num uint32), 0 se não reconhecido.
+        """
+        dtype = np.uint32 if self.tamanho < 2**32 - 1 else np.uint64
+        if not self.tamanho:
+            self.codigos = np.zeros(0, dtype=np.uint32)
+            self._linhas_reg_irregular = np.zeros(0, dtype=np.int64)
+            return np.zeros(1, dtype=dtype)
+
+        buf = np.frombuffer(self._mm, dtype=np.uint8)
+        partes_offsets = []
+        partes_codigos = []
+        inicio_bloco = np.zeros(1, dtype=np.int64) # A primeira linha começa no byte 0
+        for pos in range(0, self.tamanho, TAMANHO_BLOCO):
+            bloco = buf[pos:pos + TAMANHO_BLOCO]
+            inicios = np.concatenate((inicio_bloco, np.flatnonzero(bloco == 10) + (pos + 1)))
+            inicios = inicios[inicios < self.tamanho] # '\n' final não abre uma nova linha
+            partes_offsets.append(inicios.astype(dtype))
+            partes_codigos.append(self._codigos_registro(buf, inicios))
+            inicio_bloco = np.zeros(0, dtype=np.int64)
+        del buf, bloco # Libera as referências ao mmap
+
+        offsets = np.concatenate(partes_offsets)
+        self.codigos = np.concatenate(partes_codigos)
+        # Linhas iniciadas por '|' mas com REG fora do padrão de 4 caracteres (raras): resolvidas em Python
+        self._linhas_reg_irregular = np.flatnonzero(self.codigos == 1)
+        self.codigos[self._linhas_reg_irregular] = 0
+
+        fim = self.tamanho if self._mm[self.tamanho - 1] == 10 else self.tamanho + 1
+        return np.append(offsets, np.array([fim], dtype=dtype))
+
+    def _codigos_registro(self, buf, inicios):
+        """Código uint32 dos 4 caracteres do REG de cada linha ('|C170|' -> b'C170').
+
+        Linhas que começam com '|' mas não seguem o padrão '|XXXX|' recebem 1;
+        linhas que nem começam com '|' recebem 0.
+        """
+        ultimo = self.tamanho - 1
+        b = [buf[np.minimum(inicios + k, ultimo)] for k in range(6)]
+        cabe = inicios + 5 <= ultimo
+        comeca_com_barra = b[0] == 124
+        valido = comeca_com_barra & cabe & (b[5] == 124)
+        for k in range(1, 5):
+            valido &= (b[k] != 10) & (b[k] != 13) & (b[k] != 124)
+        codigos = (b[1].astype(np.uint32) << 24) | (b[2].astype(np.uint32) << 16) | (b[3].astype(np.uint32) << 8) | b[4]
+        return np.where(valido, codigos, np.where(comeca_com_barra, 1, 0)).astype(np.uint32)
+
+    def indice_registros(self, inicio=0, fim=None):
+        """Dicionário REG -> vetor (ordenado) com os números das linhas [inicio, fim) daquele registro."""
+        fim = len(self) if fim is None else fim
+        codigos = self.codigos[inicio:fim]
+        ordem = np.argsort(codigos, kind="stable").astype(np.uint32)
+        codigos_ordenados = codigos[ordem]
+        valores, posicoes = np.unique(codigos_ordenados, return_index=True)
+
+        indice = {}
+        limites = list(posicoes[1:]) + [len(ordem)]
+        for valor, ini, fim_grupo in zip(valores.tolist(), posicoes.tolist(), limites):
+            if valor == 0:
+                continue
+            indice[int(valor).to_bytes(4, "big").decode(ENCODING_SPED)] = ordem[ini:fim_grupo]
+
+        irregulares = self._linhas_reg_irregular
+        irregulares = irregulares[(irregulares >= inicio) & (irregulares < fim)]
+        if len(irregulares):
+            extras = {}
+            for i in irregulares.tolist():
+                extras.setdefault(self.linha(i).split('|', 2)[1], []).append(i - inicio)
+            for registro, linhas in extras.items():
+                atuais = indice.get(registro, np.zeros(0, dtype=np.uint32))
+                indice[registro] = np.sort(np.concatenate((atuais, np.array(linhas, dtype=np.uint32))))
+        return indice
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def vetores_indice(self):
+        """(offsets, codigos, linhas com REG irregular): o que basta para remapear o mesmo conteúdo sem reindexar."""
+        return self.offsets, self.codigos, self._linhas_reg_irregular
+
+    def separadores_por_linha(self):
+        """Quantidade de '|' em cada linha (uint16), contada direto nos bytes e guardada no primeiro uso."""
+        if self._separadores is None:
+            # Total de '|' antes do início de cada linha (busca binária nas posições dos '|' de cada bloco)
+            antes = np.zeros(len(self.offsets), dtype=np.int64)
+            if self.tamanho:
+                buf = np.frombuffer(self._mm, dtype=np.uint8)
+                acumulado = 0
+                for pos in range(0, self.tamanho, TAMANHO_BLOCO):
+                    bloco = buf[pos:pos + TAMANHO_BLOCO]
+                    barras = np.flatnonzero(bloco == 124) + pos
+                    ini, fim = np.searchsorted(self.offsets, [pos, pos + len(bloco)])
+                    antes[ini:fim] = np.searchsorted(barras, self.offsets[ini:fim]) + acumulado
+                    acumulado += len(barras)
+                del buf, bloco
+                antes[len(self):] = acumulado # offsets[n] marca o fim do arquivo
+            contagem = np.diff(antes)
+            self._separadores = np.minimum(contagem, np.iinfo(np.uint16).max).astype(np.uint16)
+        return self._separadores
+
+    def linha_bytes(self, i):
+        inicio, fim = self.offsets[i:i + 2].tolist()
+        dados = self._mm[inicio:fim - 1]
+        return dados[:-1] if dados.endswith(b"\r") else dados
+
+    def linha(self, i):
+        return self.linha_bytes(i).decode(ENCODING_SPED)
+
+    def iter_linhas(self, inicio, fim):
+        """Decodifica as linhas [inicio, fim) em blocos grandes (bem mais rápido que linha a linha)."""
+        i = inicio
+        while i < fim:
+            # Quantas linhas cabem em aproximadamente TAMANHO_BLOCO_LEITURA bytes a partir de i
+            limite = int(self.offsets[i]) + TAMANHO_BLOCO_LEITURA
+            j = int(np.searchsorted(self.offsets, limite, side="right")) - 1
+            j = min(max(j, i + 1), fim)
+            texto = self._mm[int(self.offsets[i]):int(self.offsets[j]) - 1].decode(ENCODING_SPED)
+            for linha in texto.split("\n"):
+                yield linha[:-1] if linha.endswith("\r") else linha
+            i = j
+
+    def linhas_em(self, indices):
+        """Decodifica as linhas dos índices informados (vetor), na ordem dada."""
+        indices = np.asarray(indices, dtype=np.int64)
+        inicios = self.offsets[indices].tolist()
+        fins = (self.offsets[indices + 1] - 1).tolist()
+        mm = self._mm
+        for inicio, fim in zip(inicios, fins):
+            linha = mm[inicio:fim].decode(ENCODING_SPED)
+            yield linha[:-1] if linha.endswith("\r") else linha
+
+    def buscar(self, padrao, inicio, fim, linhas_por_bloco=LINHAS_POR_BLOCO_BUSCA):
+        """Gera (fim do bloco, linhas com ocorrência) varrendo as linhas [inicio, fim) em blocos.
+
+        `padrao` é uma expressão regular compilada sobre bytes, aplicada direto
+        no mmap (sem decodificar as linhas); cada linha conta uma vez.
+        """
+        for ini_bloco in range(inicio, fim, linhas_por_bloco):
+            fim_bloco = min(ini_bloco + linhas_por_bloco, fim)
+            yield fim_bloco, self.ocorrencias(padrao, ini_bloco, fim_bloco)
+
+    def ocorrencias(self, padrao, inicio, fim):
+        """Vetor com as linhas [inicio, fim) em que `padrao` (regex sobre bytes) ocorre."""
+        offsets = self.offsets
+        mm = self._mm
+        inicios = []
+        if mm is not None and fim > inicio:
+            pos, limite = int(offsets[inicio]), int(offsets[fim])
+            while pos < limite:
+                achado = padrao.search(mm, pos, limite)
+                if achado is None:
+                    break
+                inicios.append(achado.start())
+                pos = mm.find(b"\n", achado.start(), limite) + 1 # Segue da próxima linha
+                if not pos:
+                    break
+        # Linha de cada ocorrência numa só busca binária (com o dtype dos offsets, sem converter o vetor)
+        posicoes = np.array(inicios, dtype=offsets.dtype)
+        return np.searchsorted(offsets, posicoes, side="right").astype(np.int64) - 1
+
+    def fechar(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._finalizador()
+
+
+class LinhasSped:
+    """Sequência (somente as linhas [inicio, fim) do arquivo) com a interface de uma lista de strings.
+
+    As linhas originais nunca são modificadas; linhas alteradas ficam em
+    `alteradas` (índice -> novo texto) e têm prioridade na leitura.
+    """
+
+    def __init__(self, arquivo, inicio=0, fim=None):
+        self.arquivo = arquivo
+        self.inicio = inicio
+        self.fim = len(arquivo) if fim is None else fim
+        self.alteradas = {}
+
+    def __len__(self):
+        return self.fim - self.inicio
+
+    def __bool__(self):
+        return self.fim > self.inicio
+
+    def _indice(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("índice de linha fora do intervalo")
+        return i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        i = self._indice(i)
+        linha = self.alteradas.get(i)
+        if linha is None:
+            linha = self.arquivo.linha(self.inicio + i)
+        return linha
+
+    def __setitem__(self, i, linha):
+        self.alteradas[self._indice(i)] = linha
+
+    def __iter__(self):
+        alteradas = self.alteradas
+        for i, linha in enumerate(self.arquivo.iter_linhas(self.inicio, self.fim)):
+            yield alteradas.get(i, linha) if alteradas else linha
+
+    def linhas_em(self, indices):
+        """Linhas (já com as alterações) dos índices informados, sem passar pelo restante do arquivo."""
+        alteradas = self.alteradas
+        linhas = self.arquivo.linhas_em(np.asarray(indices, dtype=np.int64) + self.inicio)
+        if not alteradas:
+            return linhas
+        return (alteradas.get(i, linha) for i, linha in zip(np.asarray(indices).tolist(), linhas))
+
+    def buscar(self, padrao, inicio=0, linhas_por_bloco=LINHAS_POR_BLOCO_BUSCA):
+        """Gera (fim do bloco, índices com ocorrência) a partir da linha `inicio`, já com as alterações.
+
+        `padrao` é uma expressão regular compilada sobre texto; a varredura usa
+        a versão em bytes dela no arquivo mapeado e confere à parte as linhas alteradas.
+        Sem versão em bytes equivalente (ver padrao_em_bytes), as linhas são
+        decodificadas e conferidas uma a uma.
+        """
+        padrao_bytes = padrao_em_bytes(padrao)
+        if padrao_bytes is None:
+            yield from self._buscar_texto(padrao, inicio, linhas_por_bloco)
+            return
+        ini_bloco = inicio
+        for fim_bloco, linhas in self.arquivo.buscar(padrao_bytes, self.inicio + inicio, self.fim, linhas_por_bloco):
+            fim_bloco -= self.inicio
+            yield fim_bloco, self.conferir_alteradas(padrao, linhas - self.inicio, ini_bloco, fim_bloco)
+            ini_bloco = fim_bloco
+
+    def _buscar_texto(self, padrao, inicio, linhas_por_bloco):
+        alteradas = self.alteradas
+        for ini_bloco in range(inicio, len(self), linhas_por_bloco):
+            fim_bloco = min(ini_bloco + linhas_por_bloco, len(self))
+            linhas = self.arquivo.iter_linhas(self.inicio + ini_bloco, self.inicio + fim_bloco)
+            achadas = [i for i, linha in enumerate(linhas, ini_bloco) if padrao.search(alteradas.get(i, linha))]
+            yield fim_bloco, np.array(achadas, dtype=np.int64)
+
+    def conferir_alteradas(self, padrao, linhas, inicio, fim):
+        """Acerta as ocorrências `linhas` de [inicio, fim), achadas no arquivo original, com o texto das linhas alteradas."""
+        alteradas = self.alteradas
+        if not alteradas:
+            return linhas
+        faixa = [i for i in alteradas if inicio <= i < fim]
+        linhas = linhas[~np.isin(linhas, faixa)]
+        achadas = [i for i in faixa if padrao.search(alteradas[i])]
+        if achadas:
+            linhas = np.sort(np.concatenate((linhas, np.array(achadas, dtype=np.int64))))
+        return linhas
+
+    def descartar_iguais_ao_original(self, indices):
+        """Remove da camada de alterações as linhas cujo texto voltou a ser igual ao do arquivo."""
+        alteradas = self.alteradas
+        indices = [i for i in np.asarray(indices).tolist() if i in alteradas]
+        originais = self.arquivo.linhas_em(np.asarray(indices, dtype=np.int64) + self.inicio)
+        for i, original in zip(indices, originais):
+            if alteradas[i] == original:
+                del alteradas[i]
+
+    def separadores_por_linha(self):
+        """Quantidade de '|' em cada linha desta sequência, já considerando as linhas alteradas."""
+        contagem = self.arquivo.separadores_por_linha()[self.inicio:self.fim]
+        if self.alteradas:
+            contagem = contagem.copy()
+            for i, linha in self.alteradas.items():
+                contagem[i] = linha.count('|')
+        return contagem
+
+    def indice_registros(self):
+        """REG -> vetor com os índices (relativos a esta sequência) das linhas do registro."""
+        return self.arquivo.indice_registros(self.inicio, self.fim)
+
+    def recorte(self, inicio, fim):
+        """Nova visão (sem cópia) das linhas [inicio, fim) desta sequência."""
+        return LinhasSped(self.arquivo, self.inicio + inicio, self.inicio + fim)
+
+
+# Classes que, sobre texto, também casam letras acentuadas e espaços do latin-1 (sobre bytes, só ASCII)
+_ESCAPES_UNICODE = re.compile(r"\\[wWbBsS]")
+_IGNORECASE_LOCAL = re.compile(r"\(\?[a-zA-Z]*i[a-zA-Z-]*[:)]")
+
+
+def padrao_em_bytes(padrao):
+    """Versão sobre bytes (latin-1) de uma expressão regular compilada sobre texto, para varrer o mmap.
+
+    Sobre bytes o IGNORECASE só vale para ASCII; por isso, sem diferenciar
+    maiúsculas, cada letra acentuada vira a classe com as duas formas
+    ("são" -> "s[ãÃ]o"). Devolve None quando não há versão equivalente em
+    bytes: caractere fora do latin-1, \\w, \\b ou \\s, letra acentuada dentro
+    de [...] ou IGNORECASE só em parte da expressão. Nesses casos quem chama
+    confere as linhas já decodificadas.
+    """
+    fonte = padrao.pattern
+    try:
+        fonte.encode(ENCODING_SPED)
+    except UnicodeEncodeError:
+        return None
+    if _ESCAPES_UNICODE.search(fonte) or _IGNORECASE_LOCAL.search(fonte):
+        return None
+    if padrao.flags & re.IGNORECASE:
+        fonte = _com_maiusculas_latin1(fonte)
+        if fonte is None:
+            return None
+    try:
+        return re.compile(fonte.encode(ENCODING_SPED), padrao.flags & ~re.UNICODE)
+    except re.error:
+        return None
+
+
+def _com_maiusculas_latin1(fonte):
+    """Troca cada letra não ASCII de `fonte` (fora de [...]) pela classe com suas formas maiúscula e minúscula."""
+    partes = []
+    em_classe = False
+    i = 0
+    while i < len(fonte):
+        c = fonte[i]
+        if c == "\\" and i + 1 < len(fonte):
+            if fonte[i + 1].isascii():
+                partes.append(fonte[i:i + 2])
+                i += 2
+                continue
+            i += 1 # "\ã" é o próprio "ã"
+            c = fonte[i]
+        elif c == "[" and not em_classe:
+            em_classe = True
+            # "^" e um "]" logo na abertura fazem parte da classe
+            fim_abertura = i + 1 + fonte.startswith("^", i + 1)
+            fim_abertura += fonte.startswith("]", fim_abertura)
+            partes.append(fonte[i:fim_abertura])
+            i = fim_abertura
+            continue
+        elif c == "]" and em_classe:
+            em_classe = False
+        if not c.isascii():
+            formas = sorted({f for f in (c, c.lower(), c.upper()) if len(f) == 1 and ord(f) < 256})
+            if len(formas) > 1:
+                if em_classe:
+                    return None
+                c = "[" + "".join(formas) + "]"
+        partes.append(c)
+        i += 1
+    return "".join(partes)
+
+
+def localizar_inicio_assinatura(linhas):
+    """Retorna o índice da primeira linha do bloco 9 final (separador corpo/assinatura) ou None.
+
+    Percorre o arquivo uma única vez, de trás para frente: o bloco 9 final é a
+    sequência de linhas |9...| que não é seguida por nenhum outro registro
+    (linhas que não começam com '|', como a assinatura digital, são ignoradas).
+    O custo é proporcional ao tamanho desse final, não ao do arquivo.
+    """
+    assinatura_idx = None
+    for i in range(len(linhas) - 1, -1, -1):
+        linha = linhas[i]
+        if not linha.startswith('|'):
+            continue
+        if not linha.startswith('|9'):
+            break # Registro de outro bloco: o bloco 9 final começa depois dele
+        if linha.find('|', 2) != -1: # Linha com ao menos |REG|
+            assinatura_idx = i
+    return assinatura_idx
+
+
+def separar_assinatura(linhas):
+    """(corpo, assinatura): o corpo é uma visão sem cópia; a assinatura, uma lista de strings (poucas linhas)."""
+    with medir("leitura.assinatura"):
+        assinatura_idx = localizar_inicio_assinatura(linhas)
+    if assinatura_idx is None:
+        return linhas, []
+    return linhas.recorte(0, assinatura_idx), linhas[assinatura_idx:]
@@ -0,0 +1,121 @@
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+from modules.instrumentacao import medir
+
+# --- Orçamento de memória das sessões (despejo dos RegistroStore menos usados) ---
+
+LIMITE_MEMORIA_SESSOES = 6 * 1024**3 # Bytes (estimados) somados dos documentos de todas as sessões
+FRACAO_APOS_DESPEJO = 0.8            # Ao passar do limite, despeja até ficar nesta fração dele (evita despejar a cada rerun)
+SEGUNDOS_SESSAO_OCIOSA = 60          # Só sessões paradas há esse tempo (ou a própria) têm registros despejados
+DIRETORIO_DESPEJO = os.path.join(tempfile.gettempdir(), "painel_sped_despejo")
+
+
+class SessaoMemoria:
+    """Documentos de uma sessão do Streamlit (referências fracas: a sessão encerrada libera tudo)."""
+
+    def __init__(self, sessao):
+        self.sessao = sessao
+        self.documentos = {} # nome do arquivo -> weakref do SpedDocument
+        self.ultima_atividade = time.monotonic()
+
+    def vivos(self):
+        """[(nome, documento)] dos documentos ainda existentes."""
+        vivos = [(nome, referencia()) for nome, referencia in self.documentos.items()]
+        return [(nome, documento) for nome, documento in vivos if documento is not None]
+
+
+class GerenciadorMemoria:
+    """Contabiliza a memória dos documentos de cada sessão e despeja os registros frios acima do limite.
+
+    Cada rerun registra os documentos da sessão (registrar) e confere o total
+    (conferir). Passando de `limite`, os RegistroStore usados há mais tempo, de
+    todas as sessões, são despejados (ver SpedDocument.despejar_registro) até o
+    total ficar em FRACAO_APOS_DESPEJO do limite. Um store despejado volta à
+    memória no próximo uso, sem que a tela que o usa perceba (só fica mais lenta).
+    A memória dos documentos base compartilhados fica com o CacheDocumentos.
+    """
+
+    def __init__(self, limite=LIMITE_MEMORIA_SESSOES, diretorio=DIRETORIO_DESPEJO):
+        self.limite = limite
+        self.diretorio = diretorio
+        self.sessoes = {} # id da sessão -> SessaoMemoria
+        self.despejos = 0
+        self.bytes_despejados = 0
+        self._trava = threading.Lock()
+
+    def registrar(self, sessao, documentos):
+        """Marca atividade da sessão e (re)associa a ela os `documentos` ({nome do arquivo: SpedDocument})."""
+        with self._trava:
+            registro = self.sessoes.get(sessao)
+            if registro is None:
+                registro = self.sessoes[sessao] = SessaoMemoria(sessao)
+            registro.documentos = {nome: weakref.ref(documento) for nome, documento in documentos.items() if documento is not None}
+            registro.ultima_atividade = time.monotonic()
+
+    def remover(self, sessao):
+        with self._trava:
+            self.sessoes.pop(sessao, None)
+
+    def _ativas(self):
+        """Sessões com algum documento vivo (as demais são esquecidas)."""
+        with self._trava:
+            for sessao in [sessao for sessao, registro in self.sessoes.items() if not registro.vivos()]:
+                del self.sessoes[sessao]
+            return list(self.sessoes.values())
+
+    def pegadas(self):
+        """Uma linha por documento de cada sessão: memória própria, registros montados e despejados."""
+        agora = time.monotonic()
+        linhas = []
+        for registro in self._ativas():
+            for nome, documento in registro.vivos():
+                linhas.append({
+                    "SESSAO": registro.sessao, "ARQUIVO": nome,
+                    "BYTES": documento.memoria_estimada(propria=True),
+                    "REGISTROS": len(documento.registros), "DESPEJADOS": len(documento.registros_despejados()),
+                    "OCIOSA_S": int(agora - registro.ultima_atividade),
+                })
+        return linhas
+
+    def total(self):
+        return sum(linha["BYTES"] for linha in self.pegadas())
+
+    def conferir(self, sessao_atual=None, limite=None):
+        """Despeja registros frios se o total passar do limite. Retorna os bytes liberados.
+
+        Candidatos: os stores da sessão atual (que está entre um rerun e outro) e
+        os das sessões ociosas há SEGUNDOS_SESSAO_OCIOSA; os de uma sessão no meio
+        de um processamento longo não são tocados. `limite` substitui o configurado
+        (ex: 0 para liberar tudo o que puder, pelo painel de administração).
+        """
+        limite = self.limite if limite is None else limite
+        total = self.total()
+        if total <= limite:
+            return 0
+        alvo = limite * FRACAO_APOS_DESPEJO
+        agora = time.monotonic()
+        candidatos = []
+        for registro in self._ativas():
+            if registro.sessao != sessao_atual and agora - registro.ultima_atividade < SEGUNDOS_SESSAO_OCIOSA:
+                continue
+            for _, documento in registro.vivos():
+                candidatos.extend(
+                    (documento.ultimo_uso.get(reg, 0.0), id(documento), reg, documento)
+                    for reg, store in documento.registros.items() if store.memoria_estimada(propria=True)
+                )
+        liberados = 0
+        for _, _, reg, documento in sorted(candidatos, key=lambda c: c[:2]): # Do uso mais antigo ao mais recente
+            if total - liberados <= alvo:
+                break
+            with medir("memoria.despejar", registro=reg) as etapa:
+                liberado = documento.despejar_registro(reg, self.diretorio)
+                etapa.bytes = liberado
+            liberados += liberado
+            if liberado:
+                self.despejos += 1
+        self.bytes_despejados += liberados
+        return liberados
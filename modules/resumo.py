@@ -1,18 +1,10 @@
 import streamlit as st
 import pandas as pd
-from utils import load_sped_layout # Importar load_sped_layout
 
-# --- Funções Auxiliares (Específicas para Resumo) ---
+from modules.cubo import DIMENSOES
+from modules.instrumentacao import evento
 
-def safe_float_conversion(value_str):
-    """Tenta converter uma string para float, tratando vírgula e erros."""
-    if not value_str:
-        return 0.0
-    try:
-        # Substitui vírgula por ponto e remove espaços
-        return float(value_str.replace('.', '', value_str.count('.') -1).replace(',', '.').strip())
-    except (ValueError, TypeError):
-        return 0.0 # Retorna 0 se a conversão falhar
+# --- Funções Auxiliares (Específicas para Resumo) ---
 
 def get_field_index(layout, registro, field_name):
     """Obtém o índice (base 1) de um campo no layout, tratando ausência."""
@@ -20,136 +12,102 @@ def get_field_index(layout, registro, field_name):
         return layout[registro][field_name]
     return None # Retorna None se o campo/registro não existir no layout
 
+def formatar_valor(valor):
+    """1234567.8 -> '1.234.567,80'"""
+    return f"{valor:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+
+def totais_icms(fatia, por):
+    """Colunas Contagem / Total_BC_ICMS / Total_ICMS de uma fatia do cubo, agrupadas por `por`."""
+    totais = fatia.groupby(por, sort=False).agg(
+        Contagem=('QTD', 'sum'),
+        Total_BC_ICMS=('VL_BC_ICMS', 'sum'),
+        Total_ICMS=('VL_ICMS', 'sum'),
+    )
+    return totais.reset_index()
+
 # --- Função Principal do Resumo ---
 
-def generate_summary(corpo_sped, assinatura):
+def generate_summary(documento):
     """Gera e exibe um resumo dos dados do SPED."""
     st.subheader("📊 Gerar Resumo do SPED")
 
-    if not corpo_sped:
+    if documento is None or not len(documento):
         st.info("Carregue um arquivo SPED para gerar o resumo.")
         return
 
-    sped_layout = load_sped_layout()
+    sped_layout = documento.layout
     if not sped_layout:
         st.error("Layout SPED não carregado. Não é possível gerar resumo.")
         return
 
-    # --- Coleta de Dados --- #
-    # Lista para armazenar dicionários, cada um representando uma linha relevante
-    dados_resumo = []
-    print("[DEBUG][Resumo] Iniciando coleta de dados para resumo...")
-
-    # Registros e campos de interesse (pode ser expandido)
-    registros_interesse = {
-        "C100": ["IND_OPER", "VL_DOC", "VL_BC_ICMS", "VL_ICMS"], # Documento Fiscal (Mercadorias)
-        "C170": ["CFOP", "VL_ITEM", "VL_BC_ICMS", "VL_ICMS"],    # Itens do Documento (Mercadorias)
-        "D100": ["IND_OPER", "VL_DOC", "VL_BC_ICMS", "VL_ICMS", "CFOP"], # Documento Fiscal (Serviços Transporte)
-        # Adicionar outros registros conforme necessário (ex: C500 Energia, D500 Comunicação)
-    }
-
-    for idx, linha in enumerate(corpo_sped):
-        if not linha.startswith('|'):
-            continue
-
-        partes = linha.split('|')
-        if len(partes) < 2:
-            continue
-
-        registro = partes[1]
-
-        if registro in registros_interesse:
-            # Log a cada 1000 linhas processadas
-            if idx % 1000 == 0:
-                 print(f"[DEBUG][Resumo] Processando linha {idx+1} (Registro: {registro})")
-
-            linha_data = {"REG": registro, "LINHA_ORIGINAL": idx + 1}
-            campos_layout_registro = sped_layout.get(registro, {})
-
-            for nome_campo in registros_interesse[registro]:
-                indice = campos_layout_registro.get(nome_campo)
-                valor = 0.0 # Default para campos numéricos
-                valor_str = "" # Default para strings (CFOP, IND_OPER)
-
-                if indice and indice < len(partes):
-                    valor_raw = partes[indice]
-                    # Tenta converter para float se for campo de valor/base
-                    if nome_campo.startswith("VL_") or nome_campo.startswith("ALIQ_"):
-                        valor = safe_float_conversion(valor_raw)
-                    else:
-                        valor_str = valor_raw.strip()
-                    linha_data[nome_campo] = valor if nome_campo.startswith("VL_") else valor_str
-                else:
-                    # Campo não encontrado na linha ou no layout
-                    linha_data[nome_campo] = valor if nome_campo.startswith("VL_") else valor_str
-                    # print(f"[DEBUG][Resumo] Campo {nome_campo} não encontrado ou índice inválido na linha {idx+1} (Reg: {registro})")
-
-            dados_resumo.append(linha_data)
-
-    print(f"[DEBUG][Resumo] Coleta concluída. {len(dados_resumo)} linhas de dados relevantes encontradas.")
-
-    if not dados_resumo:
-        st.warning("Nenhum dado relevante para resumo encontrado nos registros de interesse (C100, C170, D100). Verifique o conteúdo do SPED.")
+    # --- Cubo de agregação --- #
+    # Montado uma única vez por documento (e atualizado pelas edições); cada visão abaixo
+    # é uma fatia dele, então os reruns do Streamlit não reprocessam as linhas.
+    with st.spinner("Agregando registros..."):
+        cubo = documento.cubo_resumo()
+
+    # Registros somados no resumo geral (pode ser expandido)
+    registros_interesse = ["C100", "C170", "D100"]
+    registros_documento = ["C100", "D100"] # Um valor por documento (sem os itens, que repetiriam os totais)
+    registros_analiticos = [reg for reg in ("C190", "D190", "C590") if reg in cubo.cubos]
+
+    total_coletado = sum(len(cubo.cubos[reg].store) for reg in registros_interesse if reg in cubo.cubos)
+
+    celulas_invalidas = cubo.celulas_invalidas()
+    if celulas_invalidas:
+        total_invalidas = sum(len(linhas) for _, _, linhas in celulas_invalidas)
+        st.warning(f"{total_invalidas} valores fora do formato do layout foram desconsiderados nos totais.")
+        with st.expander("Ver valores inválidos"):
+            st.dataframe(pd.DataFrame({
+                "REG": [reg for reg, _, _ in celulas_invalidas],
+                "CAMPO": [campo for _, campo, _ in celulas_invalidas],
+                "QTD_LINHAS": [len(linhas) for _, _, linhas in celulas_invalidas],
+                "LINHAS (primeiras 20)": [", ".join(map(str, linhas[:20].tolist())) for _, _, linhas in celulas_invalidas],
+            }), hide_index=True, use_container_width=True)
+
+    if not total_coletado and not registros_analiticos:
+        st.warning("Nenhum dado relevante para resumo encontrado nos registros de interesse (C100, C170, D100, C190, D190, C590). Verifique o conteúdo do SPED.")
         return
 
-    # --- Processamento com Pandas --- #
     try:
-        df_resumo = pd.DataFrame(dados_resumo)
-        print(f"[DEBUG][Resumo] DataFrame criado com {len(df_resumo)} linhas e colunas: {df_resumo.columns.tolist()}")
-
         # --- Cálculos dos Resumos --- #
         st.markdown("**Resumo Geral:**")
         col1, col2, col3 = st.columns(3)
 
-        # Exemplo: Total Base de Cálculo ICMS (somando C100, C170, D100)
         # Cuidado: Somar C100 e C170 pode duplicar valores se ambos estiverem presentes.
         #          Idealmente, escolheríamos um ou outro, ou faríamos uma lógica mais complexa.
         #          Vamos somar tudo por enquanto para demonstração.
-        total_bc_icms = df_resumo['VL_BC_ICMS'].sum()
-        col1.metric("Total Base ICMS (Soma C100/C170/D100)", f"{total_bc_icms:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.'))
+        geral = cubo.fatia(registros_interesse, ["REG"])
+        total_bc_icms = geral['VL_BC_ICMS'].sum() if 'VL_BC_ICMS' in geral else 0.0
+        col1.metric("Total Base ICMS (Soma C100/C170/D100)", formatar_valor(total_bc_icms))
 
-        # Total Valor ICMS
-        total_icms = df_resumo['VL_ICMS'].sum()
-        col2.metric("Total Valor ICMS (Soma C100/C170/D100)", f"{total_icms:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.'))
+        total_icms = geral['VL_ICMS'].sum() if 'VL_ICMS' in geral else 0.0
+        col2.metric("Total Valor ICMS (Soma C100/C170/D100)", formatar_valor(total_icms))
 
-        # Total Documentos/Itens processados
-        total_linhas = len(df_resumo)
-        col3.metric("Total Linhas Relevantes Processadas", f"{total_linhas}")
+        col3.metric("Total Linhas Relevantes Processadas", f"{total_coletado}")
 
         st.markdown("---")
 
         # --- Resumo por CFOP --- #
         st.markdown("**Resumo por CFOP:**")
-        # Precisamos garantir que a coluna CFOP exista (pode vir de C170 ou D100)
-        if 'CFOP' in df_resumo.columns:
-            # Agrupar por CFOP e calcular totais e contagem
-            # Preenche NaNs em CFOP (se houver) para evitar erros no groupby
-            df_resumo['CFOP'] = df_resumo['CFOP'].fillna('N/A')
-            resumo_cfop = df_resumo.groupby('CFOP').agg(
-                Contagem=('CFOP', 'size'),
-                Total_BC_ICMS=('VL_BC_ICMS', 'sum'),
-                Total_ICMS=('VL_ICMS', 'sum'),
-                # Adicionar mais agregações se necessário (ex: soma de VL_ITEM do C170)
-            ).reset_index().sort_values(by="Contagem", ascending=False)
-
-            st.dataframe(resumo_cfop, use_container_width=True)
+        resumo_cfop = cubo.fatia(registros_interesse, ["CFOP"])
+        if len(resumo_cfop):
+            resumo_cfop['CFOP'] = resumo_cfop['CFOP'].replace("", "N/A")
+            resumo_cfop = totais_icms(resumo_cfop, ["CFOP"]).sort_values(by="Contagem", ascending=False)
+            st.dataframe(resumo_cfop, hide_index=True, use_container_width=True)
         else:
             st.info("Coluna 'CFOP' não encontrada nos dados coletados para gerar resumo por CFOP.")
 
-        # --- Resumo Entradas x Saídas (Baseado no CFOP ou IND_OPER) --- #
+        # --- Resumo Entradas x Saídas (Baseado no IND_OPER ou CFOP) --- #
         st.markdown("---")
         st.markdown("**Resumo Entradas x Saídas (Simplificado):**")
-        # Tentativa 1: Usar IND_OPER (0 = Entrada, 1 = Saída) - Presente em C100, D100
-        if 'IND_OPER' in df_resumo.columns:
-             df_resumo['Tipo_Operacao'] = df_resumo['IND_OPER'].apply(lambda x: 'Entrada' if x == '0' else ('Saída' if x == '1' else 'Outro'))
-             resumo_tipo_op = df_resumo.groupby('Tipo_Operacao').agg(
-                 Contagem=('Tipo_Operacao', 'size'),
-                 Total_BC_ICMS=('VL_BC_ICMS', 'sum'),
-                 Total_ICMS=('VL_ICMS', 'sum'),
-             ).reset_index()
-             st.dataframe(resumo_tipo_op, hide_index=True, use_container_width=True)
+        # Tentativa 1: Usar IND_OPER (0 = Entrada, 1 = Saída) dos documentos (C100, D100)
+        resumo_tipo_op = cubo.fatia(registros_documento, ["IND_OPER"])
+        if len(resumo_tipo_op) and (resumo_tipo_op['IND_OPER'] != "").any():
+            resumo_tipo_op['Tipo_Operacao'] = resumo_tipo_op['IND_OPER'].map({'0': 'Entrada', '1': 'Saída'}).fillna('Outro')
+            st.dataframe(totais_icms(resumo_tipo_op, ["Tipo_Operacao"]), hide_index=True, use_container_width=True)
         # Tentativa 2: Se não houver IND_OPER, usar CFOP (1xxx, 2xxx, 3xxx = Entrada; 5xxx, 6xxx, 7xxx = Saída)
-        elif 'CFOP' in df_resumo.columns:
+        elif len(resumo_cfop):
             def classificar_cfop(cfop):
                 if isinstance(cfop, str) and len(cfop) >= 1:
                     primeiro_digito = cfop[0]
@@ -159,23 +117,33 @@ def generate_summary(corpo_sped, assinatura):
                         return 'Saída (por CFOP)'
                 return 'Outro/N/A'
 
-            df_resumo['Tipo_Operacao'] = df_resumo['CFOP'].apply(classificar_cfop)
-            resumo_tipo_op_cfop = df_resumo.groupby('Tipo_Operacao').agg(
-                 Contagem=('Tipo_Operacao', 'size'),
-                 Total_BC_ICMS=('VL_BC_ICMS', 'sum'),
-                 Total_ICMS=('VL_ICMS', 'sum'),
-             ).reset_index()
+            resumo_cfop['Tipo_Operacao'] = resumo_cfop['CFOP'].apply(classificar_cfop)
+            resumo_tipo_op_cfop = resumo_cfop.groupby('Tipo_Operacao')[['Contagem', 'Total_BC_ICMS', 'Total_ICMS']].sum().reset_index()
             st.dataframe(resumo_tipo_op_cfop, hide_index=True, use_container_width=True)
         else:
             st.info("Não foi possível determinar Entradas/Saídas (sem IND_OPER ou CFOP nos dados coletados).")
 
+        # --- Registros analíticos (C190, D190, C590): CST x CFOP x Alíquota --- #
+        if registros_analiticos:
+            st.markdown("---")
+            st.markdown("**Resumo Analítico (C190 / D190 / C590):**")
+            col_reg, col_dim, col_mes = st.columns([1, 2, 1])
+            registro_analitico = col_reg.selectbox("Registro", registros_analiticos, key="resumo_registro_analitico")
+            agrupar_por = col_dim.multiselect(
+                "Agrupar por", DIMENSOES, default=["CST_ICMS", "CFOP", "ALIQ_ICMS"], key="resumo_agrupar_por"
+            )
+            meses = sorted(m for m in cubo.fatia([registro_analitico], ["MES"])["MES"] if m)
+            mes = col_mes.selectbox("Mês", ["Todos"] + meses, key="resumo_mes")
+            if agrupar_por:
+                filtros = {} if mes == "Todos" else {"MES": mes}
+                analitico = cubo.fatia([registro_analitico], agrupar_por, filtros).sort_values(agrupar_por)
+                st.dataframe(analitico, hide_index=True, use_container_width=True)
+            else:
+                st.info("Selecione ao menos uma dimensão para agrupar.")
 
     except Exception as e:
         st.error(f"Ocorreu um erro ao processar os dados para o resumo: {e}")
-        print(f"[DEBUG][Resumo] Erro durante processamento Pandas: {e}")
-        # Opcional: Mostrar o DataFrame parcial para depuração, se ele foi criado
-        # if 'df_resumo' in locals():
-        #     st.expander("Dados parciais coletados (para depuração)").dataframe(df_resumo.head(50))
+        evento("Resumo: erro ao montar as tabelas", erro=str(e))
 
     # Limpar o placeholder de aviso
     # (Remover o st.warning inicial)
@@ -199,9 +167,4 @@ def generate_summary(corpo_sped, assinatura):
     #             continue # Ignora linhas mal formatadas ou sem valor
     # st.metric("Total ICMS (Registro D100 - Exemplo)", f"{total_icms_d100:.2f}")
 
-    # TODO: Implementar totalizações por CST, CFOP, base de cálculo, etc.
-    #       - Identificar os registros relevantes (ex: C100, C170, D100, etc.)
-    #       - Mapear os campos corretos para cada totalização
-    #       - Usar Pandas para agrupar e somar pode ser eficiente
-
     pass # Remover quando implementar a lógica 
\ No newline at end of file
@@ -0,0 +1,52 @@
+import numpy as np
+
+# --- Seleção de linhas de um registro (um bit por linha do RegistroStore) ---
+
+
+def _bytes_e_mascaras(posicoes):
+    posicoes = np.asarray(posicoes, dtype=np.int64)
+    return posicoes >> 3, (np.uint8(0x80) >> (posicoes & 7).astype(np.uint8)).astype(np.uint8)
+
+
+class Selecao:
+    """Conjunto de posições (0 .. tamanho-1) de um RegistroStore guardado como bitset.
+
+    Ocupa tamanho/8 bytes, qualquer que seja a quantidade de linhas marcadas,
+    e as operações recebem vetores de posições (resultado de um filtro, de uma
+    página, dos filhos de alguns pais...), sem laço em Python.
+    """
+
+    def __init__(self, tamanho):
+        self.tamanho = tamanho
+        self.bits = np.zeros((tamanho + 7) // 8, dtype=np.uint8)
+
+    def __len__(self):
+        return int(np.unpackbits(self.bits, count=self.tamanho).sum())
+
+    def __bool__(self):
+        return bool(self.bits.any())
+
+    def contem(self, posicoes):
+        """Vetor booleano: cada posição está marcada?"""
+        bytes_, mascaras = _bytes_e_mascaras(posicoes)
+        return (self.bits[bytes_] & mascaras) != 0
+
+    def marcar(self, posicoes):
+        bytes_, mascaras = _bytes_e_mascaras(posicoes)
+        np.bitwise_or.at(self.bits, bytes_, mascaras)
+
+    def desmarcar(self, posicoes):
+        bytes_, mascaras = _bytes_e_mascaras(posicoes)
+        np.bitwise_and.at(self.bits, bytes_, ~mascaras)
+
+    def inverter(self, posicoes):
+        """Inverte a marcação das posições informadas (sem repetições)."""
+        bytes_, mascaras = _bytes_e_mascaras(np.unique(posicoes))
+        np.bitwise_xor.at(self.bits, bytes_, mascaras)
+
+    def limpar(self):
+        self.bits[:] = 0
+
+    def posicoes(self):
+        """Vetor ordenado com as posições marcadas."""
+        return np.flatnonzero(np.unpackbits(self.bits, count=self.tamanho))
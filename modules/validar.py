@@ -0,0 +1,306 @@
+import gc
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from modules.decodificar import decodificar_coluna
+from modules.hierarquia import concatenar_faixas
+from modules.layout import layout_conferido
+
+# --- Validação do conteúdo do SPED contra o layout ---
+
+def validar_formatos(documento, registros=None, liberar_registros=False):
+    """Confere o formato de todos os campos (tipo, tamanho, decimais, datas) com o layout.
+
+    Cada coluna é verificada de uma vez pelo decodificador vetorizado. Com
+    `liberar_registros`, os registros que não estavam carregados são
+    descartados logo após a verificação (memória limitada a um registro por vez).
+    Retorna uma lista de (REG, CAMPO, linhas base 1, valores) com as células inválidas.
+    """
+    problemas = []
+    for registro in registros if registros is not None else documento.tipos_registro():
+        ja_carregado = registro in documento.registros
+        store = documento.registro(registro)
+        if store is None:
+            continue
+        for nome_campo in store.campos:
+            coluna = store.coluna(nome_campo)
+            _, invalidos = decodificar_coluna(coluna, store.tipo_campo(nome_campo))
+            if invalidos.any():
+                posicoes = invalidos.nonzero()[0]
+                problemas.append((registro, nome_campo, store.linhas[posicoes] + 1, [coluna[p] for p in posicoes.tolist()]))
+        if liberar_registros and not ja_carregado:
+            del documento.registros[registro]
+    return problemas
+
+
+# --- Validação estrutural (contadores, totais e quantidade de campos), mantida em dia a cada edição ---
+
+Problema = namedtuple("Problema", ["regra", "linha", "registro", "campo", "mensagem"]) # linha: base 1 no arquivo (None = arquivo todo)
+
+REGRA_CAMPOS = "Quantidade de campos"
+REGRA_9900 = "Contagem 9900"
+REGRA_QTD_LIN = "QTD_LIN"
+REGRA_TOTAIS = "Totais analíticos"
+TOLERANCIA_TOTAIS = 0.01 # Diferença (em R$) aceita entre o analítico e a soma dos itens
+
+# (pai, itens, analítico, chaves comuns, medidas comuns): o analítico de cada pai deve somar os seus itens
+RELACOES_TOTAIS = [
+    ("C100", "C170", "C190", ["CST_ICMS", "CFOP", "ALIQ_ICMS"], ["VL_BC_ICMS", "VL_ICMS", "VL_BC_ICMS_ST", "VL_ICMS_ST", "VL_IPI"]),
+]
+
+
+def _campos_esperados(campos_layout):
+    """Quantidade de '|' de uma linha completa do registro, ou None se o layout não foi conferido com o Guia Prático.
+
+    Layouts não conferidos (campos genéricos do CSV ou descritivo incompleto)
+    marcariam como erradas as linhas corretas de um arquivo real.
+    """
+    if not campos_layout or not layout_conferido(campos_layout):
+        return None
+    return max(campos_layout.values()) + 1
+
+
+@contextmanager
+def _coletor_pausado():
+    """Pausa o coletor de lixo: milhares de Problema com milhões de objetos vivos disparam coletas caras."""
+    gc_ativo = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_ativo:
+            gc.enable()
+
+
+def _valores_numericos(store, campo):
+    """Coluna decodificada como float (nulos = 0), ou None se o campo não tiver tipo numérico conhecido."""
+    decodificada = store.coluna_decodificada(campo)
+    if decodificada is None or getattr(decodificada[0], "dtype", None) is None or decodificada[0].dtype.kind != "f":
+        return None
+    return np.nan_to_num(decodificada[0], nan=0.0)
+
+
+def contagem_registros(documento):
+    """REG -> quantidade de linhas no arquivo todo (corpo + bloco 9 final), sem percorrer o corpo."""
+    contagem = Counter({registro: quantidade for registro, quantidade in documento.contagem.items() if quantidade > 0})
+    for linha in documento.assinatura:
+        if linha.startswith('|'):
+            contagem[linha.split('|', 2)[1]] += 1
+    return contagem
+
+
+class ValidacaoEstrutural:
+    """Checagens estruturais do arquivo, feitas numa passada e atualizadas a cada edição.
+
+    - quantidade de campos de cada linha x layout (contagem de '|' vetorizada),
+      só nos registros conferidos com o Guia Prático (sped_conferidos.txt);
+    - 9900 (linhas por registro) e QTD_LIN dos x990/9990/9999 x contagem real;
+    - totais dos analíticos (C190) x soma dos itens (C170) de cada documento (C100).
+
+    Uma edição revalida só as linhas alteradas, os pais delas (para os totais)
+    e os contadores, que custam O(quantidade de registros).
+    """
+
+    def __init__(self, documento):
+        self.versao = documento.versao
+        self.campos = {}    # linha (base 0) -> Problema de quantidade de campos
+        self.contadores = []
+        self.totais = {}    # relação -> {posição do pai: [Problema]}
+        self.posicoes_pai = {} # (relação, registro) -> posição do pai de cada linha (itens e analítico)
+
+        if hasattr(documento.corpo, "separadores_por_linha"):
+            separadores = documento.corpo.separadores_por_linha()
+        else:
+            separadores = np.fromiter((linha.count('|') for linha in documento.corpo), dtype=np.int64, count=len(documento.corpo))
+        with _coletor_pausado():
+            self._validar_campos(documento, separadores)
+            self.contadores = self._validar_contadores(documento)
+            for relacao in RELACOES_TOTAIS:
+                self.totais[relacao[0]] = self._validar_totais(documento, relacao)
+
+    def __len__(self):
+        return len(self.campos) + len(self.contadores) + sum(len(p) for por_pai in self.totais.values() for p in por_pai.values())
+
+    # --- Quantidade de campos ---
+
+    def _problema_campos(self, registro, idx, encontrados, esperados):
+        # Contagens sem o REG: '|REG|c1|...|cN|' tem N + 2 separadores
+        return Problema(REGRA_CAMPOS, idx + 1, registro, None, f"{encontrados - 2} campos na linha; o layout tem {esperados - 2}")
+
+    def _validar_campos(self, documento, separadores):
+        for registro, linhas in documento.indice_registros.items():
+            esperados = _campos_esperados(documento.layout.get(registro))
+            if esperados is None:
+                continue
+            erradas = linhas[separadores[linhas] != esperados]
+            for idx, encontrados in zip(erradas.tolist(), separadores[erradas].tolist()):
+                self.campos[idx] = self._problema_campos(registro, idx, encontrados, esperados)
+
+    # --- Contadores (9900 e QTD_LIN) ---
+
+    def _validar_contadores(self, documento):
+        problemas = []
+        contagem = contagem_registros(documento)
+        por_bloco = Counter()
+        for registro, quantidade in contagem.items():
+            por_bloco[registro[0]] += quantidade
+        base_assinatura = len(documento.corpo)
+
+        # x990 do corpo (QTD_LIN_0, QTD_LIN_C, ...)
+        for registro, linhas in documento.indice_registros.items():
+            if len(registro) == 4 and registro.endswith("990") and registro != "9990":
+                for idx, linha in zip(linhas.tolist(), documento.linhas_em(linhas)):
+                    problemas.extend(self._conferir(linha, idx + 1, registro, "QTD_LIN_" + registro[0], por_bloco[registro[0]], REGRA_QTD_LIN))
+
+        # Bloco 9 final: 9900 (por registro), 9990 e 9999
+        informados = set()
+        for i, linha in enumerate(documento.assinatura):
+            partes = linha.split('|')
+            if len(partes) < 4:
+                continue
+            numero = base_assinatura + i + 1
+            if partes[1] == "9900":
+                informados.add(partes[2])
+                problemas.extend(self._conferir(linha, numero, "9900", f"QTD_REG_BLC ({partes[2]})", contagem.get(partes[2], 0), REGRA_9900, 3))
+            elif partes[1] == "9990":
+                problemas.extend(self._conferir(linha, numero, "9990", "QTD_LIN_9", por_bloco["9"], REGRA_QTD_LIN))
+            elif partes[1] == "9999":
+                problemas.extend(self._conferir(linha, numero, "9999", "QTD_LIN", sum(contagem.values()), REGRA_QTD_LIN))
+        if informados:
+            for registro in sorted(set(contagem) - informados):
+                problemas.append(Problema(REGRA_9900, None, "9900", registro, f"Registro {registro} ({contagem[registro]} linhas) sem 9900"))
+        if problemas and documento.encerramento_recalculado():
+            problemas = [p._replace(mensagem=p.mensagem + " (recalculado no arquivo gerado)") for p in problemas]
+        return problemas
+
+    @staticmethod
+    def _conferir(linha, numero, registro, campo, esperado, regra, posicao=2):
+        partes = linha.split('|')
+        informado = partes[posicao] if len(partes) > posicao else ""
+        if informado.strip() != str(esperado):
+            return [Problema(regra, numero, registro, campo, f"Informado {informado or '(vazio)'}, contado {esperado}")]
+        return []
+
+    # --- Totais (analítico x itens de cada pai) ---
+
+    def _posicoes_pai(self, documento, relacao, store, store_pai):
+        chave = (relacao[0], store.registro)
+        posicoes = self.posicoes_pai.get(chave)
+        if posicoes is None:
+            posicoes = self.posicoes_pai[chave] = documento.posicoes_pai(store, store_pai)
+        return posicoes
+
+    def _tabela(self, documento, relacao, store, store_pai, selecao):
+        """DataFrame (PAI, LINHA, chaves, medidas) das linhas `selecao` (None = todas) do registro."""
+        _, _, _, chaves, medidas = relacao
+        todas = selecao is None
+        dados = {"PAI": self._posicoes_pai(documento, relacao, store, store_pai) if todas else self._posicoes_pai(documento, relacao, store, store_pai)[selecao],
+                 "LINHA": store.linhas if todas else store.linhas[selecao]}
+        for chave in chaves:
+            coluna = store.coluna(chave) or [None] * len(store)
+            valores = _valores_numericos(store, chave) if chave.startswith("ALIQ") else None
+            if valores is not None:
+                dados[chave] = np.round(valores if todas else valores[selecao], 2)
+            else:
+                dados[chave] = coluna if todas else [coluna[p] for p in selecao.tolist()]
+        for medida in medidas:
+            valores = _valores_numericos(store, medida)
+            if valores is None:
+                valores = np.zeros(len(store))
+            dados[medida] = valores if todas else valores[selecao]
+        return pd.DataFrame(dados)
+
+    def _validar_totais(self, documento, relacao, posicoes_pais=None):
+        """{posição do pai: [Problema]} da relação, para todos os pais ou só `posicoes_pais`."""
+        registro_pai, registro_item, registro_analitico, chaves, medidas = relacao
+        store_pai = documento.registro(registro_pai)
+        store_item = documento.registro(registro_item)
+        store_analitico = documento.registro(registro_analitico)
+        if store_pai is None or store_item is None or store_analitico is None or not len(store_item):
+            return {}
+
+        selecoes = [None, None]
+        if posicoes_pais is not None:
+            linhas_pais = store_pai.linhas[posicoes_pais]
+            selecoes = [concatenar_faixas(*documento.hierarquia.faixas_filhos(linhas_pais, store.linhas))
+                        for store in (store_item, store_analitico)]
+        itens = self._tabela(documento, relacao, store_item, store_pai, selecoes[0])
+        analiticos = self._tabela(documento, relacao, store_analitico, store_pai, selecoes[1])
+        # Só pais que têm itens: documentos sem C170 (ex: NF-e de terceiros) não entram na comparação
+        analiticos = analiticos[analiticos["PAI"].isin(itens["PAI"].unique())]
+        grupo = ["PAI"] + chaves
+        soma_itens = itens.groupby(grupo)[medidas].sum()
+        soma_analiticos = analiticos.groupby(grupo).agg({"LINHA": "first", **{m: "sum" for m in medidas}})
+        comparacao = soma_itens.join(soma_analiticos, how="outer", lsuffix="_ITENS").reset_index()
+
+        problemas = {}
+        sem_analitico = comparacao["LINHA"].isna()
+        for linha in comparacao[sem_analitico].itertuples(index=False):
+            pai = int(linha.PAI)
+            if pai < 0:
+                continue
+            descricao = "/".join(str(getattr(linha, chave)) for chave in chaves)
+            problemas.setdefault(pai, []).append(Problema(
+                REGRA_TOTAIS, int(store_pai.linhas[pai]) + 1, registro_pai, None,
+                f"Itens {registro_item} com {'/'.join(chaves)} {descricao} sem {registro_analitico} correspondente"
+            ))
+        comparacao = comparacao[~sem_analitico].fillna(0.0)
+        for medida in medidas:
+            diferentes = comparacao[(comparacao[medida] - comparacao[medida + "_ITENS"]).abs() > TOLERANCIA_TOTAIS]
+            for pai, linha, analitico, soma in zip(diferentes["PAI"].tolist(), diferentes["LINHA"].tolist(),
+                                                  diferentes[medida].tolist(), diferentes[medida + "_ITENS"].tolist()):
+                problemas.setdefault(int(pai), []).append(Problema(
+                    REGRA_TOTAIS, int(linha) + 1, registro_analitico, medida,
+                    f"{registro_analitico} = {analitico:.2f}; soma dos {registro_item} = {soma:.2f}"
+                ))
+        return problemas
+
+    # --- Revalidação incremental ---
+
+    def atualizar(self, documento, registro, ids, posicoes, versao):
+        """Revalida só o que a edição das linhas `ids` (posições `posicoes` no RegistroStore) pode ter mudado."""
+        esperados = _campos_esperados(documento.layout.get(registro))
+        for idx, linha in zip(np.asarray(ids).tolist(), documento.linhas_em(ids)):
+            self.campos.pop(idx, None)
+            encontrados = linha.count('|')
+            if esperados is not None and encontrados != esperados:
+                self.campos[idx] = self._problema_campos(registro, idx, encontrados, esperados)
+
+        self.contadores = self._validar_contadores(documento)
+
+        for relacao in RELACOES_TOTAIS:
+            registro_pai, registro_item, registro_analitico = relacao[:3]
+            if registro not in (registro_item, registro_analitico):
+                continue
+            pais_linhas = self.posicoes_pai.get((registro_pai, registro))
+            if pais_linhas is None:
+                continue
+            pais = np.unique(pais_linhas[np.asarray(posicoes, dtype=np.int64)])
+            pais = pais[pais >= 0]
+            por_pai = self.totais.setdefault(registro_pai, {})
+            for pai in pais.tolist():
+                por_pai.pop(pai, None)
+            por_pai.update(self._validar_totais(documento, relacao, pais))
+        self.versao = versao
+
+    # --- Resultado ---
+
+    def problemas(self):
+        """Todos os problemas, ordenados pela linha (os sem linha por último)."""
+        with _coletor_pausado():
+            todos = list(self.campos.values()) + self.contadores
+            for por_pai in self.totais.values():
+                for problemas in por_pai.values():
+                    todos.extend(problemas)
+            return sorted(todos, key=lambda p: (p.linha is None, p.linha or 0, p.regra))
+
+    def tabela(self):
+        """DataFrame (Regra, Linha, Registro, Campo, Mensagem) com todos os problemas."""
+        tabela = pd.DataFrame(self.problemas(), columns=list(Problema._fields)).rename(columns={
+            "regra": "Regra", "linha": "Linha", "registro": "Registro", "campo": "Campo", "mensagem": "Mensagem"
+        })
+        tabela["Linha"] = tabela["Linha"].astype("Int64")
+        return tabela
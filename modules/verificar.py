@@ -0,0 +1,48 @@
+import streamlit as st
+
+from modules.validar import REGRA_9900, REGRA_CAMPOS, REGRA_QTD_LIN, REGRA_TOTAIS
+
+LIMITE_PROBLEMAS_EXIBIDOS = 5000 # Linhas da tabela de problemas mostradas na tela (o CSV traz todas)
+REGRAS = [REGRA_CAMPOS, REGRA_9900, REGRA_QTD_LIN, REGRA_TOTAIS]
+
+
+def exibir_status_validacao(documento):
+    """Resumo da validação estrutural, se ela já foi feita (é mantida em dia a cada alteração)."""
+    validacao = documento.validacao_atual()
+    if validacao is None:
+        return
+    if len(validacao):
+        st.warning(f"🔎 Validação estrutural: {len(validacao)} problema(s) encontrados. Veja em 'Validar Estrutura'.")
+    else:
+        st.caption("🔎 Validação estrutural: nenhum problema encontrado.")
+
+
+def display_validation_report(documento):
+    """Valida a estrutura do arquivo (contadores 9900/QTD_LIN, totais C190 x C170, campos por linha)."""
+    st.subheader("🔎 Validação Estrutural")
+    st.caption("As verificações são feitas uma vez e atualizadas só nas linhas afetadas a cada alteração.")
+
+    with st.spinner("Validando a estrutura do arquivo..."):
+        tabela = documento.validacao().tabela()
+
+    if not len(tabela):
+        st.success("Nenhum problema estrutural encontrado.")
+        return
+
+    contagem = tabela["Regra"].value_counts()
+    colunas = st.columns(len(REGRAS))
+    for coluna, regra in zip(colunas, REGRAS):
+        coluna.metric(regra, int(contagem.get(regra, 0)))
+
+    regras = st.multiselect("Mostrar as regras", REGRAS, default=[r for r in REGRAS if contagem.get(r, 0)], key="validacao_regras")
+    filtrada = tabela[tabela["Regra"].isin(regras)]
+    st.dataframe(filtrada.head(LIMITE_PROBLEMAS_EXIBIDOS), hide_index=True, use_container_width=True)
+    if len(filtrada) > LIMITE_PROBLEMAS_EXIBIDOS:
+        st.caption(f"... (mostrando {LIMITE_PROBLEMAS_EXIBIDOS} de {len(filtrada)} problemas)")
+    st.download_button(
+        label="📥 Baixar problemas (.csv)",
+        data=lambda: filtrada.to_csv(sep=";", index=False).encode("utf-8"),
+        file_name="validacao_estrutural.csv",
+        mime="text/csv",
+        key="download_validacao"
+    )
@@ -1,15 +1,157 @@
+import re
+
+import numpy as np
 import streamlit as st
 
-def display_file_content(corpo_sped, assinatura):
-    """Exibe as primeiras 100 linhas do corpo do SPED."""
+from modules.instrumentacao import medir
+from modules.leitor import ENCODING_SPED
+
+# --- Visualizador paginado do corpo (só a janela visível é lida e decodificada) ---
+
+LINHAS_POR_PAGINA = [50, 100, 250, 500]
+LIMITE_OCORRENCIAS_BUSCA = 1000 # Ocorrências juntadas por busca; "Continuar busca" junta mais a partir de onde parou
+
+
+def _posicao(linhas_visiveis, total, linha):
+    """Posição, na sequência visível, da primeira linha >= `linha` (base 0)."""
+    if linhas_visiveis is None:
+        return min(max(linha, 0), max(total - 1, 0))
+    return min(int(np.searchsorted(linhas_visiveis, linha)), max(total - 1, 0))
+
+
+def _linha_na_posicao(linhas_visiveis, posicao):
+    return posicao if linhas_visiveis is None else int(linhas_visiveis[posicao])
+
+
+def _cabe_no_arquivo(termo):
+    """Se o termo pode ser escrito no encoding dos arquivos SPED (latin-1)."""
+    try:
+        termo.encode(ENCODING_SPED)
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _buscar(documento, busca, registros, progresso, status):
+    """Continua a busca de onde parou, mostrando o andamento a cada bloco varrido."""
+    total = len(documento.corpo)
+    limite = len(busca["ocorrencias"]) + LIMITE_OCORRENCIAS_BUSCA
+    with medir("buscar", regex=busca["regex"], indice=documento.indice_texto() is not None) as etapa:
+        inicio = busca["proxima"]
+        for proxima, linhas in documento.buscar(busca["termo"], busca["proxima"], busca["regex"], busca["maiusculas"], registros):
+            busca["ocorrencias"].extend(linhas.tolist())
+            busca["proxima"] = proxima
+            progresso.progress(proxima / total if total else 1.0)
+            status.caption(f"{len(busca['ocorrencias'])} linha(s) encontradas até a linha {proxima}...")
+            if len(busca["ocorrencias"]) >= limite:
+                break
+        etapa.linhas = busca["proxima"] - inicio
+        etapa.anotar(ocorrencias=len(busca["ocorrencias"]))
+    busca["concluida"] = busca["proxima"] >= total
+    progresso.empty()
+    status.empty()
+
+
+def display_file_content(documento):
+    """Exibe o corpo do SPED em páginas, com ida direta a uma linha, filtro por registro e busca."""
     st.subheader("Conteúdo do Arquivo (sem assinatura)")
-    if corpo_sped:
-        st.text("\n".join(corpo_sped[:100]))
-        if len(corpo_sped) > 100:
-            st.caption(f"... (mostrando 100 de {len(corpo_sped)} linhas do corpo)")
-    else:
+    corpo_sped = documento.corpo if documento is not None else None
+    if not corpo_sped:
         st.info("Corpo do arquivo vazio ou não carregado.")
+        return
+
+    col_reg, col_pag = st.columns([4, 1])
+    registros = col_reg.multiselect("Mostrar só os registros", documento.registros_presentes(), key="visualizar_registros")
+    por_pagina = col_pag.selectbox("Linhas por página", LINHAS_POR_PAGINA, index=1, key="visualizar_por_pagina")
+
+    linhas_visiveis = documento.linhas_dos_registros(registros) if registros else None
+    total = len(corpo_sped) if linhas_visiveis is None else len(linhas_visiveis)
+    if not total:
+        st.info("Nenhuma linha dos registros selecionados.")
+        return
+    posicao = _posicao(linhas_visiveis, total, st.session_state.get("visualizar_linha", 0))
+
+    # --- Busca (as ocorrências aparecem conforme os blocos do arquivo são varridos) ---
+    with st.expander("🔍 Buscar no arquivo", expanded=bool(st.session_state.get("visualizar_busca"))):
+        progresso = documento.progresso_indice_texto()
+        if progresso is not None and progresso < 1.0:
+            st.caption(f"Índice de busca em montagem ({progresso:.0%}); enquanto isso a busca varre o arquivo.")
+        elif progresso is not None:
+            st.caption("Índice de busca pronto: só os trechos do arquivo que contêm o termo são conferidos.")
+        col_termo, col_regex, col_maiusculas = st.columns([4, 1, 1])
+        termo = col_termo.text_input("Texto ou expressão a buscar", key="visualizar_termo")
+        regex = col_regex.checkbox("Expressão regular", key="visualizar_regex")
+        maiusculas = col_maiusculas.checkbox("Diferenciar maiúsculas", key="visualizar_maiusculas")
+        fora_do_arquivo = bool(termo) and not regex and not _cabe_no_arquivo(termo)
+        if fora_do_arquivo:
+            st.warning(f"O termo tem caracteres que não existem em arquivos SPED ({ENCODING_SPED}); nenhuma linha pode contê-lo.")
 
-    # A informação sobre a assinatura pode ser mostrada na interface principal
-    # if assinatura:
-    #     st.info("Assinatura detectada e preservada.") 
\ No newline at end of file
+        chave = (id(documento), documento.versao, termo, regex, maiusculas, tuple(registros))
+        busca = st.session_state.get("visualizar_busca")
+        if busca is not None and busca["chave"] != chave:
+            busca = st.session_state.visualizar_busca = None # Termo, filtro ou conteúdo mudou
+
+        col_buscar, col_continuar = st.columns(2)
+        buscar = col_buscar.button("🔍 Buscar", disabled=not termo or fora_do_arquivo, key="visualizar_buscar")
+        continuar = col_continuar.button("⏩ Continuar busca", disabled=busca is None or busca["concluida"], key="visualizar_continuar")
+        if buscar:
+            busca = st.session_state.visualizar_busca = {
+                "chave": chave, "termo": termo, "regex": regex, "maiusculas": maiusculas,
+                "ocorrencias": [], "proxima": 0, "concluida": False,
+            }
+        if buscar or continuar:
+            try:
+                _buscar(documento, busca, registros, st.progress(0.0), st.empty())
+            except re.error as e:
+                st.error(f"Expressão regular inválida: {e}")
+                busca = st.session_state.visualizar_busca = None
+
+        if busca is not None:
+            ocorrencias = busca["ocorrencias"]
+            if busca["concluida"]:
+                st.caption(f"{len(ocorrencias)} linha(s) encontradas no arquivo.")
+            else:
+                st.caption(f"{len(ocorrencias)} linha(s) encontradas até a linha {busca['proxima']} de {len(corpo_sped)}.")
+            if ocorrencias:
+                col_sel, col_ir, col_prox = st.columns([3, 1, 1])
+                escolhida = col_sel.selectbox(
+                    "Ocorrências", ocorrencias, key="visualizar_ocorrencia",
+                    format_func=lambda idx: f"Linha {idx + 1} ({documento.hierarquia.registro_da_linha(idx) or '?'})"
+                )
+                if col_ir.button("Ir para a ocorrência", key="visualizar_ir_ocorrencia"):
+                    posicao = _posicao(linhas_visiveis, total, escolhida)
+                if col_prox.button("Próxima ocorrência ▶", key="visualizar_proxima_ocorrencia"):
+                    atual = _linha_na_posicao(linhas_visiveis, posicao)
+                    seguinte = ocorrencias[min(int(np.searchsorted(ocorrencias, atual, side="right")), len(ocorrencias) - 1)]
+                    posicao = _posicao(linhas_visiveis, total, seguinte)
+
+    # --- Navegação ---
+    col_inicio, col_anterior, col_proxima, col_fim, col_linha, col_ir = st.columns([1, 1, 1, 1, 2, 1])
+    if col_inicio.button("⏮ Início", key="visualizar_inicio"):
+        posicao = 0
+    if col_anterior.button("◀ Anterior", key="visualizar_anterior"):
+        posicao = max(posicao - por_pagina, 0)
+    if col_proxima.button("Próxima ▶", key="visualizar_proxima"):
+        posicao = min(posicao + por_pagina, max(total - 1, 0))
+    if col_fim.button("Fim ⏭", key="visualizar_fim"):
+        posicao = max(total - por_pagina, 0)
+    ir_para = col_linha.number_input("Ir para a linha", min_value=1, max_value=len(corpo_sped), value=1, step=1,
+                                     key="visualizar_ir_para", label_visibility="collapsed")
+    if col_ir.button("Ir", key="visualizar_ir"):
+        posicao = _posicao(linhas_visiveis, total, int(ir_para) - 1)
+    st.session_state.visualizar_linha = _linha_na_posicao(linhas_visiveis, posicao)
+
+    # --- Janela visível ---
+    fim = min(posicao + por_pagina, total)
+    indices = np.arange(posicao, fim) if linhas_visiveis is None else linhas_visiveis[posicao:fim]
+    alteradas = getattr(corpo_sped, "alteradas", {})
+    largura = len(str(len(corpo_sped)))
+    st.code("\n".join(
+        f"{idx + 1:>{largura}}{'*' if idx in alteradas else ' '} {linha}"
+        for idx, linha in zip(indices.tolist(), documento.linhas_em(indices))
+    ), language=None)
+    if linhas_visiveis is None:
+        st.caption(f"Linhas {posicao + 1} a {fim} de {len(corpo_sped)} do corpo (* = linha alterada)")
+    else:
+        st.caption(f"Linhas {posicao + 1} a {fim} de {total} dos registros {', '.join(registros)} "
+                   f"({len(corpo_sped)} no corpo; * = linha alterada)")
\ No newline at end of file
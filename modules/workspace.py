@@ -0,0 +1,152 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from modules.cache_documentos import hash_conteudo
+from modules.documento import abrir_documento
+
+# --- Área de trabalho com vários documentos SPED (meses e/ou estabelecimentos) ---
+
+DIMENSOES_WORKSPACE = ["ARQUIVO", "CNPJ", "PERIODO"] # Dimensões acrescentadas às do cubo de cada documento
+
+
+def chave_arquivo(arquivo):
+    """Identifica um upload na área de trabalho: o file_id do Streamlit ou, sem ele, o SHA-256 do conteúdo.
+
+    Nunca o nome: dois estabelecimentos mandam "SPED.txt" com conteúdos diferentes.
+    """
+    return getattr(arquivo, "file_id", None) or hash_conteudo(arquivo)
+
+
+def nomes_exibicao(arquivos, chaves):
+    """{chave: nome mostrado}; nomes repetidos ganham um sufixo na ordem do upload ("SPED.txt (2)")."""
+    nomes = {}
+    usados = set()
+    for arquivo, chave in zip(arquivos, chaves):
+        nome, n = arquivo.name, 1
+        while nome in usados:
+            n += 1
+            raiz, extensao = os.path.splitext(arquivo.name)
+            nome = f"{raiz} ({n}){extensao}"
+        usados.add(nome)
+        nomes[chave] = nome
+    return nomes
+
+
+class DocumentoWorkspace:
+    """Um documento da área de trabalho, identificado pelo registro 0000 (período e CNPJ).
+
+    `chave` identifica o upload (ver chave_arquivo); `nome` é o nome mostrado, único na área de trabalho.
+    """
+
+    def __init__(self, chave, nome, documento):
+        self.chave = chave
+        self.nome = nome
+        self.documento = documento
+        store = documento.registro("0000")
+        abertura = {nome_campo: store.coluna(nome_campo)[0] for nome_campo in store.campos} if store is not None and len(store) else {}
+        self.dt_ini = abertura.get("DT_INI") or ""
+        self.dt_fin = abertura.get("DT_FIN") or ""
+        self.cnpj = abertura.get("CNPJ") or abertura.get("CPF") or ""
+        self.nome_empresa = abertura.get("NOME") or ""
+
+    @property
+    def periodo(self):
+        """Período de referência 'AAAA-MM' (a partir de 0000.DT_INI)."""
+        return f"{self.dt_ini[4:8]}-{self.dt_ini[2:4]}" if len(self.dt_ini) == 8 else ""
+
+
+class Workspace:
+    """Conjunto de documentos SPED carregados juntos para consolidação.
+
+    Cada documento guarda o próprio armazenamento colunar (arquivo mapeado +
+    RegistroStore sob demanda) e o próprio cubo de agregação; as visões
+    consolidadas juntam apenas as células dos cubos, nunca as linhas.
+    """
+
+    def __init__(self):
+        self.itens = {} # chave do upload (ver chave_arquivo) -> DocumentoWorkspace
+
+    def __len__(self):
+        return len(self.itens)
+
+    def __contains__(self, chave):
+        return chave in self.itens
+
+    def __getitem__(self, chave):
+        return self.itens[chave]
+
+    def sincronizar(self, arquivos, sped_layout, sped_tipos=None, max_processos=None, abrir=abrir_documento):
+        """Deixa na área de trabalho exatamente os `arquivos` (objetos com .name), lendo só os novos.
+
+        Os arquivos são identificados por chave_arquivo, então uploads de mesmo
+        nome são documentos distintos (mostrados como "SPED.txt", "SPED.txt (2)").
+        Os novos são lidos em paralelo (a leitura é dominada por E/S e
+        operações numpy, que liberam o GIL). `abrir(arquivo, layout, tipos)` monta
+        cada documento (ex: CacheDocumentos.abrir). Retorna {nome: erro} dos que falharam.
+        """
+        chaves = [chave_arquivo(arquivo) for arquivo in arquivos]
+        nomes = nomes_exibicao(arquivos, chaves)
+        for chave in [chave for chave in self.itens if chave not in nomes]:
+            del self.itens[chave]
+        for chave, item in self.itens.items():
+            item.nome = nomes[chave]
+
+        novos = {chave: arquivo for chave, arquivo in zip(chaves, arquivos) if chave not in self.itens}
+        erros = {}
+        if not novos:
+            return erros
+        max_processos = max_processos or min(len(novos), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max_processos) as pool:
+            futuros = {chave: pool.submit(abrir, arquivo, sped_layout, sped_tipos) for chave, arquivo in novos.items()}
+            for chave, futuro in futuros.items():
+                try:
+                    self.itens[chave] = DocumentoWorkspace(chave, nomes[chave], futuro.result())
+                except Exception as e:
+                    erros[nomes[chave]] = e
+        return erros
+
+    def ordenados(self):
+        """Documentos por CNPJ e período."""
+        return sorted(self.itens.values(), key=lambda item: (item.cnpj, item.dt_ini[4:8] + item.dt_ini[2:4], item.nome))
+
+    def identificacao(self):
+        """DataFrame com arquivo, CNPJ, período e tamanho de cada documento."""
+        return pd.DataFrame([{
+            "ARQUIVO": item.nome, "CNPJ": item.cnpj, "NOME": item.nome_empresa,
+            "DT_INI": item.dt_ini, "DT_FIN": item.dt_fin, "LINHAS": len(item.documento),
+        } for item in self.ordenados()])
+
+    def periodos_repetidos(self):
+        """Pares (CNPJ, período) presentes em mais de um arquivo (provável arquivo retificador duplicado)."""
+        vistos = {}
+        for item in self.ordenados():
+            vistos.setdefault((item.cnpj, item.periodo), []).append(item.nome)
+        return {chave: nomes for chave, nomes in vistos.items() if len(nomes) > 1}
+
+    def fatia(self, registros, por, filtros=None):
+        """Totais consolidados de todos os documentos, agrupados por `por`.
+
+        `por` aceita as dimensões do cubo (CFOP, CST_ICMS, ...) e também
+        ARQUIVO, CNPJ e PERIODO; `filtros` idem ({dimensão: valor ou lista}).
+        """
+        filtros = dict(filtros or {})
+        filtros_workspace = {dim: filtros.pop(dim) for dim in DIMENSOES_WORKSPACE if dim in filtros}
+        por_documento = ["REG"] + [dim for dim in por if dim not in DIMENSOES_WORKSPACE and dim != "REG"]
+
+        partes = []
+        for item in self.ordenados():
+            marcacao = {"ARQUIVO": item.nome, "CNPJ": item.cnpj, "PERIODO": item.periodo}
+            if any(marcacao[dim] not in (valor if isinstance(valor, (list, tuple, set)) else [valor])
+                   for dim, valor in filtros_workspace.items()):
+                continue
+            parte = item.documento.cubo_resumo().fatia(registros, por_documento, filtros)
+            if len(parte):
+                partes.append(parte.assign(**marcacao))
+        if not partes:
+            return pd.DataFrame(columns=list(por) + ["QTD"])
+        consolidado = pd.concat(partes, ignore_index=True)
+        medidas = [c for c in consolidado.columns if c not in por_documento and c not in DIMENSOES_WORKSPACE]
+        consolidado[medidas] = consolidado[medidas].fillna(0)
+        return consolidado.groupby(list(por), sort=False)[medidas].sum().reset_index()
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.documento import abrir_documento  # noqa: E402
+from modules.layout import carregar_catalogo, ler_tipos  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def catalogo():
+    return carregar_catalogo()
+
+
+@pytest.fixture(scope="session")
+def tipos():
+    return ler_tipos()
+
+
+@pytest.fixture
+def abrir_sped(tmp_path, catalogo, tipos):
+    """Grava as linhas num .txt temporário e devolve o SpedDocument aberto."""
+    def abrir(linhas, nome="sped.txt"):
+        caminho = tmp_path / nome
+        caminho.write_bytes("\r\n".join(linhas).encode("latin-1") + b"\r\n")
+        documento = abrir_documento(str(caminho), catalogo, tipos)
+        return documento
+    return abrir
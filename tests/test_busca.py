@@ -0,0 +1,61 @@
+import pytest
+
+from modules import documento as modulo_documento
+from modules.alterar import filtrar_por_texto
+
+LINHAS = [
+    "|0000|017|0|01012024|31012024|EMPRESA TESTE LTDA|12345678000195||SP|111222333444|3550308|||A|1|",
+    "|0001|0|",
+    "|0150|P1|CLIENTE SÃO PAULO|01058||||3550308||RUA A|1|||",
+    "|0150|P2|cliente são josé|01058||||3549904||RUA B|2|||",
+    "|0150|P3|CLIENTE SANTOS|01058||||3548500||RUA C|3|||",
+    "|0200|I1|CONTA SINTÉTICA|||UN|00||||||",
+    "|0990|6|",
+    "|9001|0|",
+    "|9990|2|",
+    "|9999|10|",
+]
+
+
+@pytest.fixture(params=["varredura", "indice"])
+def documento(request, abrir_sped, monkeypatch):
+    """O mesmo arquivo buscado varrendo o mmap e pelo índice de trigramas."""
+    documento = abrir_sped(LINHAS)
+    if request.param == "indice":
+        monkeypatch.setattr(modulo_documento, "MIN_LINHAS_INDICE_TEXTO", 1)
+        documento.iniciar_indice_texto().pronto.wait()
+        assert documento.indice_texto() is not None
+    return documento
+
+
+def _registros(documento, linhas):
+    return [documento.hierarquia.registro_da_linha(int(i)) for i in linhas]
+
+
+@pytest.mark.parametrize("termo", ["são", "SÃO", "São"])
+def test_acentos_sem_diferenciar_maiusculas(documento, termo):
+    assert documento.linhas_com_texto(termo).tolist() == [2, 3]
+
+
+def test_acentos_diferenciando_maiusculas(documento):
+    assert documento.linhas_com_texto("SÃO", diferenciar_maiusculas=True).tolist() == [2]
+
+
+def test_regex_com_acentos_e_classes_unicode(documento):
+    assert documento.linhas_com_texto("sintética").tolist() == [5]
+    assert documento.linhas_com_texto(r"s[ãa]o\b", regex=True).tolist() == [2, 3]
+    assert _registros(documento, documento.linhas_com_texto(r"\bJOSÉ\b", regex=True)) == ["0150"]
+
+
+def test_termo_fora_do_latin1_nao_encontra_nada(documento):
+    assert documento.linhas_com_texto("€").tolist() == []
+    assert documento.linhas_com_texto("SÃO|€", regex=True, diferenciar_maiusculas=True).tolist() == [2]
+
+
+@pytest.mark.parametrize("termo, esperadas", [("SÃO", [2]), ("são", [3]), ("CLIENTE", [2, 4]), ("€", [])])
+def test_filtro_geral_do_alterar(documento, termo, esperadas):
+    """Com ou sem o índice de texto, o filtro geral do Alterar dá as mesmas linhas (e não quebra com "€")."""
+    linhas_0150 = documento.linhas_dos_registros(["0150"])
+    indices, linhas_texto = filtrar_por_texto(documento, linhas_0150, termo)
+    assert indices.tolist() == esperadas
+    assert (linhas_texto is None) == (documento.indice_texto() is None)
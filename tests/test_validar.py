@@ -0,0 +1,54 @@
+from modules.validar import REGRA_CAMPOS
+
+# Linhas no formato real do leiaute atual (Guia Prático): C170 com 37 campos e D100 com 24, fora o REG
+C170_REAL = ("|C170|1|000123|PRODUTO TESTE|10,00000|UN|1000,00|0,00|0|000|5102||1000,00|18,00|180,00|0,00|0,00|0,00|0|50|"
+             "|0,00|0,00|0,00|01|1000,00|1,6500|||16,50|01|1000,00|7,6000|||76,00|3.01.01|0,00|")
+D100_REAL = ("|D100|0|1|P001|57|00|1||12345|35240112345678000195570010000123451000012345|15012024|16012024|0|"
+             "|1500,00|0,00|1|1500,00|1500,00|180,00|0,00|||3550308|3304557|")
+
+
+def _sped(*linhas, cod_ver="017"):
+    return [
+        f"|0000|{cod_ver}|0|01012024|31012024|EMPRESA TESTE LTDA|12345678000195||SP|111222333444|3550308|||A|1|",
+        "|0001|0|",
+        "|0990|3|",
+        "|C001|0|",
+        "|C100|0|1|P001|55|00|1|123|35240112345678000195550010000001231000001230|15012024|16012024|1000,00|0|0,00|0,00|1000,00|9|0,00|0,00|0,00|1000,00|180,00|0,00|0,00|0,00|16,50|76,00|0,00|0,00|",
+        *linhas,
+        "|9001|0|",
+        "|9990|2|",
+        "|9999|10|",
+    ]
+
+
+def _problemas_campos(documento):
+    return [p for p in documento.validacao().problemas() if p.regra == REGRA_CAMPOS]
+
+
+def test_linhas_no_formato_real_nao_sao_apontadas(abrir_sped):
+    assert C170_REAL.count("|") - 2 == 37
+    assert D100_REAL.count("|") - 2 == 24
+    documento = abrir_sped(_sped(C170_REAL, C170_REAL.replace("|1|000123|", "|2|000123|", 1), D100_REAL))
+    assert _problemas_campos(documento) == []
+
+
+def test_linha_sem_o_ultimo_campo_e_apontada(abrir_sped):
+    incompleta = C170_REAL[:C170_REAL.rindex("|", 0, -1) + 1] # Sem VL_ABAT_NT
+    documento = abrir_sped(_sped(C170_REAL, incompleta))
+    problemas = _problemas_campos(documento)
+    assert [(p.linha, p.registro) for p in problemas] == [(7, "C170")]
+    assert problemas[0].mensagem == "36 campos na linha; o layout tem 37"
+
+
+def test_versao_anterior_usa_o_layout_da_versao(abrir_sped):
+    # Leiaute 011: C170 ainda sem VL_ABAT_NT e D100 sem COD_MUN_ORIG/COD_MUN_DEST
+    c170 = C170_REAL[:C170_REAL.rindex("|", 0, -1) + 1]
+    d100 = D100_REAL[:D100_REAL.rindex("|", 0, D100_REAL.rindex("|", 0, -1)) + 1]
+    documento = abrir_sped(_sped(c170, d100, cod_ver="011"))
+    assert _problemas_campos(documento) == []
+
+
+def test_registro_nao_conferido_nao_tem_quantidade_de_campos_validada(abrir_sped):
+    # 0450 não foi conferido com o Guia Prático (sped_conferidos.txt): o layout não é usado para contar campos
+    documento = abrir_sped(_sped(C170_REAL, "|0450|1|INFORMACAO|CAMPO A MAIS|"))
+    assert _problemas_campos(documento) == []
@@ -1,105 +1,97 @@
 import streamlit as st
-import os # Pode ser útil para futuras funções de utilidade
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import os
+from pathlib import Path
+from modules.cache_documentos import CacheDocumentos
+from modules.instrumentacao import evento, medir
+from modules.memoria import GerenciadorMemoria
+from modules.layout import ARQUIVO_LAYOUT, ARQUIVO_TIPOS, carregar_catalogo, ler_tipos
+from modules.leitor import ArquivoMapeado, LinhasSped, separar_assinatura
 
 def ler_e_separar_sped(uploaded_file):
-    """Lê o arquivo SPED, separa o corpo da assinatura e retorna ambos."""
+    """Lê o arquivo SPED, separa o corpo da assinatura e retorna ambos.
+
+    O upload é copiado para um arquivo temporário mapeado em memória; o corpo
+    retornado é uma LinhasSped (decodifica cada linha só quando é acessada) e
+    a assinatura é uma lista de strings (poucas linhas).
+    """
     try:
-        conteudo = uploaded_file.read().decode("latin-1")
-        linhas = conteudo.splitlines()
+        linhas = LinhasSped(ArquivoMapeado(uploaded_file))
     except Exception as e:
         st.error(f"Erro ao ler o arquivo: {e}")
         return None, None
 
-    assinatura_idx = None
-    for i, linha in enumerate(linhas):
-        # Procura por um padrão mais genérico de assinatura (início de bloco 9)
-        if linha.startswith("|9") and len(linha.split('|')) > 2 and linha.split('|')[1].startswith('9'):
-             # Verifica se é o último bloco antes do |9999|
-            is_last_block = True
-            for next_line in linhas[i+1:]:
-                if next_line.startswith('|') and not next_line.startswith('|9'):
-                    is_last_block = False
-                    break
-            if is_last_block:
-                 # Considera o início do bloco 9 como separador
-                 assinatura_idx = i
-                 break # Assume que o primeiro bloco 9 encontrado no final é a assinatura
-
-    if assinatura_idx is not None:
-        corpo_sped = linhas[:assinatura_idx]
-        assinatura = linhas[assinatura_idx:]
-        # A mensagem pode ser movida para a interface principal se preferir
-        # st.info(f"Assinatura (a partir da linha {assinatura_idx + 1}) detectada e preservada.")
-    else:
-        corpo_sped = linhas
-        assinatura = []
-        # A mensagem pode ser movida para a interface principal se preferir
-        # st.warning("Assinatura não detectada ou formato não reconhecido. O arquivo será tratado como um todo.")
-
+    corpo_sped, assinatura = separar_assinatura(linhas)
     return corpo_sped, assinatura
 
-def baixar_arquivo(corpo_sped, assinatura, nome_arquivo="sped_processado.txt"):
-    """Gera o botão de download para o arquivo SPED (corpo + assinatura)."""
-    if corpo_sped is None:
+def carregar_documento_sped(uploaded_file):
+    """Monta o SpedDocument da sessão para o arquivo enviado.
+
+    O conteúdo é identificado pelo SHA-256: um arquivo já lido (nesta ou em
+    outra sessão, ou antes de reiniciar o servidor) não é lido de novo; a
+    sessão recebe um documento próprio sobre o já lido (ver CacheDocumentos).
+    Retorna None se a leitura falhar.
+    """
+    try:
+        with medir("documento.abrir", bytes=getattr(uploaded_file, "size", None)):
+            return obter_cache_documentos().abrir(uploaded_file, load_sped_layout(), load_sped_tipos())
+    except Exception as e:
+        st.error(f"Erro ao ler o arquivo: {e}")
+        return None
+
+def sincronizar_workspace(workspace, uploaded_files):
+    """Carrega na área de trabalho os arquivos enviados (em paralelo), mantendo os já lidos.
+
+    Mostra um erro para cada arquivo que não pôde ser lido.
+    """
+    with medir("documento.abrir", documentos=len(uploaded_files)):
+        erros = workspace.sincronizar(uploaded_files, load_sped_layout(), load_sped_tipos(), abrir=obter_cache_documentos().abrir)
+    for nome, erro in erros.items():
+        st.error(f"Erro ao ler o arquivo {nome}: {erro}")
+    return workspace
+
+def baixar_arquivo(documento, nome_arquivo="sped_processado.txt", key=None):
+    """Gera o botão de download para o arquivo SPED (corpo + assinatura).
+
+    O conteúdo só é montado quando o usuário clica no botão (callable em
+    `data`): o arquivo é gravado em blocos num temporário, reaproveitado
+    enquanto a versão do documento não mudar, e lido inteiro para a resposta.
+    Nos reruns comuns o custo é praticamente zero.
+    """
+    if documento is None:
         st.warning("Não há dados para baixar.")
         return
 
-    novo_conteudo = "\n".join(corpo_sped + assinatura)
+    validacao = documento.validacao_atual()
+    if validacao is not None and len(validacao):
+        st.warning(f"A validação estrutural encontrou {len(validacao)} problema(s); o PVA pode rejeitar o arquivo.")
+
     st.download_button(
         label="💾 Baixar Arquivo Processado",
-        data=novo_conteudo.encode("latin-1"),
+        data=lambda: Path(documento.caminho_download()).read_bytes(),
         file_name=nome_arquivo,
-        mime="text/plain"
+        mime="text/plain",
+        key=key
     )
 
 # Adicionar mais funções utilitárias aqui no futuro
 # Ex: função para validar formato de linha SPED, etc.
 
-@st.cache_data # Cache para evitar ler o arquivo descritivo toda hora
-def load_sped_layout(file_path="sped_descricao/sped_descritivo.txt"):
-    """ Lê o arquivo descritivo do layout SPED e retorna um dicionário
-        mapeando REGISTRO -> {NOME_CAMPO: indice_base_1}.
+@st.cache_resource # Compartilhado entre sessões: o catálogo é somente leitura
+def load_sped_layout(file_path=ARQUIVO_LAYOUT):
+    """ Carrega o catálogo de layouts SPED (CatalogoLayouts) a partir do cache
+        compilado, recompilando as fontes de sped_descricao só quando mudarem.
+        Cada documento usa o layout da versão do seu 0000.COD_VER.
     """
-    layout = {}
-    print(f"[DEBUG] Tentando carregar layout de: {file_path}") # Log inicial
     try:
-        with open(file_path, 'r', encoding='utf-8') as f: # Usar utf-8 por segurança
-            for line_num, line in enumerate(f):
-                line = line.strip()
-                if not line or not line.startswith('|'):
-                    continue
-
-                try:
-                    parts = line.split('|')
-                    # Esperado: ['', REGISTRO, CAMPO1, CAMPO2, ..., '', '']
-                    if len(parts) < 4:
-                        print(f"[DEBUG] Layout: Linha {line_num+1} ignorada (formato inválido - poucas partes): {line[:50]}...")
-                        continue
-
-                    registro = parts[1]
-                    # Os campos estão de parts[2] até parts[-3] ? Verificar o último `|`
-                    # Se a linha termina com ||, parts[-1] e parts[-2] serão vazios.
-                    campos = parts[2:-2] # Correto se termina com ||
-
-                    if not registro: # Ignora se o registro for vazio
-                        print(f"[DEBUG] Layout: Linha {line_num+1} ignorada (registro vazio): {line[:50]}...")
-                        continue
-
-                    layout[registro] = {}
-                    for i, nome_campo in enumerate(campos):
-                        if nome_campo: # Ignora campos vazios no descritivo
-                            layout[registro][nome_campo] = i + 2 # Índice baseado em 1 (posição após split)
-                    # print(f"[DEBUG] Layout: Registro {registro} carregado com {len(campos)} campos.") # Log por registro (pode ser muito)
-                except Exception as inner_e:
-                     print(f"[DEBUG] Layout: Erro processando linha {line_num+1}: {line[:50]}... Erro: {inner_e}")
-                     continue # Pula para próxima linha
-
-        if not layout:
+        with medir("layout.carregar") as etapa:
+            catalogo = carregar_catalogo(file_path)
+            etapa.anotar(registros=len(catalogo))
+        if not len(catalogo):
             st.error(f"Nenhum layout válido carregado de {file_path}. Verifique o arquivo.")
-            print(f"[DEBUG] Nenhum layout carregado de {file_path}")
             return None
-        print(f"[DEBUG] Layout SPED carregado com {len(layout)} registros.")
-        return layout
+        evento("Layout SPED carregado", registros=len(catalogo), versoes=",".join(catalogo.versoes()) or "nenhuma")
+        return catalogo
 
     except FileNotFoundError:
         st.error(f"Arquivo descritivo do layout SPED não encontrado em: {file_path}")
@@ -107,5 +99,50 @@ def load_sped_layout(file_path="sped_descricao/sped_descritivo.txt"):
     except Exception as e:
         st.error(f"Erro ao ler o arquivo descritivo do layout SPED ({file_path}): {e}")
 
-        return None 
+        return None
 
+
+@st.cache_resource # Um cache para todas as sessões do servidor
+def obter_cache_documentos():
+    """Cache de documentos já lidos, por conteúdo (memória e disco, com LRU)."""
+    return CacheDocumentos()
+
+
+@st.cache_resource # Um orçamento de memória para todas as sessões do servidor
+def obter_gerenciador_memoria():
+    """Contabilidade de memória das sessões, com despejo dos registros menos usados (ver GerenciadorMemoria)."""
+    return GerenciadorMemoria()
+
+
+def id_sessao():
+    """Identificador da sessão atual do Streamlit (None fora de uma execução do app)."""
+    contexto = get_script_run_ctx()
+    return contexto.session_id if contexto is not None else None
+
+
+def modo_administrador():
+    """Painéis de administração do servidor (memória de todas as sessões) só com PAINEL_SPED_ADMIN=1."""
+    return os.environ.get("PAINEL_SPED_ADMIN") == "1"
+
+
+def conferir_memoria(documentos):
+    """Registra os documentos da sessão no orçamento de memória e despeja registros frios se ele estourou."""
+    gerenciador = obter_gerenciador_memoria()
+    sessao = id_sessao()
+    gerenciador.registrar(sessao, documentos)
+    gerenciador.conferir(sessao)
+
+
+@st.cache_data
+def load_sped_tipos(file_path=ARQUIVO_TIPOS):
+    """ Lê o arquivo com o tipo de cada campo do layout e retorna um dicionário
+        mapeando REGISTRO -> {NOME_CAMPO: TipoCampo(tipo, tamanho, decimais)}.
+    """
+    try:
+        with medir("layout.tipos"):
+            tipos = ler_tipos(file_path)
+        evento("Tipos de campo carregados", registros=len(tipos))
+        return tipos
+    except FileNotFoundError:
+        st.warning(f"Arquivo de tipos de campo não encontrado em: {file_path}. Todos os campos serão tratados como texto.")
+        return {}